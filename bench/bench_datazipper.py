@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""
+Time and peak memory of DataZipper.deliver on test/biggerTestData.json, against the one-shot
+pipeline it replaced, both for a result that is zipped and one that goes to S3 (which is not
+actually written to here), what each registered codec makes of it, and how AdaptiveCompression
+does against the default level as the limit shrinks.
+
+    python -m bench.bench_datazipper
+"""
+import base64
+import hashlib
+import timeit
+import tracemalloc
+import zlib
+from protocol.datazipper import AdaptiveCompression, DataZipper, to_unicode
+
+
+class _DroppedS3(object):
+    """ Takes puts and forgets them, so the benchmark measures DataZipper and not the network """
+    def Object(self, bucket, key):
+        return self
+
+    def put(self, Body=None):
+        pass
+
+
+def one_shot(data, limit):
+    """ deliver as it was: encode, compress, base64, decode, join, then encode again to hash """
+    if len(data) < limit:
+        return data
+    the_bytes = to_unicode(data)
+    zipped = zlib.compress(the_bytes.encode('utf-8'))
+    zipped = ":".join(("FF-ZIP", str(len(the_bytes)), to_unicode(base64.b64encode(zipped))))
+    if len(zipped) <= limit:
+        return zipped
+    result_bytes = to_unicode(zipped).encode('utf-8')
+    md5_hash = hashlib.md5(result_bytes).hexdigest()
+    DataZipper.s3.Object(DataZipper.bucket, md5_hash).put(Body=result_bytes)
+    return md5_hash
+
+
+def measure(deliver, data, limit):
+    tracemalloc.start()
+    deliver(data, limit)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = min(timeit.repeat(lambda: deliver(data, limit), number=10, repeat=3)) / 10
+    return seconds, peak
+
+
+def main():
+    DataZipper.s3 = _DroppedS3()
+    with open('test/biggerTestData.json', 'r') as f:
+        data = f.read()
+    compressed = len(zlib.compress(data.encode('utf-8')))
+    print("{} characters, {} bytes compressed, {} as base64".format(len(data), compressed, (compressed + 2) // 3 * 4))
+    for name, limit in (("zipped", 200000), ("to S3", 30000)):
+        for label, deliver in (("one shot", one_shot), ("streamed", DataZipper.deliver)):
+            seconds, peak = measure(deliver, data, limit)
+            print("{:7} {:9} {:7.2f} ms  peak {:8.1f} KB".format(name, label, seconds * 1000, peak / 1024))
+    for magick in sorted(DataZipper.codecs):
+        zipped = DataZipper._zip_data(data, 0, magick)
+        deliver = min(timeit.repeat(lambda: DataZipper._zip_data(data, 0, magick), number=5, repeat=3)) / 5
+        receive = min(timeit.repeat(lambda: DataZipper.receive(zipped), number=5, repeat=3)) / 5
+        print("{:8} {:7} characters  deliver {:6.2f} ms  receive {:6.2f} ms".format(
+            magick, len(zipped), deliver * 1000, receive * 1000))
+
+    for limit in (200000, 122000, 120000, 60000):
+        paths = []
+        strategy = AdaptiveCompression(metrics=paths.append)
+        default = min(timeit.repeat(lambda: DataZipper.deliver(data, limit), number=5, repeat=3)) / 5
+        adaptive = min(timeit.repeat(lambda: DataZipper.deliver(data, limit, strategy=strategy), number=5, repeat=3)) / 5
+        print("limit {:6}  default {:6.2f} ms  adaptive {:6.2f} ms ({})".format(limit, default * 1000, adaptive * 1000, paths[-1]))
+
+
+if __name__ == '__main__':
+    main()
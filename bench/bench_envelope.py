@@ -0,0 +1,55 @@
+#!/usr/bin/python
+"""
+How many more results stay under ActivityResponse.SWF_LIMIT in the FF-B85 envelope than in
+FF-ZIP's base64, and what it costs. The results are the leading 32 KB, 33 KB, ... of
+test/bigTestData.json and test/biggerTestData.json, so every one would need compressing.
+
+    python -m bench.bench_envelope
+"""
+import time
+from protocol.datazipper import DataZipper
+from protocol.response import ActivityResponse
+
+
+class _DroppedS3(object):
+    """ Takes puts and forgets them, so spills cost nothing here """
+    def Object(self, bucket, key):
+        return self
+
+    def put(self, Body=None):
+        pass
+
+
+def corpus():
+    for name in ('test/bigTestData.json', 'test/biggerTestData.json'):
+        with open(name, 'r') as f:
+            data = f.read()
+        for length in range(ActivityResponse.SWF_LIMIT, len(data) + 1, 1000):
+            yield data[:length]
+
+
+def main():
+    DataZipper.s3 = _DroppedS3()
+    DataZipper.stored_size = 0
+    results = list(corpus())
+    limit = ActivityResponse.SWF_LIMIT
+    print("{} results over {} characters".format(len(results), limit))
+    for label, codec, dense in (("FF-ZIP", "FF-ZIP", {}), ("FF-B85", "FF-B85", {}),
+                                ("FF-ZIP, dense", "FF-ZIP", {"FF-ZIP": "FF-B85"})):
+        DataZipper.dense = dense
+        started = time.perf_counter()
+        delivered = [DataZipper.deliver(result, limit, codec=codec) for result in results]
+        seconds = time.perf_counter() - started
+        inline = sum(not d.startswith(DataZipper.magick_url) for d in delivered)
+        started = time.perf_counter()
+        for d in delivered:
+            if not d.startswith(DataZipper.magick_url):
+                DataZipper.receive(d)
+        received = time.perf_counter() - started
+        print("{:14} {:4} inline  deliver {:7.1f} ms  receive inline {:6.1f} ms".format(
+            label, inline, seconds * 1000, received * 1000))
+    DataZipper.dense = {}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+"""
+Per-task cost of turning an event into handler kwargs for a 40-parameter function, with
+parse_event and with the InvocationPlan a FulfillmentFunction builds once.
+
+    python -m bench.bench_invocation
+"""
+import timeit
+from protocol.schema import *
+from protocol.fulfillment_parser import InvocationPlan, parse_event
+
+PARAMETERS = {}
+for i in range(10):
+    PARAMETERS["campaignName{}".format(i)] = StringParameter("Name", required=False, default="Spring sale")
+    PARAMETERS["maxDailyBudget{}".format(i)] = FloatParameter("Budget", required=False, default=25.0)
+    PARAMETERS["targetChannel{}".format(i)] = EnumParameter("Channel", options=["search", "social"],
+                                                            required=False, default="search")
+    PARAMETERS["locationId{}".format(i)] = UuidParameter("Location id")
+
+# every required parameter and half of the others are in the event
+EVENT = {}
+for i, name in enumerate(sorted(PARAMETERS)):
+    if PARAMETERS[name].is_required():
+        EVENT[name] = "02ef139a-417a-4328-9953-5996b9f36dae"
+    elif i % 2:
+        EVENT[name] = PARAMETERS[name].default
+
+
+def main():
+    plan = InvocationPlan(PARAMETERS)
+    assert plan(EVENT) == parse_event(EVENT, PARAMETERS)
+
+    number = 2000
+    before = min(timeit.repeat(lambda: parse_event(EVENT, PARAMETERS), number=number, repeat=5)) / number
+    after = min(timeit.repeat(lambda: plan(EVENT), number=number, repeat=5)) / number
+    print("{} parameters, {} in the event".format(len(PARAMETERS), len(EVENT)))
+    print("parse_event     {:8.1f} us".format(before * 1e6))
+    print("InvocationPlan  {:8.1f} us".format(after * 1e6))
+    print("speedup         {:8.1f}x".format(before / after))
+
+
+if __name__ == '__main__':
+    main()
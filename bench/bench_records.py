@@ -0,0 +1,45 @@
+#!/usr/bin/python
+"""
+Memory and iteration speed of 200k parsed records, as dicts and as the Record instances an
+ObjectParameter with output="record" parses into.
+
+    python -m bench.bench_records
+"""
+import gc
+import timeit
+import tracemalloc
+from protocol.schema import *
+
+
+def element(output):
+    return ObjectParameter("A location", output=output, properties={
+        "locationId": IntParameter("Location id"),
+        "name": StringParameter("Location name"),
+        "budget": FloatParameter("Budget"),
+        "channel": EnumParameter("Channel", options=["search", "display", "social"], required=False)
+    })
+
+
+def main():
+    raw = [{"locationId": i, "name": "Location {}".format(i), "budget": 1.5 * i, "channel": "search"}
+           for i in range(200000)]
+    print("{} records".format(len(raw)))
+    for output in ("dict", "record"):
+        param = ArrayParameter("Locations", element(output))
+        gc.collect()
+        tracemalloc.start()
+        parsed = param.parse(raw)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        parse = min(timeit.repeat(lambda: param.parse(raw), number=1, repeat=3))
+        if output == "dict":
+            read = min(timeit.repeat(lambda: sum(r["budget"] for r in parsed), number=5, repeat=3)) / 5
+        else:
+            read = min(timeit.repeat(lambda: sum(r.budget for r in parsed), number=5, repeat=3)) / 5
+        print("{:7} {:8.1f} MB  parse {:7.1f} ms  read one field {:6.1f} ms".format(
+            output, size / 1e6, parse * 1000, read * 1000))
+        del parsed
+
+
+if __name__ == '__main__':
+    main()
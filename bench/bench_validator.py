@@ -0,0 +1,64 @@
+#!/usr/bin/python
+"""
+Compares the compiled validator against Draft4Validator on a large nested payload, and times
+the error budgets on a broken one.
+
+    python -m bench.bench_validator
+"""
+import json
+import timeit
+from jsonschema import Draft4Validator
+from protocol.schema import *
+from protocol.schema_compiler import CompiledValidator
+from protocol.param_validator import ParamValidator
+
+LOCATION = ObjectParameter("A location", properties={
+    "locationId": UuidParameter("Location id"),
+    "locationKey": StringParameter("Location key", min_length=1),
+    "brandUrl": UriParameter("Brand url", required=False),
+    "name": StringParameter("Location name")
+})
+
+PARAMETERS = {
+    "locations": ArrayParameter("Locations", element=LOCATION, min_items=1),
+    "budget": FloatParameter("Budget", minimum=1),
+    "channel": EnumParameter("Channel", options=["search", "display", "social"])
+}
+
+
+def main():
+    with open('test/bigTestData.json', 'r') as f:
+        event = {
+            "locations": json.load(f),
+            "budget": 1500.0,
+            "channel": "search"
+        }
+
+    schema = ObjectParameter("", properties=PARAMETERS).to_schema(True)
+    draft4 = Draft4Validator(schema)
+    compiled = CompiledValidator(schema)
+    assert draft4.is_valid(event) and compiled.is_valid(event)
+
+    number = 20
+    slow = min(timeit.repeat(lambda: list(draft4.iter_errors(event)), number=number, repeat=3)) / number
+    fast = min(timeit.repeat(lambda: list(compiled.iter_errors(event)), number=number, repeat=3)) / number
+    print("{} locations".format(len(event["locations"])))
+    print("Draft4Validator    {:8.3f} ms".format(slow * 1000))
+    print("CompiledValidator  {:8.3f} ms".format(fast * 1000))
+    print("speedup            {:8.1f}x".format(slow / fast))
+
+    # a badly broken input, and how much of describing its errors the budgets save
+    rows = {"rows": ArrayParameter("Rows", ObjectParameter("Row", properties={
+        "id": IntParameter("Id", minimum=1),
+        "name": StringParameter("Name")
+    }))}
+    broken = {"rows": [{"id": 0} for _ in range(50000)]}
+    print("{} rows, {} errors".format(len(broken["rows"]), len(ParamValidator(rows).validate(broken))))
+    for label, budget in (("every error", {}), ("max_errors=100", {'max_errors': 100}), ("fail_fast", {'fail_fast': True})):
+        validator = ParamValidator(rows, **budget)
+        seconds = min(timeit.repeat(lambda: validator.validate(broken), number=1, repeat=3))
+        print("{:18} {:8.3f} ms".format(label, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Keeps compiled validators on disk, so a new process loads them instead of generating and compiling
+the validator code again. Artifacts are keyed on the schema, the schema compiler and the python
+version, so an artifact is never used for anything but the exact validator it was written for.
+
+Pre-generate the artifacts of a function module while building the deployment package:
+
+    python -m protocol.artifact_cache my_function_module path/to/artifacts
+
+and pass artifact_cache=ArtifactCache("path/to/artifacts", "/tmp/fulfillment-artifacts") to the
+FulfillmentFunction or FulfillmentWorker. Validators that aren't found are compiled as usual and
+written to the first directory that can be written to.
+"""
+import hashlib
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+from . import schema_compiler
+from .schema_compiler import CompiledValidator
+from .trusted_files import trusted
+from .fulfillment_function import FulfillmentFunction
+from .fulfillment_worker import FulfillmentWorker
+
+_compiler_digest = None
+
+
+def _compiler():
+    """ Identifies the schema compiler, so a changed compiler never loads an old artifact """
+    global _compiler_digest
+    if _compiler_digest is None:
+        with open(schema_compiler.__file__, 'rb') as f:
+            _compiler_digest = hashlib.sha256(f.read()).hexdigest()
+    return _compiler_digest
+
+
+class ArtifactCache(object):
+    def __init__(self, *directories):
+        if not directories:
+            directories = (os.path.join(tempfile.gettempdir(), 'fulfillment-artifacts'),)
+        self.directories = directories
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, schema):
+        key = json.dumps([_compiler(), sys.implementation.cache_tag, schema], default=repr)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _name(self, schema):
+        return "{}.artifact".format(self.fingerprint(schema))
+
+    def load(self, schema):
+        """ The stored validator for schema, or None """
+        name = self._name(schema)
+        for directory in self.directories:
+            path = os.path.join(directory, name)
+            try:
+                # artifacts are pickles
+                if not (trusted(directory) and trusted(path)):
+                    continue
+                with open(path, 'rb') as f:
+                    artifact = f.read()
+                return CompiledValidator.from_artifact(schema, artifact)
+            except Exception:
+                # missing, unreadable or truncated; another directory or the compiler will do
+                continue
+        return None
+
+    def store(self, validator):
+        """ Writes the validator to the first writable directory, returns the path or None """
+        artifact = validator.to_artifact()
+        name = self._name(validator.schema)
+        for directory in self.directories:
+            try:
+                os.makedirs(directory, mode=0o755, exist_ok=True)
+                fd, partial = tempfile.mkstemp(dir=directory)
+            except OSError:
+                continue
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(artifact)
+                os.chmod(partial, 0o644)
+                path = os.path.join(directory, name)
+                os.replace(partial, path)
+                return path
+            except OSError:
+                os.unlink(partial)
+        return None
+
+    def compiled_validator(self, schema):
+        """ Loads the validator for schema, compiling and storing it if there isn't one """
+        validator = self.load(schema)
+        if validator is not None:
+            self.hits += 1
+            return validator
+        self.misses += 1
+        validator = CompiledValidator(schema)
+        self.store(validator)
+        return validator
+
+
+def main(argv=None):
+    """ Stores the validators of every FulfillmentFunction and FulfillmentWorker in a module """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: python -m protocol.artifact_cache <function module> <artifact directory>")
+        return 2
+    module = importlib.import_module(argv[0])
+    cache = ArtifactCache(argv[1])
+    stored = 0
+    for name, value in sorted(vars(module).items()):
+        if isinstance(value, (FulfillmentFunction, FulfillmentWorker)):
+            paths = [value._input.validator.save_artifact(cache)]
+            if value._input.stream is not None:
+                paths += value._input.stream.save_artifacts(cache)
+            if None in paths:
+                raise Exception("Could not write the artifact for {} to {}".format(name, argv[1]))
+            for path in paths:
+                print("{}: {}".format(name, path))
+            stored += 1
+    if not stored:
+        print("No FulfillmentFunction or FulfillmentWorker found in {}".format(argv[0]))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
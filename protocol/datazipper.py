@@ -1,9 +1,22 @@
 
 import zlib
+import lzma
+import codecs
+import asyncio
 import hashlib
+import functools
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
 import base64
+import binascii
+import io
 import boto3
+from boto3.s3.transfer import TransferConfig
 import os
+import itertools
+import tempfile
 from .config import Config
 
 
@@ -15,65 +28,623 @@ def to_unicode(data):
     return data
 
 
+class Base64Envelope(object):
+    """ How compressed bytes are written as text: 4 characters for every 3 bytes """
+    group = 3
+    characters = 4
+
+    def encode(self, data):
+        return binascii.b2a_base64(data, newline=False)
+
+    def decode(self, text):
+        return base64.b64decode(text)
+
+    def length(self, size):
+        return (size + 2) // 3 * 4
+
+
+class Base85Envelope(object):
+    """
+    5 characters for every 4 bytes, with RFC 1924's alphabet (python's b85), which has no quote or
+    backslash, so it goes in JSON strings as it is. Three times slower than zlib to write, though.
+    """
+    group = 4
+    characters = 5
+
+    def encode(self, data):
+        return base64.b85encode(data)
+
+    def decode(self, text):
+        return base64.b85decode(text)
+
+    def length(self, size):
+        return size // 4 * 5 + (size % 4 + 1 if size % 4 else 0)
+
+
+BASE64 = Base64Envelope()
+BASE85 = Base85Envelope()
+
+
+class Codec(object):
+    """
+    A compression format for DataZipper, named by the magick its payloads start with.
+    compressor(level) makes an object with compress(data) and flush(), the codec's default level
+    for None, and inflate(chunks, chunk_size) yields the decompressed bytes of an iterable of
+    compressed chunks, a piece at a time. fast_level and best_level are for AdaptiveCompression.
+    envelope writes the compressed bytes as text; the same compression in another envelope is
+    another codec, with its own magick.
+    """
+    magick = None
+    envelope = BASE64
+    fast_level = None
+    best_level = None
+
+    def __init__(self, magick=None, envelope=None):
+        if magick is not None:
+            self.magick = magick
+        if envelope is not None:
+            self.envelope = envelope
+
+    def compressor(self, level=None):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        return b''.join(self.inflate([data], 1 << 16))
+
+    def inflate(self, chunks, chunk_size):
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    magick = "FF-ZIP"
+    fast_level = 1
+    best_level = 9
+
+    def compressor(self, level=None):
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+    def inflate(self, chunks, chunk_size):
+        # no chunk inflates to more than chunk_size
+        decompressor = zlib.decompressobj()
+        for pending in chunks:
+            while pending or decompressor.unconsumed_tail:
+                yield decompressor.decompress(decompressor.unconsumed_tail + pending, chunk_size)
+                pending = b''
+        yield decompressor.flush()
+
+
+class LzmaCodec(Codec):
+    magick = "FF-LZMA"
+    fast_level = 0
+    # presets over 6 need hundreds of MB to compress
+    best_level = 6
+
+    def compressor(self, level=None):
+        return lzma.LZMACompressor(preset=level)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+    def inflate(self, chunks, chunk_size):
+        decompressor = lzma.LZMADecompressor()
+        for pending in chunks:
+            while pending or not (decompressor.needs_input or decompressor.eof):
+                yield decompressor.decompress(pending, chunk_size)
+                pending = b''
+
+
+class ZstdCodec(Codec):
+    """ Needs the zstandard module, and is only registered when it's installed """
+    magick = "FF-ZSTD"
+    fast_level = 1
+    best_level = 19
+
+    def __init__(self, zstandard, magick=None, envelope=None):
+        Codec.__init__(self, magick, envelope)
+        self.zstandard = zstandard
+
+    def compressor(self, level=None):
+        return self.zstandard.ZstdCompressor(**({} if level is None else {'level': level})).compressobj()
+
+    def inflate(self, chunks, chunk_size):
+        # write_size keeps every piece to chunk_size
+        return self.zstandard.ZstdDecompressor().read_to_iter(_ChunkReader(chunks), write_size=chunk_size)
+
+
+class AdaptiveCompression(object):
+    """
+    How hard DataZipper.deliver works to keep a result off S3. A few slices of the text are
+    compressed first to estimate the whole; when even the best level clearly can't fit, the text
+    goes to S3 uncompressed ('skipped'). Otherwise it's compressed at the codec's fast level
+    ('fast'), and again at its best level when that lands within `escalate` of the limit ('best').
+    A result still over the limit is put on S3 compressed ('spilled').
+
+    metrics is called with the path taken for every result delivered, as counts keeps them.
+    """
+    PATHS = ('fast', 'best', 'spilled', 'skipped')
+
+    def __init__(self, sample_size=1 << 15, samples=4, hopeless=1.5, escalate=1.25, metrics=None):
+        self.sample_size = sample_size
+        self.samples = samples
+        self.hopeless = hopeless
+        self.escalate = escalate
+        self._metrics = metrics
+        self.counts = dict.fromkeys(self.PATHS, 0)
+
+    def count(self, name):
+        self.counts[name] += 1
+        if self._metrics is not None:
+            self._metrics(name)
+
+    def estimate(self, the_text, codec):
+        """ About how many characters the text compresses to at the fast level, None if it's short enough to just try """
+        if len(the_text) <= self.sample_size * 2:
+            return None
+        step = len(the_text) // self.samples
+        width = self.sample_size // self.samples
+        sample = ''.join(the_text[start:start + width] for start in range(0, step * self.samples, step)).encode('utf-8')
+        compressor = codec.compressor(codec.fast_level)
+        compressed = len(compressor.compress(sample)) + len(compressor.flush())
+        # encoded size of the whole from the sample's characters
+        return codec.envelope.length(compressed * len(the_text) // (width * self.samples))
+
+    def skip(self, the_text, limit, codec):
+        estimate = self.estimate(the_text, codec)
+        return estimate is not None and estimate > limit * self.hopeless
+
+    def retry(self, size, limit):
+        return limit < size <= limit * self.escalate
+
+
+class _BufferReader(io.RawIOBase):
+    """ A file reading a bytes-like object in place, where BytesIO would copy a bytearray """
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._position))
+        b[:n] = self._view[self._position:self._position + n]
+        self._position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class _ChunkReader(io.RawIOBase):
+    """ A file reading an iterable of bytes chunks in order """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._pending):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
 class DataZipper(object):
 
     s3 = boto3.resource('s3')
     bucket = Config.zipper_bucket
     path = '/'.join(Config.zipper_path.split('/')[1:])
-    magick_zip = "FF-ZIP"
+    magick_zip = ZlibCodec.magick
     magick_url = "FF-URL"
     separator = ":"
+    # an AdaptiveCompression for deliver to use when it isn't given one, None to always use the default level
+    strategy = None
+    # the hash S3 keys are named by. Keys by any but md5 say which hash made them ("blake2b-...")
+    # so no two hashes share a key; receivers only follow the FF-URL's path, so old ones still resolve
+    digests = {"md5": hashlib.md5, "blake2b": functools.partial(hashlib.blake2b, digest_size=16)}
+    digest = "md5"
+    # keys put on S3 recently, so the same result spilled again isn't uploaded again. Entries are
+    # trusted for stored_for seconds, well inside the bucket's expiry. check_existing asks S3 about
+    # keys that aren't in the index, to skip uploads other processes already made
+    stored = OrderedDict()
+    stored_size = 1024
+    stored_for = 24 * 60 * 60
+    check_existing = False
+    _stored_lock = threading.Lock()
+    store_counts = {'uploaded': 0, 'indexed': 0, 'existing': 0}
+    # bodies of transfer_threshold bytes or more are uploaded through s3transfer, part_size at a time
+    # with concurrency parts in flight. parallel_downloads downloads FF-URLs the same way, in ranges,
+    # which costs a HEAD for every download however small
+    transfer_threshold = 8 << 20
+    part_size = 8 << 20
+    concurrency = 10
+    parallel_downloads = False
+    # for deliver_async and receive_async: the concurrent.futures executor compression runs on, and
+    # the one S3 calls run on unless async_s3 is an asyncio S3 client (aiobotocore's, say). None is
+    # the event loop's default executor
+    executor = None
+    s3_executor = None
+    async_s3 = None
+    # a PayloadCache for the FF-URL payloads receive downloads, None to download them every time
+    payload_cache = None
+    # every codec receive understands, by magick. Receivers must know a codec before senders use it
+    codecs = {}
+    # payloads too big for the limit are written again in the codec named here for theirs, when
+    # that makes them fit, before they're spilled. Receivers must know those codecs first too
+    dense = {}
+    # the magick deliver compresses with, or a sequence of them to use the first registered one
+    codec = getattr(Config, "zipper_codec", "FF-ZIP")
+    # the magick, separator, a 10 digit length and separator all fit in this many characters
+    header_room = 24
+
+    @classmethod
+    def register(cls, codec):
+        cls.codecs[codec.magick] = codec
+
+    @classmethod
+    def _choose_codec(cls, preference):
+        if isinstance(preference, Codec):
+            return preference
+        for magick in ((preference,) if isinstance(preference, str) else preference):
+            if magick in cls.codecs:
+                return cls.codecs[magick]
+        raise Exception("No registered DataZipper codec in {}".format(preference))
+
+    @classmethod
+    def _codec_for(cls, head):
+        return cls.codecs.get(head[:cls.header_room].split(cls.separator, 1)[0])
 
     @classmethod
     def _make_key(cls, filename):
         return os.path.join(cls.path, filename)
 
     @classmethod
-    def deliver(cls, data, limit):
+    def deliver(cls, data, limit, codec=None, strategy=None):
+        """
+        data as is if it's under limit, else compressed with the first registered codec in codec
+        (a magick or a sequence of them, DataZipper.codec by default), or on S3 if even that's too big.
+        strategy is an AdaptiveCompression, DataZipper.strategy by default.
+        """
+        if len(data) < limit:
+            return data
+
+        delivered, digest = cls._pack(to_unicode(data), limit, codec, strategy)
+        if digest is None:
+            return delivered
+        return cls._put_in_s3(delivered, digest)
+
+    @classmethod
+    async def deliver_async(cls, data, limit, codec=None, strategy=None):
+        """
+        deliver for event loops. Compression runs on DataZipper.executor, and S3 on async_s3 or,
+        without one, on s3_executor.
+        """
         if len(data) < limit:
             return data
 
-        zipped = cls._zip_data(data, limit)
+        loop = asyncio.get_running_loop()
+        delivered, digest = await loop.run_in_executor(cls.executor, cls._pack, to_unicode(data), limit, codec, strategy)
+        if digest is None:
+            return delivered
+        if cls.async_s3 is None:
+            return await loop.run_in_executor(cls.s3_executor, cls._put_in_s3, delivered, digest)
+
+        s3_key = cls._make_key(digest + ".ff")
+        if not await cls._already_stored_async(s3_key):
+            await cls.async_s3.put_object(Bucket=cls.bucket, Key=s3_key, Body=delivered)
+            cls.store_counts['uploaded'] += 1
+            cls._remember(s3_key)
+        return cls._ff_url(digest, s3_key)
+
+    @classmethod
+    def _pack(cls, the_text, limit, codec=None, strategy=None):
+        """ What deliver sends for text over the limit: (the text, None) or (a body for S3, its digest) """
+        strategy = strategy or cls.strategy
+        if strategy is not None:
+            return cls._pack_adaptive(the_text, limit, cls._choose_codec(codec or cls.codec), strategy)
+        codec = cls._choose_codec(codec or cls.codec)
+        zipped, digest = cls._zip_stream(the_text, codec=codec)
 
         if len(zipped) > limit:
-            # Even zipped it was too big! Let's stick it on S3.
-            return cls._store_in_s3(zipped)
+            # Even zipped it was too big! Unless it fits more densely, let's stick it on S3.
+            return cls._denser(zipped, digest, limit, codec)
         else:
-            return zipped
+            return zipped.decode('ascii'), None
+
+    @classmethod
+    def _pack_adaptive(cls, the_text, limit, codec, strategy):
+        if strategy.skip(the_text, limit, codec):
+            strategy.count('skipped')
+            body = the_text.encode('utf-8')
+            return body, cls._digest_id(cls._hasher(body))
+
+        path = 'fast'
+        zipped, digest = cls._zip_stream(the_text, codec=codec, level=codec.fast_level)
+        if strategy.retry(len(zipped), limit):
+            path = 'best'
+            zipped, digest = cls._zip_stream(the_text, codec=codec, level=codec.best_level)
+
+        if len(zipped) <= limit:
+            strategy.count(path)
+            return zipped.decode('ascii'), None
+        delivered, digest = cls._denser(zipped, digest, limit, codec)
+        strategy.count(path if digest is None else 'spilled')
+        return delivered, digest
 
     @classmethod
-    def _zip_data(cls, data, limit):
-        the_bytes = to_unicode(data)
-        zipped = zlib.compress(the_bytes.encode('utf-8'))
+    def _zip_stream(cls, the_text, chunk_size=1 << 16, codec=None, level=None):
+        """
+        The compressed form of the text as ascii bytes, and their digest. The text is encoded, compressed,
+        put in the codec's envelope and hashed a chunk at a time straight into the output, so the
+        only full size copy is the output itself.
+        """
+        codec = cls._choose_codec(codec or cls.codec)
+        zipped = bytearray(cls.separator.join((codec.magick, str(len(the_text)), '')).encode('ascii'))
+        digest = cls._hasher(zipped)
+        compressor = codec.compressor(level)
+        envelope = codec.envelope
+        carry = b''
+
+        def encode(compressed, final=False):
+            # envelopes write groups of bytes, so all but the last chunk go in whole groups
+            nonlocal carry
+            pending = carry + compressed if carry else compressed
+            usable = len(pending) if final else len(pending) - len(pending) % envelope.group
+            carry = pending[usable:]
+            encoded = envelope.encode(pending[:usable])
+            digest.update(encoded)
+            zipped.extend(encoded)
 
-        return cls.separator.join((cls.magick_zip, str(len(the_bytes)), to_unicode(base64.b64encode(zipped))))
+        for start in range(0, len(the_text), chunk_size):
+            compressed = compressor.compress(the_text[start:start + chunk_size].encode('utf-8'))
+            if compressed:
+                encode(compressed)
+        encode(compressor.flush(), final=True)
+        return zipped, cls._digest_id(digest)
+
+    @classmethod
+    def _zip_data(cls, data, limit, codec=None):
+        return cls._zip_stream(to_unicode(data), codec=codec)[0].decode('ascii')
 
     @classmethod
     def _store_in_s3(cls, data):
-        md5 = hashlib.md5()
-        result_unicode = to_unicode(data)
-        result_bytes = result_unicode.encode('utf-8')
-        md5.update(result_bytes)
-        md5_hash = md5.hexdigest()
+        result_bytes = to_unicode(data).encode('utf-8')
+        return cls._put_in_s3(result_bytes, cls._digest_id(cls._hasher(result_bytes)))
+
+    @classmethod
+    def _hasher(cls, data):
+        return cls.digests[cls.digest](data)
 
-        s3_key = cls._make_key(md5_hash + ".ff")
+    @classmethod
+    def _digest_id(cls, hasher):
+        if cls.digest == "md5":
+            return hasher.hexdigest()
+        return "{}-{}".format(cls.digest, hasher.hexdigest())
+
+    @classmethod
+    def _put_in_s3(cls, body, digest):
+        s3_key = cls._make_key(digest + ".ff")
 
         s3_obj = cls.s3.Object(cls.bucket, s3_key)
-        s3_obj.put(Body=result_bytes)
+        if not cls._already_stored(s3_obj, s3_key):
+            if len(body) >= cls.transfer_threshold:
+                s3_obj.upload_fileobj(_BufferReader(body), Config=cls._transfer_config())
+            else:
+                s3_obj.put(Body=body)
+            cls.store_counts['uploaded'] += 1
+            cls._remember(s3_key)
+
+        return cls._ff_url(digest, s3_key)
 
-        return cls.separator.join((cls.magick_url, md5_hash, "s3://{}/{}".format(cls.bucket, s3_key)))
+    @classmethod
+    def _ff_url(cls, digest, s3_key):
+        return cls.separator.join((cls.magick_url, digest, "s3://{}/{}".format(cls.bucket, s3_key)))
+
+    @classmethod
+    def _already_stored(cls, s3_obj, s3_key):
+        if cls._indexed(s3_key):
+            return True
+        if cls.check_existing:
+            try:
+                s3_obj.load()
+            except ClientError as e:
+                if cls._missing(e):
+                    return False
+                raise
+            cls.store_counts['existing'] += 1
+            return True
+        return False
+
+    @classmethod
+    async def _already_stored_async(cls, s3_key):
+        if cls._indexed(s3_key):
+            return True
+        if cls.check_existing:
+            try:
+                await cls.async_s3.head_object(Bucket=cls.bucket, Key=s3_key)
+            except ClientError as e:
+                if cls._missing(e):
+                    return False
+                raise
+            cls.store_counts['existing'] += 1
+            return True
+        return False
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    @classmethod
+    def _indexed(cls, s3_key):
+        # only our own uploads are indexed, and by when they were made, so none outlives stored_for
+        key = (cls.bucket, s3_key)
+        with cls._stored_lock:
+            stored_at = cls.stored.get(key)
+            if stored_at is None or time.time() - stored_at >= cls.stored_for:
+                return False
+            cls.stored.move_to_end(key)
+            cls.store_counts['indexed'] += 1
+        return True
+
+    @classmethod
+    def _remember(cls, s3_key):
+        key = (cls.bucket, s3_key)
+        with cls._stored_lock:
+            cls.stored.pop(key, None)
+            cls.stored[key] = time.time()
+            while len(cls.stored) > cls.stored_size:
+                cls.stored.popitem(last=False)
 
     @classmethod
     def receive(cls, data: str):
-        if data.startswith(cls.magick_zip):
-            return cls._receive_zipped(data)
+        codec = cls._codec_for(data)
+        if codec:
+            return cls._receive_zipped(data, codec)
         elif data.startswith(cls.magick_url):
             return cls._receive_url(data)
         else:
             return data
 
     @classmethod
-    def _receive_url(cls, ff_url):
+    async def receive_async(cls, data: str):
+        """ receive for event loops, on the same executors and client as deliver_async """
+        codec = cls._codec_for(data)
+        if codec:
+            return await asyncio.get_running_loop().run_in_executor(cls.executor, cls._receive_zipped, data, codec)
+        elif data.startswith(cls.magick_url):
+            return await cls.receive_async((await cls._fetch_url_async(data)).decode('utf8'))
+        else:
+            return data
+
+    @classmethod
+    def receive_stream(cls, data: str, chunk_size=1 << 16):
+        """
+        receive for inputs too big to hold as one string. Returns a function that yields the
+        received text in chunks each time it's called, so the input can be read more than once.
+        FF-URL bodies are downloaded once, to a temporary file, unless payload_cache has them.
+        """
+        if data.startswith(cls.magick_url):
+            key = data.split(cls.separator, 2)[1]
+            # the downloaded body, once payload_cache didn't have it
+            spooled = []
+
+            def chunks():
+                cached = cls.payload_cache.get(key) if cls.payload_cache is not None and not spooled else None
+                if cached is not None:
+                    # a handle of the cache's for each read, closed once it's read
+                    with cached:
+                        yield from cls._stream_bytes(iter(lambda: cached.read(chunk_size), b''), chunk_size)
+                    return
+                if not spooled:
+                    spooled.append(cls._spool_url(data, key, chunk_size))
+                spool = spooled[0]
+                spool.seek(0)
+                yield from cls._stream_bytes(iter(lambda: spool.read(chunk_size), b''), chunk_size)
+            return chunks
+        return lambda: cls._stream_text(data, chunk_size)
+
+    @classmethod
+    def _spool_url(cls, data, key, chunk_size):
+        """ A temporary file with the body data points at, kept by payload_cache too """
+        spool = tempfile.TemporaryFile()
+        if cls.parallel_downloads:
+            cls._url_object(data).download_fileobj(spool, Config=cls._transfer_config())
+        else:
+            body = cls._get_url(data)
+            for chunk in iter(lambda: body.read(chunk_size), b''):
+                spool.write(chunk)
+        if cls.payload_cache is not None:
+            cls.payload_cache.put(key, spool)
+        return spool
+
+    @classmethod
+    def _stream_text(cls, data, chunk_size):
+        codec = cls._codec_for(data)
+        start = cls._zip_header_length(data[:cls.header_room]) if codec else 0
+        chunks = (data[i:i + chunk_size] for i in range(start, len(data), chunk_size))
+        if codec:
+            return cls._unzip_stream(chunks, chunk_size, codec)
+        return chunks
+
+    @classmethod
+    def _stream_bytes(cls, chunks, chunk_size):
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= cls.header_room:
+                break
+        codec = cls._codec_for(head[:cls.header_room].decode('latin-1'))
+        if codec:
+            header_length = cls._zip_header_length(head[:cls.header_room].decode('latin-1'))
+            yield from cls._unzip_stream(itertools.chain([head[header_length:]], chunks), chunk_size, codec)
+        elif head.startswith(cls.magick_url.encode()):
+            nested = b''.join(itertools.chain([head], chunks)).decode('utf-8')
+            yield from cls.receive_stream(nested, chunk_size)()
+        else:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            for chunk in itertools.chain([head], chunks):
+                yield decoder.decode(chunk)
+            yield decoder.decode(b'', final=True)
+
+    @classmethod
+    def _unzip_stream(cls, chunks, chunk_size, codec):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for piece in codec.inflate(cls._unwrap_stream(chunks, codec.envelope), chunk_size):
+            yield decoder.decode(piece)
+        yield decoder.decode(b'', final=True)
+
+    @staticmethod
+    def _unwrap_stream(chunks, envelope):
+        # envelopes decode in groups of characters
+        carry = b''
+        for chunk in chunks:
+            chunk = carry + (chunk.encode('ascii') if isinstance(chunk, str) else chunk)
+            usable = len(chunk) - len(chunk) % envelope.characters
+            carry = chunk[usable:]
+            yield envelope.decode(chunk[:usable])
+        yield envelope.decode(carry)
+
+    @classmethod
+    def _transfer_config(cls):
+        return TransferConfig(multipart_threshold=cls.transfer_threshold, multipart_chunksize=cls.part_size,
+                              max_concurrency=cls.concurrency)
+
+    @classmethod
+    def _get_url(cls, ff_url):
+        return cls._url_object(ff_url).get()['Body']
+
+    @classmethod
+    def _read_url(cls, ff_url):
+        if not cls.parallel_downloads:
+            return cls._get_url(ff_url).read()
+        body = io.BytesIO()
+        cls._url_object(ff_url).download_fileobj(body, Config=cls._transfer_config())
+        return body.getvalue()
+
+    @classmethod
+    def _url_object(cls, ff_url):
+        return cls.s3.Object(*cls._url_location(ff_url))
+
+    @classmethod
+    def _url_location(cls, ff_url):
         # sample ff url:
         # FF-URL:ca5c3877664255d120079fa323850b7f:s3://balihoo.dev.fulfillment/retain_30_180/zipped-ff/ca5c3877664255d120079fa323850b7f.ff
         s, h, proto, path = ff_url.split(cls.separator)
@@ -81,18 +652,82 @@ class DataZipper(object):
         bucket = path_parts[0]
         key = '/'.join(path_parts[1:])
         assert proto == "s3", "DataZipper only supports s3 protocol for fulfillment documents"
+        return bucket, key
 
-        s3_obj = cls.s3.Object(bucket, key)
-        response = s3_obj.get()
+    @classmethod
+    def _receive_url(cls, ff_url):
+        return cls.receive(cls._fetch_url(ff_url).decode('utf8'))
 
-        return cls.receive(response['Body'].read().decode('utf8'))
+    @classmethod
+    def _fetch_url(cls, ff_url):
+        """ The payload an FF-URL points at, from payload_cache if it's there """
+        if cls.payload_cache is None:
+            return cls._read_url(ff_url)
+        key = ff_url.split(cls.separator, 2)[1]
+        cached = cls.payload_cache.get(key)
+        if cached is not None:
+            with cached:
+                return cached.read()
+        body = cls._read_url(ff_url)
+        cls.payload_cache.put(key, body)
+        return body
+
+    @classmethod
+    async def _fetch_url_async(cls, ff_url):
+        loop = asyncio.get_running_loop()
+        if cls.async_s3 is None:
+            return await loop.run_in_executor(cls.s3_executor, cls._fetch_url, ff_url)
+        key = ff_url.split(cls.separator, 2)[1]
+        if cls.payload_cache is not None:
+            # the disk tier blocks, so it's used from s3_executor
+            cached = await loop.run_in_executor(cls.s3_executor, cls.payload_cache.get, key)
+            if cached is not None:
+                with cached:
+                    return cached.read()
+        bucket, s3_key = cls._url_location(ff_url)
+        response = await cls.async_s3.get_object(Bucket=bucket, Key=s3_key)
+        body = await response['Body'].read()
+        if cls.payload_cache is not None:
+            await loop.run_in_executor(cls.s3_executor, cls.payload_cache.put, key, body)
+        return body
 
     @classmethod
-    def _receive_zipped(cls, zipped):
-        # 17 chars allows for a 10 digit length!
-        s, length_string, head = zipped[:min(17, len(zipped))].split(cls.separator)
+    def _zip_header_length(cls, head):
+        # header_room allows for a 10 digit length!
+        magick, length_string, rest = head.split(cls.separator, 2)
         # parts would look like ("FF-ZIP", "56794", "blah blah blah...")
-        header_length = len(cls.magick_zip) + len(length_string) + 2  # 2 separators
+        return len(magick) + len(length_string) + 2  # 2 separators
+
+    @classmethod
+    def _receive_zipped(cls, zipped, codec=None):
+        header_length = cls._zip_header_length(zipped[:cls.header_room])
+        codec = codec or cls._codec_for(zipped)
+        return codec.decompress(codec.envelope.decode(zipped[header_length:])).decode('utf-8')
+
+    @classmethod
+    def _denser(cls, zipped, digest, limit, codec):
+        """
+        zipped in the dense twin of its codec if that fits the limit where it doesn't, as
+        (text, None), else (zipped, digest) unchanged.
+        """
+        twin = cls.codecs.get(cls.dense.get(codec.magick))
+        if twin is None:
+            return zipped, digest
+        header_length = cls._zip_header_length(zipped[:cls.header_room].decode('ascii'))
+        compressed = codec.envelope.decode(zipped[header_length:])
+        header = twin.magick + cls.separator + zipped[len(codec.magick) + 1:header_length].decode('ascii')
+        if len(header) + twin.envelope.length(len(compressed)) > limit:
+            return zipped, digest
+        return header + twin.envelope.encode(compressed).decode('ascii'), None
 
-        return zlib.decompress(base64.b64decode(zipped[header_length:])).decode('utf-8')
 
+DataZipper.register(ZlibCodec())
+DataZipper.register(ZlibCodec("FF-B85", BASE85))
+DataZipper.register(LzmaCodec())
+DataZipper.register(LzmaCodec("FF-LZMA-B85", BASE85))
+try:
+    import zstandard
+    DataZipper.register(ZstdCodec(zstandard))
+    DataZipper.register(ZstdCodec(zstandard, "FF-ZSTD-B85", BASE85))
+except ImportError:
+    pass
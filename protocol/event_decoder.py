@@ -0,0 +1,114 @@
+"""
+Decodes events so that equal strings share one object. CPython's decoder already shares the keys
+repeated within a document, but every value is a new string, so a list of a million records with
+a "channel": "search" in each holds a million copies of "search". EventDecoder makes the values
+that are options of an EnumParameter, anywhere in the parameters, the one string the schema holds.
+Only the properties whose schema can hold an option are looked at, so records with many other
+fields cost little more than the object_hook call itself.
+"""
+import json
+import sys
+
+_size = sys.getsizeof
+
+
+def _enum_options(schema, found):
+    if isinstance(schema, dict):
+        for option in schema.get('enum', ()):
+            if isinstance(option, str):
+                found.add(option)
+        for value in schema.values():
+            _enum_options(value, found)
+    elif isinstance(schema, list):
+        for value in schema:
+            _enum_options(value, found)
+    return found
+
+
+def _subschemas(schema):
+    """ The schemas of the values directly inside a value of schema, and whether they're properties """
+    for name, sub in schema.get('properties', {}).items():
+        yield name, sub
+    for sub in schema.get('patternProperties', {}).values():
+        yield None, sub
+    if isinstance(schema.get('additionalProperties', None), dict):
+        yield None, schema['additionalProperties']
+    items = schema.get('items', None)
+    for sub in ([items] if isinstance(items, dict) else items or ()):
+        yield (), sub
+    for keyword in ('oneOf', 'anyOf', 'allOf'):
+        for sub in schema.get(keyword, ()):
+            yield (), sub
+
+
+def _holds_option(schema):
+    """ Whether a value of schema, or a string in its arrays, can be an enum option """
+    return 'enum' in schema or any(_holds_option(sub) for key, sub in _subschemas(schema) if key == ())
+
+
+def _option_keys(schema, keys, seen):
+    """ Adds the names of the properties, anywhere in schema, that can hold an enum option; None for any name """
+    if id(schema) not in seen:
+        seen.add(id(schema))
+        for key, sub in _subschemas(schema):
+            if key != () and _holds_option(sub):
+                keys.add(key)
+            _option_keys(sub, keys, seen)
+    return keys
+
+
+class EventDecoder(object):
+    def __init__(self, params):
+        self._strings = {}
+        keys = set()
+        for name, param in params.items():
+            schema = param.to_schema()
+            for option in _enum_options(schema, set()):
+                self._strings[option] = sys.intern(option)
+            if _holds_option(schema):
+                keys.add(name)
+            _option_keys(schema, keys, set())
+        # None when some object, a LooseObjectParameter's, can hold options under any name
+        self._keys = None if None in keys else tuple(keys)
+        # values replaced by the shared string, and the bytes their copies held
+        self.shared = 0
+        self.saved_bytes = 0
+
+    def loads(self, text):
+        if not self._strings:
+            return json.loads(text)
+        return json.loads(text, object_hook=self._object)
+
+    def _object(self, obj):
+        get = self._strings.get
+        shared = saved = 0
+        for key in obj if self._keys is None else self._keys:
+            value = obj.get(key)
+            kind = type(value)
+            if kind is str:
+                string = get(value, value)
+                if string is not value:
+                    obj[key] = string
+                    shared += 1
+                    saved += _size(value)
+            elif kind is list:
+                shared, saved = self._list(value, shared, saved)
+        if shared:
+            self.shared += shared
+            self.saved_bytes += saved
+        return obj
+
+    def _list(self, items, shared, saved):
+        # every item is checked, lists in lists too; the objects in it were seen by the hook already
+        get = self._strings.get
+        for index, item in enumerate(items):
+            kind = type(item)
+            if kind is str:
+                string = get(item, item)
+                if string is not item:
+                    items[index] = string
+                    shared += 1
+                    saved += _size(item)
+            elif kind is list:
+                shared, saved = self._list(item, shared, saved)
+        return shared, saved
@@ -0,0 +1,228 @@
+"""
+Streams events that are mostly one enormous array parameter. The input is read twice, as JSON
+arriving in chunks: once before the handler runs, to collect the other parameters and validate
+every element, and again while the handler iterates, parsing one element at a time. Neither pass
+holds more than one element of the array.
+"""
+import json
+import re
+
+from .datazipper import DataZipper
+from .fulfillment_exception import FulfillmentValidationException
+from .fulfillment_parser import InvocationPlan, kwarg_name
+from .param_validator import ParamValidator
+from .schema import ArrayParameter, JsonParameter, _ParseError
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[-+0-9.eE]*')
+
+
+class _JsonReader(object):
+    """ Reads JSON values and punctuation from text that arrives in chunks """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        self._pos = 0
+        self._scan = json.JSONDecoder().scan_once
+
+    def _more(self, wanted):
+        """ Buffers at least `wanted` more characters, False if the input had nothing left """
+        unread = self._buffer[self._pos:]
+        parts = [unread]
+        size = target = len(unread)
+        target += wanted
+        for chunk in self._chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= target:
+                break
+        self._buffer = ''.join(parts)
+        self._pos = 0
+        return size > len(unread)
+
+    def peek(self):
+        """ The next character that isn't whitespace, '' at the end of the input """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._more(1):
+                return ''
+
+    def take(self, expected):
+        found = self.peek()
+        if not found or found not in expected:
+            raise ValueError("Expecting one of '{}' but found '{}'".format(expected, found))
+        self._pos += 1
+        return found
+
+    def value(self):
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            try:
+                value, end = self._scan(self._buffer, self._pos)
+            except (StopIteration, ValueError) as e:
+                # most likely cut off by the end of the buffer, so try again with twice as much
+                if self._more(max(len(self._buffer) - self._pos, 1)):
+                    continue
+                if isinstance(e, ValueError):
+                    raise
+                raise ValueError("Expecting a value at '{}'".format(self._buffer[self._pos:self._pos + 20]))
+            # a number that runs up to the end of the buffer might go on in the next chunk
+            if isinstance(value, (int, float)) and _NUMBER_TAIL.match(self._buffer, end).end() == len(self._buffer):
+                if self._more(1):
+                    continue
+            self._pos = end
+            return value
+
+    def members(self):
+        """ Yields the keys of the object that starts here, the caller reads each value """
+        self.take('{')
+        if self.peek() == '}':
+            self.take('}')
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("Expecting a property name but found {!r}".format(key))
+            self.take(':')
+            yield key
+            if self.take(',}') == '}':
+                return
+
+    def elements(self):
+        """ Yields the elements of the array that starts here """
+        self.take('[')
+        if self.peek() == ']':
+            self.take(']')
+            return
+        while True:
+            yield self.value()
+            if self._pos < len(self._buffer) and self._buffer[self._pos] == ',':
+                self._pos += 1
+            elif self.take(',]') == ']':
+                return
+
+
+class StreamedEvent(object):
+    """ An event read by ArrayStream.scan: everything but the array, and what was wrong with it """
+    def __init__(self, stream, chunks, event, validation_errors, streamed):
+        self._stream = stream
+        self._chunks = chunks
+        self._streamed = streamed
+        self.event = event
+        self.validation_errors = validation_errors
+
+    def kwargs(self):
+        """ parse_event for this event, with the array as an iterator of parsed elements """
+        if not self._streamed:
+            return self._stream.parse(self.event)
+        kwargs = self._stream.rest_plan(self.event, in_place=True)
+        kwargs[kwarg_name(self._stream.name)] = self._stream.elements(self._chunks)
+        return kwargs
+
+
+class ArrayStream(object):
+    """
+    Hands the handler the array parameter `name` as an iterator of parsed elements, reading the
+    raw, FF-ZIP or FF-URL input incrementally. uniqueItems would need every element at once, so
+    arrays that have it can't be streamed.
+    """
+    def __init__(self, parameters, name, artifact_cache=None, chunk_size=1 << 16, max_errors=None, fail_fast=False):
+        param = parameters[name]
+        if not isinstance(param, ArrayParameter):
+            raise Exception("Only an ArrayParameter can be streamed, '{}' is a {}".format(name, type(param).__name__))
+        schema = param.to_schema()
+        if schema.get('uniqueItems'):
+            raise Exception("'{}' has unique items, which can't be checked one element at a time".format(name))
+
+        self.name = name
+        self.parameters = parameters
+        self.rest = {k: v for k, v in parameters.items() if k != name}
+        self.rest_plan = InvocationPlan(self.rest)
+        self._plan = InvocationPlan(parameters)
+        self._element = param.element
+        self._min_items = schema.get('minItems', 0)
+        self._max_items = schema.get('maxItems', None)
+        self._chunk_size = chunk_size
+
+        # the elements are validated one by one, so the array only stands in for its presence
+        placeholder = ArrayParameter(param.description, JsonParameter("Streamed element"), required=param.required)
+        self._validator = ParamValidator(dict(self.rest, **{name: placeholder}), artifact_cache, max_errors, fail_fast)
+        if artifact_cache is None:
+            self._element_validator = param.element.to_compiled_validator()
+        else:
+            self._element_validator = artifact_cache.compiled_validator(param.element.to_schema())
+
+    def save_artifacts(self, artifact_cache):
+        """ Stores the validators of the other parameters and of an element, returns their paths """
+        return [self._validator.save_artifact(artifact_cache), artifact_cache.store(self._element_validator)]
+
+    def scan(self, data):
+        """ Reads the input once, keeping everything but the array and validating its elements """
+        chunks = DataZipper.receive_stream(data, self._chunk_size)
+        reader = _JsonReader(chunks())
+        event = {}
+        element_errors = self._validator.budget()
+        count = None
+        # enough of the array to show in a minItems error
+        head = []
+        for key in reader.members():
+            if key == self.name and reader.peek() == '[':
+                count = 0
+                for element in reader.elements():
+                    element_errors.collect(self._element_validator, element, (self.name, count))
+                    if count < self._min_items:
+                        head.append(element)
+                    count += 1
+                event[key] = []
+            else:
+                event[key] = reader.value()
+        if reader.peek():
+            raise ValueError("Extra data after the event")
+
+        if count is not None and count < self._min_items:
+            element_errors.add_described(self._count_error('minItems', self._min_items, "%r is too short" % (head,)))
+        if count is not None and self._max_items and count > self._max_items:
+            # jsonschema's message, with the array that isn't held shown by its length
+            element_errors.add_described(self._count_error('maxItems', self._max_items,
+                                                           "[... {} items] is too long".format(count)))
+        errors = self._validator.validate(event, element_errors)
+        return StreamedEvent(self, chunks, event, errors, count is not None)
+
+    def _count_error(self, validator, limit, message):
+        return {
+            'cause': None,
+            'context': [],
+            'message': message,
+            'path': self.name,
+            'relative_path': self.name,
+            'absolute_path': self.name,
+            'validator': validator,
+            'validator_value': limit
+        }
+
+    def elements(self, chunks):
+        """ Reads the input again, parsing the elements of the array as they are asked for """
+        reader = _JsonReader(chunks())
+        for key in reader.members():
+            if key != self.name:
+                reader.value()
+                continue
+            parse = self._element._parse_node
+            for index, element in enumerate(reader.elements()):
+                try:
+                    value = parse(element, True)
+                except _ParseError as e:
+                    inner = Exception(e.render("{}[{}]".format(self.name, index)))
+                    raise FulfillmentValidationException("Error parsing parameter '{}'".format(self.name), inner_exception=inner)
+                yield value
+            return
+
+    def parse(self, event):
+        """ parse_event for an event that was already decoded, with the array as an iterator """
+        kwargs = self._plan(event)
+        name = kwarg_name(self.name)
+        if kwargs[name] is not None:
+            kwargs[name] = iter(kwargs[name])
+        return kwargs
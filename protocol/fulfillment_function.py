@@ -1,15 +1,13 @@
 from typing import Union
 
-from .fulfillment_parser import parse_event, parse_result
 from .fulfillment_exception import (
     FulfillmentException,
     FulfillmentFailedException
 )
 
 from .schema import ObjectParameter
-from .datazipper import DataZipper
 from .response import ActivityResponse, ActivityStatus
-from jsonschema import Draft4Validator
+from .task_input import InputHandler
 import json
 
 
@@ -25,7 +23,15 @@ class FulfillmentFunction(object):
         handler,
         debug_handler=None,
         default_exception=FulfillmentFailedException,
-        disable_protocol=False
+        disable_protocol=False,
+        artifact_cache=None,
+        stream=None,
+        in_place=False,
+        max_errors=None,
+        fail_fast=False,
+        result_policy=None,
+        intern_strings=False,
+        input_cache=None
     ):
         self._description = description
         self._params = parameters
@@ -37,9 +43,17 @@ class FulfillmentFunction(object):
             'params': ObjectParameter("", properties=parameters).to_schema(),
             'result': result.to_schema()
         }
-        self._validator = Draft4Validator(ObjectParameter("", properties=parameters).to_schema(True))
+        # Receives, validates and parses the input, and parses the result
+        self._input = InputHandler(parameters, result, artifact_cache, stream, max_errors, fail_fast,
+                                   result_policy, intern_strings, input_cache)
         self._exception = default_exception
         self._disable_protocol = disable_protocol # Allow the function author to disable the protocol (like Node)
+        # Parse dict events in place too; Lambda decodes a new event for every invocation
+        self._in_place = in_place
+
+    def memory_report(self):
+        """ How much memory the schemas of this function hold, see schema_footprint, and what intern_strings saved """
+        return self._input.memory_report(self._schema)
 
     @classmethod
     def error_response(cls, e):
@@ -64,8 +78,8 @@ class FulfillmentFunction(object):
         return response.pack()
 
     def handle(self, event: Union[str, dict], context):
-        if isinstance(event, str):
-            event = json.loads(DataZipper.receive(event))
+        task = self._input.receive(event, self._in_place)
+        event = task.event
 
         if 'LOG_INPUT' in event:
             print(json.dumps(event, indent=4))
@@ -79,17 +93,18 @@ class FulfillmentFunction(object):
         # Always override _disable_protocol with the value in the event (if there is one)
         disable_protocol = event.get("DISABLE_PROTOCOL", self._disable_protocol)
 
-        validation_errors = self._validator.validate(event)
+        validation_errors = task.validation_errors()
         if validation_errors:
             return self.invalid_response(validation_errors, disable_protocol)
 
         try:
-            kwargs = parse_event(event, self._params)
+            kwargs = task.kwargs()
             if 'DEBUG_MODE' in event:
                 result = self._debug_handler(debug_mode=event['DEBUG_MODE'], **kwargs)
             else:
                 result = self._handler(**kwargs)
-            (valid_result, notes) = parse_result(result, self._result)
+            task.handled(kwargs)
+            (valid_result, notes) = self._input.parse_result(result)
             return self.success_response(valid_result, notes, disable_protocol)
         except FulfillmentException as e:
             if disable_protocol:
@@ -102,5 +117,3 @@ class FulfillmentFunction(object):
 
             wrapped = self._exception("unhandled exception", inner_exception=e)
             return self.error_response(wrapped)
-
-
@@ -1,29 +1,131 @@
+import datetime
+import random
 import re
 
 from .fulfillment_exception import (
     FulfillmentValidationException
 )
+from .schema import SchemaParameter, _json
 
 param_rex = re.compile('((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))')
 
 
-def parse_event(event, params):
+def kwarg_name(name):
+    # http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
+    return param_rex.sub(r'_\1', name.replace(' ', '_')).lower()
+
+
+def parse_event(event, params, in_place=False):
     kwargs = {}
     for (name, param) in params.items():
         try:
             value = event[name] if name in event else None
-            # http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-            param_name = param_rex.sub(r'_\1', name.replace(' ', '_')).lower()
-            kwargs[param_name] = param.parse(value, name)
+            kwargs[kwarg_name(name)] = param.parse(value, name, in_place)
         except Exception as e:
             msg = "Error parsing parameter '{}'".format(name)
             raise FulfillmentValidationException(msg, inner_exception=e)
     return kwargs
 
 
-def parse_result(result, result_schema):
+class InvocationPlan(object):
+    """
+    parse_event for one set of parameters, with everything that is the same for every event worked
+    out once: the kwarg names, the bound parsers and the defaults, parsed ahead of time when they
+    are strings, numbers, dates or None and can be shared between events.
+    """
+    _SHARED = (str, int, float, bool, type(None), datetime.date, datetime.datetime)
+
+    def __init__(self, params):
+        self._params = params
+        self._build()
+
+    def _build(self):
+        self.edits = SchemaParameter._edits
+        self._steps = []
+        for (name, param) in self._params.items():
+            # so that making it required or optional later shows up in SchemaParameter._edits
+            param._observed = True
+            try:
+                default = param.parse(None, name)
+                shared = type(default) in self._SHARED
+            except Exception:
+                # required, or a default that doesn't parse; either way parse reports it per event
+                default, shared = None, False
+            self._steps.append((name, kwarg_name(name), param.parse, shared, default))
+
+    def __call__(self, event, in_place=False):
+        if self.edits != SchemaParameter._edits:
+            self._build()
+        kwargs = {}
+        for (name, kwarg, parse, shared, default) in self._steps:
+            value = event.get(name, None)
+            if value is None and shared:
+                kwargs[kwarg] = default
+                continue
+            try:
+                kwargs[kwarg] = parse(value, name, in_place)
+            except Exception as e:
+                msg = "Error parsing parameter '{}'".format(name)
+                raise FulfillmentValidationException(msg, inner_exception=e)
+        return kwargs
+
+
+class ResultPolicy(object):
+    """
+    How much of a handler's result parse_result checks. 'always' parses all of it, 'sampled'
+    parses a `rate` share of the results and only checks the shape of the others, 'shape-only'
+    only checks the shape (see SchemaParameter.parse_shape). Results that are only shape checked
+    are returned as the handler made them, without defaults applied or strings stripped.
+
+    metrics is called with 'parsed', 'shape_checked' or 'violation' for every result, so a
+    handler that starts returning bad results is still noticed while most of them aren't parsed.
+    """
+    MODES = ('always', 'sampled', 'shape-only')
+
+    def __init__(self, mode='always', rate=0.01, metrics=None, seed=None):
+        if mode not in self.MODES:
+            raise Exception("Unknown result policy '{}', expected one of {}".format(mode, ", ".join(self.MODES)))
+        self.mode = mode
+        self.rate = rate
+        self._metrics = metrics
+        self._random = random.Random(seed).random
+        self.counts = {'parsed': 0, 'shape_checked': 0, 'violation': 0}
+
+    def _count(self, name):
+        self.counts[name] += 1
+        if self._metrics is not None:
+            self._metrics(name)
+
+    def parse(self, value, result_schema):
+        full = self.mode == 'always' or (self.mode == 'sampled' and self._random() < self.rate)
+        try:
+            if full:
+                parsed = result_schema.parse(value, 'Parsing result:')
+            else:
+                parsed = result_schema.parse_shape(value, 'Parsing result:')
+        except Exception:
+            self._count('violation')
+            raise
+        self._count('parsed' if full else 'shape_checked')
+        return parsed
+
+
+def parse_result(result, result_schema, policy=None, plain=None):
+    """
+    The parsed result and notes. plain says whether result_schema only parses into JSON types (see
+    SchemaParameter.plain_json); handlers work it out once, and only other results are converted.
+    """
+    if plain is None:
+        plain = result_schema.plain_json()
     if isinstance(result, tuple):
         (res, notes) = result
-        return result_schema.parse(res, 'Parsing result:'), notes
     else:
-        return result_schema.parse(result, 'Parsing result:'), []
+        (res, notes) = (result, [])
+    if policy is None:
+        parsed = result_schema.parse(res, 'Parsing result:')
+    else:
+        parsed = policy.parse(res, result_schema)
+    if plain:
+        return parsed, notes
+    # records and the like are for handlers, the response is sent as JSON
+    return _json(parsed), notes
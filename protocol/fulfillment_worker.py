@@ -2,15 +2,14 @@ import json
 import boto3
 from botocore.client import Config
 
-from .fulfillment_parser import parse_event, parse_result
 from .fulfillment_exception import (
     FulfillmentException,
     FulfillmentFailedException
 )
 from .response import ActivityResponse, ActivityStatus
 from .schema import ObjectParameter
-from .datazipper import DataZipper
 from .param_validator import ParamValidator
+from .task_input import InputHandler
 
 
 def default_log(message):
@@ -30,7 +29,14 @@ class FulfillmentWorker(object):
         activity_name,
         activity_version,
         swf_domain,
-        default_exception=FulfillmentFailedException
+        default_exception=FulfillmentFailedException,
+        artifact_cache=None,
+        stream=None,
+        max_errors=None,
+        fail_fast=False,
+        result_policy=None,
+        intern_strings=False,
+        input_cache=None
     ):
         self._description = description
         self._params = parameters
@@ -46,7 +52,9 @@ class FulfillmentWorker(object):
             'result': result.to_schema(),
             'activity': self._activity
         }
-        self._validator = ParamValidator(parameters)
+        # Receives, validates and parses the input, and parses the result
+        self._input = InputHandler(parameters, result, artifact_cache, stream, max_errors, fail_fast,
+                                   result_policy, intern_strings, input_cache)
         self._default_exception = default_exception
         self._task_list = {'name': '{}{}'.format(activity_name, activity_version)}
         self._swf_domain = swf_domain
@@ -62,6 +70,10 @@ class FulfillmentWorker(object):
             )
         )
 
+    def memory_report(self):
+        """ How much memory the schemas of this worker hold, see schema_footprint, and what intern_strings saved """
+        return self._input.memory_report(self._schema)
+
     def _poll(self):
         task = self._swf.poll_for_activity_task(
             domain=self._swf_domain,
@@ -107,13 +119,13 @@ class FulfillmentWorker(object):
         response = ActivityResponse(ActivityStatus.INVALID, validation_errors=validation_errors)
         self._swf.respond_activity_task_failed(
             taskToken=token,
-            reason="{} validation error(s)".format(len(validation_errors)),
+            reason="{} validation error(s)".format(ParamValidator.count(validation_errors)),
             details=json.dumps(response.pack())
         )
 
     def handle(self, token, event):
-        if isinstance(event, str):
-            event = json.loads(DataZipper.receive(event))
+        task = self._input.receive(event)
+        event = task.event
 
         if 'LOG_INPUT' in event:
             print(json.dumps(event, indent=4))
@@ -121,14 +133,15 @@ class FulfillmentWorker(object):
         if 'RETURN_SCHEMA' in event:
             return self._schema
 
-        validation_error = self._validator.validate(event)
+        validation_error = task.validation_errors()
         if validation_error:
             return self._invalid(token, validation_error)
 
         try:
-            kwargs = parse_event(event, self._params)
+            kwargs = task.kwargs()
             result = self._handler(**kwargs)
-            (valid_result, notes) = parse_result(result, self._result)
+            task.handled(kwargs)
+            (valid_result, notes) = self._input.parse_result(result)
             self._success(token, valid_result, notes)
         except FulfillmentException as e:
             self._fail(token, e)
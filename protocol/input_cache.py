@@ -0,0 +1,43 @@
+"""
+Remembers what came of the last few task inputs, for activities that SWF keeps handing the same
+input, like tasks that are deferred or cancelled and retried. An input seen before skips
+DataZipper.receive, json.loads and validation, and with kwargs=True the parse too.
+"""
+import hashlib
+from collections import OrderedDict
+
+from .datazipper import DataZipper
+
+
+class InputCache(object):
+    def __init__(self, size=16, kwargs=False):
+        self.size = size
+        # Handlers get the same kwargs every time the input comes round, so only keep them for
+        # handlers that don't change their arguments
+        self.kwargs = kwargs
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(data):
+        """ The key for a raw input: the md5 an FF-URL carries, or a hash of the input itself """
+        if data.startswith(DataZipper.magick_url):
+            return data.split(DataZipper.separator, 2)[1]
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """ (event, validation errors, kwargs or None) for the input, None if it isn't cached """
+        entry = self._entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, event, validation_errors, kwargs=None):
+        self._entries[key] = (event, validation_errors, kwargs if self.kwargs else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
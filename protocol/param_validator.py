@@ -1,23 +1,142 @@
-from jsonschema import Draft4Validator
+from collections import OrderedDict
+
 from .schema import ObjectParameter
 
 
+class ErrorBudget(object):
+    """
+    Collects validation errors, describing the first max_errors of them and only counting the
+    rest by where they are. With fail_fast the first error is the only one, and done tells the
+    caller to stop looking for more.
+    """
+    def __init__(self, max_errors=None, fail_fast=False):
+        self.limit = 1 if fail_fast else max_errors
+        self.fail_fast = fail_fast
+        self.reported = []
+        self.skipped = OrderedDict()
+        self._places = []
+
+    @property
+    def done(self):
+        return self.fail_fast and bool(self.reported)
+
+    def _full(self):
+        return self.limit is not None and len(self.reported) >= self.limit
+
+    @staticmethod
+    def _place(err, prefix):
+        # array indexes are left out, so a bad column of a huge array counts as one place
+        return ('/'.join('*' if isinstance(p, int) else str(p) for p in tuple(prefix) + tuple(err.path)),
+                err.validator)
+
+    def _skip(self, place, count=1):
+        self.skipped[place] = self.skipped.get(place, 0) + count
+
+    def add(self, err, prefix=()):
+        place = self._place(err, prefix)
+        if self._full():
+            self._skip(place)
+        else:
+            self.reported.append(ParamValidator.describe(err, prefix))
+            self._places.append(place)
+
+    def add_described(self, described):
+        """ Adds an error that's already described, like those found without a validator """
+        if self.done:
+            return
+        place = (described['path'], described['validator'])
+        if self._full():
+            self._skip(place)
+        else:
+            self.reported.append(described)
+            self._places.append(place)
+
+    def collect(self, validator, instance, prefix=()):
+        """
+        Adds the errors a CompiledValidator finds in instance. Those past the budget are only
+        counted, by the validator, without building their messages or ValidationErrors.
+        """
+        if self.done:
+            return
+        taken = 0
+        if not self._full():
+            for err in validator.iter_errors(instance):
+                if self._full():
+                    break
+                self.add(err, prefix)
+                if self.done:
+                    return
+                taken += 1
+            else:
+                return
+        places = validator.count_errors(instance, ['*' if isinstance(p, int) else p for p in prefix], taken)
+        for place, count in places.items():
+            self._skip(place, count)
+
+    def merge(self, other):
+        """ Adds the errors other collected after the ones collected here """
+        for described, place in zip(other.reported, other._places):
+            if self._full():
+                self._skip(place)
+            else:
+                self.reported.append(described)
+                self._places.append(place)
+        for place, count in other.skipped.items():
+            self._skip(place, count)
+
+    def errors(self):
+        """ The described errors, followed by one summary per place the skipped errors were found """
+        return self.reported + [{
+            'cause': None,
+            'context': [],
+            'message': "{} more '{}' error(s) at '{}'".format(count, validator, where),
+            'path': where,
+            'relative_path': where,
+            'absolute_path': where,
+            'validator': 'maxErrors',
+            'validator_value': count
+        } for (where, validator), count in self.skipped.items()]
+
+
 class ParamValidator(object):
-    def __init__(self, parameters):
-        self._validator = Draft4Validator(ObjectParameter('', properties=parameters).to_schema(True))
-
-    def validate(self, event):
-        validation_errors = []
-        for err in self._validator.iter_errors(event):
-            validation_errors.append({
-                'cause': err.cause,
-                'context': err.context,
-                'message': err.message,
-                'path': '/'.join([str(p) for p in err.path]),
-                'relative_path': '/'.join([str(p) for p in err.relative_path]),
-                'absolute_path': '/'.join([str(p) for p in err.absolute_path]),
-                'validator': err.validator,
-                'validator_value': err.validator_value
-            })
-
-        return validation_errors
+    def __init__(self, parameters, artifact_cache=None, max_errors=None, fail_fast=False):
+        if artifact_cache is None:
+            self._validator = ObjectParameter('', properties=parameters).to_compiled_validator(True)
+        else:
+            self._validator = artifact_cache.compiled_validator(ObjectParameter('', properties=parameters).to_schema(True))
+        self.max_errors = max_errors
+        self.fail_fast = fail_fast
+
+    def save_artifact(self, artifact_cache):
+        return artifact_cache.store(self._validator)
+
+    def budget(self):
+        return ErrorBudget(self.max_errors, self.fail_fast)
+
+    def validate(self, event, more=None):
+        """ The errors in event and then those in the budget more, within the budget of this validator """
+        budget = self.budget()
+        budget.collect(self._validator, event)
+        if more is not None:
+            budget.merge(more)
+        return budget.errors()
+
+    @staticmethod
+    def count(errors):
+        """ How many errors a validate result stands for, counting the summarized ones """
+        return sum(e['validator_value'] if e['validator'] == 'maxErrors' else 1 for e in errors)
+
+    @staticmethod
+    def describe(err, prefix=()):
+        """ A validation error as it is reported, with its paths starting at prefix """
+        prefix = [str(p) for p in prefix]
+        return {
+            'cause': err.cause,
+            'context': err.context,
+            'message': err.message,
+            'path': '/'.join(prefix + [str(p) for p in err.path]),
+            'relative_path': '/'.join(prefix + [str(p) for p in err.relative_path]),
+            'absolute_path': '/'.join(prefix + [str(p) for p in err.absolute_path]),
+            'validator': err.validator,
+            'validator_value': err.validator_value
+        }
@@ -0,0 +1,175 @@
+"""
+Keeps the FF-URL payloads DataZipper has downloaded, so a big input handed to many activities on
+one host is downloaded once. FF-URL keys are hashes of what they point at, so a payload never
+changes and is kept until it's evicted, least recently used first, when its tier holds more than
+its bytes. The memory tier holds the smaller payloads, and the optional disk tier, Lambda's /tmp
+or a worker-local directory, holds them all and outlives the process:
+
+    DataZipper.payload_cache = PayloadCache(64 << 20, "/tmp/fulfillment-payloads", 512 << 20)
+
+Processes sharing a directory find each other's payloads, but each only evicts the ones it knows
+about, so disk_bytes is per process.
+"""
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from .trusted_files import trusted
+
+_KEY = re.compile(r'^[0-9A-Za-z-]{1,128}$')
+
+
+class PayloadCache(object):
+    def __init__(self, memory_bytes=64 << 20, directory=None, disk_bytes=512 << 20):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self.memory_used = 0
+        self.disk_used = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # DataZipper.receive_async uses it from executor threads
+        self._lock = threading.RLock()
+        if directory is not None:
+            self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".ff")
+
+    def _scan(self):
+        """ Adopts the payloads already in the directory, oldest used first """
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # payloads are task inputs
+            if not trusted(self.directory):
+                raise OSError("{} could be written by others".format(self.directory))
+            entries = [e for e in os.scandir(self.directory)
+                       if e.name.endswith(".ff") and e.is_file() and trusted(e.path)]
+        except OSError:
+            # no disk tier then, the memory one still works
+            self.directory = None
+            return
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            self._adopt(entry.name[:-len(".ff")], entry.stat().st_size)
+        self._evict_disk()
+
+    def _adopt(self, key, size):
+        self._disk[key] = size
+        self.disk_used += size
+
+    def get(self, key):
+        """ A binary file with the payload for key, None if it isn't cached """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        if _KEY.match(key):
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return io.BytesIO(body)
+            f = self._open(key)
+            if f is not None:
+                self.disk_hits += 1
+                size = self._disk[key]
+                if size <= self._memory_item_bytes():
+                    with f:
+                        body = f.read()
+                    self._remember(key, body)
+                    return io.BytesIO(body)
+                return f
+        self.misses += 1
+        return None
+
+    def _open(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            if key not in self._disk:
+                # another process sharing the directory may have stored it
+                if not trusted(path):
+                    return None
+                self._adopt(key, os.stat(path).st_size)
+            f = open(path, 'rb')
+            os.utime(path)
+        except OSError:
+            self._forget_disk(key)
+            return None
+        self._disk.move_to_end(key)
+        return f
+
+    def put(self, key, body):
+        """ Keeps body, bytes or a binary file, for key. A file is read from its start """
+        with self._lock:
+            self._put(key, body)
+
+    def _put(self, key, body):
+        if not _KEY.match(key):
+            return
+        if hasattr(body, 'read'):
+            body.seek(0)
+            if self.directory is not None:
+                self._store(key, body)
+                body.seek(0)
+            if os.fstat(body.fileno()).st_size <= self._memory_item_bytes():
+                self._remember(key, body.read())
+            return
+        if self.directory is not None:
+            self._store(key, io.BytesIO(body))
+        if len(body) <= self._memory_item_bytes():
+            self._remember(key, body)
+
+    def _memory_item_bytes(self):
+        # so one payload never pushes out all the others
+        return self.memory_bytes // 4
+
+    def _remember(self, key, body):
+        if key in self._memory:
+            self.memory_used -= len(self._memory.pop(key))
+        self._memory[key] = body
+        self.memory_used += len(body)
+        while self.memory_used > self.memory_bytes:
+            self.memory_used -= len(self._memory.popitem(last=False)[1])
+
+    def _store(self, key, body):
+        if key in self._disk:
+            return
+        try:
+            fd, partial = tempfile.mkstemp(dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(body, f)
+                size = f.tell()
+            if size > self.disk_bytes:
+                os.unlink(partial)
+                return
+            os.replace(partial, self._path(key))
+        except OSError:
+            os.unlink(partial)
+            return
+        self._adopt(key, size)
+        self._evict_disk()
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self.disk_used -= size
+
+    def _evict_disk(self):
+        while self.disk_used > self.disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
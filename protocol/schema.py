@@ -1,9 +1,133 @@
 from jsonschema import Draft4Validator
+from .schema_compiler import CompiledValidator
+import array
+import datetime
+import keyword
 import pprint
+import re
+import sys
+import weakref
+from collections.abc import Mapping
+from .fulfillment_exception import FulfillmentValidationException
+
+
+class _ParseError(Exception):
+    """
+    A parse failure whose message is rendered only once the full context is known. Containers
+    add their path segment on the way out, so nothing is formatted while parsing succeeds.
+    """
+    def __init__(self, render):
+        super(_ParseError, self).__init__()
+        self.render = render
+
+    def __str__(self):
+        return self.render("")
+
+    def within(self, segment):
+        render = self.render
+        return _ParseError(lambda context: render(context + segment))
+
+    @classmethod
+    def wrap(cls, inner, suffix):
+        def render(context):
+            context = context + suffix
+            message = inner.render(context) if isinstance(inner, _ParseError) else inner
+            return "Exception while parsing {}: {}".format(context, message)
+        return cls(render)
+
+    @classmethod
+    def missing(cls, description):
+        return cls(lambda context: "{}-Missing required parameter (description: {})".format(context, description[:40]))
+
+
+class FrozenDict(dict):
+    """ A read-only dict. It is still a dict, so jsonschema and json.dumps treat it as one. """
+    __slots__ = ('__weakref__',)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Schemas returned by to_schema are read-only, copy them first")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+class FrozenList(list):
+    """ A read-only list, see FrozenDict """
+    __slots__ = ('__weakref__',)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Schemas returned by to_schema are read-only, copy them first")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+# Every read-only schema fragment that is alive, keyed on its structure
+_interned = weakref.WeakValueDictionary()
+
+
+def _structure(value):
+    """
+    A hashable key for the contents of a schema fragment. Fragments inside it are interned already,
+    so they are keyed on identity; everything else on type and value, which keeps 1, 1.0 and True
+    apart. Defaults and examples are plain data and are keyed all the way down.
+    """
+    if isinstance(value, dict):
+        return '{', tuple((k, _fragment_key(v)) for k, v in value.items())
+    return '[', tuple(_fragment_key(v) for v in value)
+
+
+def _fragment_key(value):
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return '@', id(value)
+    elif isinstance(value, (dict, list, tuple)):
+        return type(value), _structure(value)
+    return type(value), value
+
+
+def _intern(fragment):
+    """ The shared fragment that is structurally identical to this one """
+    try:
+        key = _structure(fragment)
+        return _interned.setdefault(key, fragment)
+    except TypeError:
+        # something unhashable that isn't a dict or list, so it can't be shared
+        return fragment
+
+
+def _freeze(value, children):
+    """ A read-only copy of a schema template, with child parameters replaced by their schemas """
+    if isinstance(value, SchemaParameter):
+        child_schema = value._frozen_schema()
+        children.append(value)
+        return child_schema
+    elif isinstance(value, dict):
+        return _intern(FrozenDict([(k, _freeze(v, children)) for k, v in value.items()]))
+    elif isinstance(value, list):
+        return _intern(FrozenList([_freeze(v, children) for v in value]))
+    return value
 
 
 class SchemaParameter(object):
+    # Nodes are small and numerous, so they keep no __dict__. Subclasses outside this module
+    # that don't declare __slots__ get one back.
+    __slots__ = ('description', '_required', '_json_type', 'default', '_schema', '_frozen', '_observed')
+
+    # Set to False to skip x-example checks at runtime and run check_examples() from tests instead
+    validate_examples = True
+
+    # Bumped when a node that something was derived from changes, which drops every cached schema
+    # and union index. Nodes are observed once their schema is built or a union index reads them.
+    _edits = 0
+
     def __init__(self, description, required=True, default=None, more_schema=None, example=None):
+        self._frozen = None
+        self._observed = False
         self.description = description
         self.required = required if default is None else False
         self.jsonType = "string"
@@ -21,6 +145,26 @@ class SchemaParameter(object):
         if example is not None:
             self._schema['x-example'] = example
 
+    @property
+    def required(self):
+        return self._required
+
+    @required.setter
+    def required(self, value):
+        self._required = value
+        if self._observed:
+            SchemaParameter._edits += 1
+
+    @property
+    def jsonType(self):
+        return self._json_type
+
+    @jsonType.setter
+    def jsonType(self, value):
+        self._json_type = value
+        if self._observed:
+            SchemaParameter._edits += 1
+
     def simple(self):
         return self.jsonType not in ('array', 'object')
 
@@ -38,43 +182,146 @@ class SchemaParameter(object):
             raise Exception("Every Schema MUST have a jsonType! ='{}'".format(self.jsonType))
 
     def to_schema(self, include_version=False):
-        self._schema['type'] = self._get_type()
-        schema = self._schema.copy()
+        schema = self._frozen_schema()
         if include_version:
-            schema['$schema'] = "http://json-schema.org/draft-04/schema"
+            schema = FrozenDict(schema, **{'$schema': "http://json-schema.org/draft-04/schema"})
+        return schema
+
+    def _frozen_schema(self):
+        # Every node is built once and reused by all of its parents until some node is edited
+        frozen = self._frozen
+        if frozen is not None and frozen[1] == SchemaParameter._edits:
+            return frozen[0]
+
+        children = []
+        schema = {}
+        for k, v in self._schema.items():
+            # defaults and examples are instance data rather than schema, so they are left as given
+            if isinstance(v, (SchemaParameter, dict, list)) and k not in ('default', 'x-example'):
+                v = _freeze(v, children)
+            schema[k] = v
+        schema['type'] = _freeze(self._get_type(), children)
+        schema = _intern(FrozenDict(schema))
+        if self.validate_examples:
+            self._check_example(schema)
+        if not children:
+            # a leaf rebuilds the same way from its own schema, so the template can be shared too
+            self._schema = schema
+        # whether a lazy ObjectParameter is below this node, for _place
+        holds_lazy = any((isinstance(c, ObjectParameter) and c.lazy) or c._frozen[3] for c in children)
+        self._frozen = (schema, SchemaParameter._edits, tuple(children), holds_lazy)
+        self._observed = True
+        return schema
 
+    def _check_example(self, schema):
         # Make sure the provided example is valid for the given schema
-        if 'x-example' in self._schema:
+        if 'x-example' in schema:
             validator = Draft4Validator(schema)
-            if not validator.is_valid(self._schema['x-example']):
+            if not validator.is_valid(schema['x-example']):
                 problems = []
-                for err in validator.iter_errors(self._schema['x-example']):
+                for err in validator.iter_errors(schema['x-example']):
                     problems.append(err.message)
                 raise Exception("Schema example does not match! {}\n\n----- SCHEMA -----\n{}".format("\n".join(problems), pprint.pformat(schema)))
-        return schema
+
+    def check_examples(self):
+        """ Checks the x-example of this node and every node below it """
+        self._frozen_schema()
+        seen = set()
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if id(node) not in seen:
+                seen.add(id(node))
+                schema, edits, children, holds_lazy = node._frozen
+                node._check_example(schema)
+                pending.extend(children)
+
+    def plain_json(self):
+        """ Whether everything parse makes for this node and those below it is JSON already """
+        self._frozen_schema()
+        seen = set()
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if id(node) not in seen:
+                seen.add(id(node))
+                if node._makes_objects():
+                    return False
+                pending.extend(node._frozen[2])
+        return True
+
+    def _makes_objects(self):
+        # whether this node parses into Records, LazyObjects, typed arrays or dates, which _json converts
+        return False
 
     def to_validator(self, include_version=False):
         return Draft4Validator(self.to_schema(include_version=include_version))
 
-    def parse(self, value, context=""):
+    def to_compiled_validator(self, include_version=False):
+        return CompiledValidator(self.to_schema(include_version=include_version))
+
+    def parse(self, value, context="", in_place=False):
+        """
+        The value with strings stripped, defaults applied and missing properties dropped. With
+        in_place, the dicts and lists of the value are normalized and reused rather than copied,
+        which is only safe for a value nothing else holds on to, like the output of json.loads.
+        """
+        try:
+            parsed = self._parse_node(value, in_place)
+        except _ParseError as e:
+            raise Exception(e.render(context))
+        _place(self, parsed, context)
+        return parsed
+
+    def parse_shape(self, value, context=""):
+        """
+        parse for a value that is only checked at the top level. A dict or list has its type and,
+        for an object, its required properties checked and is returned as it is; anything else is
+        parsed as usual.
+        """
+        if value is None or self._parse_types not in ((dict,), (list, tuple)):
+            return self.parse(value, context)
+        try:
+            self._check_shape(value)
+        except _ParseError as e:
+            raise Exception(e.render(context))
+        return value
+
+    def _check_shape(self, value):
+        if not isinstance(value, self._parse_types):
+            raise _ParseError.wrap(Exception("Expected to parse a {}!".format(self._parse_types[0].__name__)), "")
+
+    def _parse_node(self, value, in_place=False):
+        # Contexts are built lazily, so _parse gets an empty one. Containers parse their children
+        # through _parse_node and only add their path segment when a child fails.
         if value is not None:
             if isinstance(value, bytes):
                 value = str(value, 'utf-8')
             try:
-                return self._parse(value, context)
+                return self._normalize(value) if in_place else self._parse(value, "")
             except Exception as e:
-                raise Exception("Exception while parsing {}: {}".format(context, e))
+                raise _ParseError.wrap(e, "")
         if not self.is_required():
+            # defaults are shared between parses, so they are always copied
             try:
-                return self._parse(self.default, context+"/-default-/") if self.default is not None else self.default
+                return self._parse(self.default, "") if self.default is not None else self.default
             except Exception as e:
-                raise Exception("Exception while parsing {}: {}".format(context+"/-default-/", e))
-        raise Exception("{}-Missing required parameter (description: {})".format(context, self.description[:40]))
+                raise _ParseError.wrap(e, "/-default-/")
+        raise _ParseError.missing(self.description)
+
+    # The python types _parse can succeed for, None if it might take anything
+    _parse_types = None
 
     def _parse(self, value, context):
         return value
 
+    def _normalize(self, value):
+        """ _parse, reusing the containers of value where that gives the same result """
+        return self._parse(value, "")
+
 class StringParameter(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, pattern=None, min_length=None, max_length=None, **kwargs):
         add_schema = {}
         if pattern:
@@ -85,14 +332,20 @@ class StringParameter(SchemaParameter):
             add_schema['minLength'] = int(min_length)
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
 
+    _parse_types = (str,)
+
     def _parse(self, value, context=""):
         return value.strip()
 
 class EnumParameter(SchemaParameter):
+    __slots__ = ('options',)
+
     def __init__(self, description, options, **kwargs):
         SchemaParameter.__init__(self, description, more_schema={'enum': options}, **kwargs)
         self.options = options
 
+    _parse_types = (str,)
+
     def _parse(self, value, context=""):
         v = value.strip()
         if v not in self.options:
@@ -100,16 +353,22 @@ class EnumParameter(SchemaParameter):
         return v
 
 class BooleanParameter(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         SchemaParameter.__init__(self, description, **kwargs)
         self.jsonType = "boolean"
 
+    _parse_types = (bool,)
+
     def _parse(self, value, context=""):
         if type(value) != bool:
             raise Exception("Expected to parse a bool!")
         return bool(value)
 
 class UriParameter(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         add_schema = {
             'format': "uri",
@@ -117,40 +376,293 @@ class UriParameter(SchemaParameter):
         }
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
 
+    _parse_types = (str,)
+
     def _parse(self, value, context=""):
         return value.strip()
 
 class UuidParameter(StringParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         pattern = r"^[0-9A-Fa-f]{8}-([0-9A-Fa-f]{4}-){3}[0-9A-Fa-f]{12}$"
         StringParameter.__init__(self, description, pattern=pattern, **kwargs)
 
 class ObjectParameter(SchemaParameter):
-    def __init__(self, description, properties, **kwargs):
+    __slots__ = ('properties', 'lazy', 'output', '_record')
+
+    def __init__(self, description, properties, lazy=False, output="dict", **kwargs):
         add_schema = {
-            'properties': {name: properties[name].to_schema() for name in properties},
+            'properties': dict(properties),
             'required': [name for name in properties if properties[name].is_required()]
         }
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.properties = properties
+        # Parse into a LazyObject, which parses each property the first time it's read
+        self.lazy = lazy
+        # "dict", or "record" to parse into instances of a Record class made for these properties
+        if output not in ("dict", "record"):
+            raise Exception("output must be 'dict' or 'record', not '{}'".format(output))
+        if output == "record" and lazy:
+            raise Exception("An ObjectParameter can't be both lazy and parse into records")
+        self.output = output
+        self._record = _record_class(list(properties)) if output == "record" else None
         self.jsonType = "object"
 
+    _parse_types = (dict,)
+
+    def _frozen_schema(self):
+        if self._frozen is None or self._frozen[1] != SchemaParameter._edits:
+            # properties made optional or required since the last build, see SchemaParameter.required
+            self._schema['required'] = [name for name in self.properties if self.properties[name].is_required()]
+        return SchemaParameter._frozen_schema(self)
+
+    def _makes_objects(self):
+        return self.lazy or self._record is not None
+
     def _parse(self, value, context=""):
         if type(value) != dict:
-            raise Exception("Expected to parse a dict!")
+            if isinstance(value, LazyObject):
+                value = value.to_dict()
+            elif isinstance(value, Record):
+                value = value.to_json()
+            else:
+                raise Exception("Expected to parse a dict!")
+        if self.lazy:
+            return LazyObject(self, value)
+        if self._record is not None:
+            return self._parse_record(value)
         out = {}
         for name, prop in self.properties.items():
-            v = prop.parse(value.get(name, None), context+"[{}]".format(name))
+            try:
+                v = prop._parse_node(value.get(name, None))
+            except _ParseError as e:
+                raise e.within("[{}]".format(name))
             if v is not None:
                 out[name] = v
         return out
 
+    def _parse_record(self, value):
+        values = []
+        for name, prop in self.properties.items():
+            try:
+                values.append(prop._parse_node(value.get(name, None)))
+            except _ParseError as e:
+                raise e.within("[{}]".format(name))
+        return self._record(*values)
+
+    def _normalize(self, value):
+        if type(value) != dict or self.lazy or self._record is not None:
+            return self._parse(value, "")
+        kept = 0
+        for name, prop in self.properties.items():
+            try:
+                v = prop._parse_node(value.get(name, None), True)
+            except _ParseError as e:
+                raise e.within("[{}]".format(name))
+            if v is not None:
+                value[name] = v
+                kept += 1
+            elif name in value:
+                del value[name]
+        if len(value) > kept:
+            for name in [name for name in value if name not in self.properties]:
+                del value[name]
+        return value
+
+    def _check_shape(self, value):
+        SchemaParameter._check_shape(self, value)
+        for name, prop in self.properties.items():
+            if prop.is_required() and value.get(name, None) is None:
+                raise _ParseError.wrap(_ParseError.missing(prop.description).within("[{}]".format(name)), "")
+
+class LazyObject(Mapping):
+    """
+    What a lazy ObjectParameter parses into: a read-only mapping over the decoded dict that parses
+    a property the first time it is read and keeps the result. It holds the same keys and values
+    as the dict the parameter would have parsed, and to_dict() makes that dict. A property that
+    doesn't parse raises FulfillmentValidationException with its path.
+    """
+    __slots__ = ('_param', '_raw', '_parsed', '_context')
+
+    def __init__(self, param, raw):
+        self._param = param
+        self._raw = raw
+        self._parsed = {}
+        # where this object is, see _path; set by whoever parsed it
+        self._context = ""
+
+    def __getitem__(self, name):
+        parsed = self._parsed
+        if name in parsed:
+            value = parsed[name]
+        else:
+            prop = self._param.properties[name]
+            try:
+                value = prop._parse_node(self._raw.get(name, None))
+            except _ParseError as e:
+                context = _path(self._context)
+                inner = Exception(_ParseError.wrap(e.within("[{}]".format(name)), "").render(context))
+                raise FulfillmentValidationException("Error parsing parameter '{}'".format(context), inner_exception=inner)
+            _place(prop, value, (self, name))
+            parsed[name] = value
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        prop = self._param.properties.get(name, None)
+        if prop is None:
+            return False
+        if name in self._parsed:
+            return self._parsed[name] is not None
+        return self._raw.get(name, None) is not None or prop.default is not None or prop.is_required()
+
+    def __iter__(self):
+        return (name for name in self._param.properties if name in self)
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def __repr__(self):
+        return "LazyObject({!r})".format(self._raw)
+
+    def to_dict(self):
+        """ The dict the parameter would have parsed, with nested lazy objects made into dicts too """
+        return {name: _eager(value) for name, value in self.items()}
+
+
+def _eager(value):
+    if type(value) is LazyObject:
+        return value.to_dict()
+    elif type(value) is list:
+        return [_eager(v) for v in value]
+    elif type(value) is dict:
+        return {k: _eager(v) for k, v in value.items()}
+    return value
+
+
+class Record(object):
+    """
+    What an ObjectParameter with output="record" parses into: an instance of a class made for its
+    properties, with a slot for each of them rather than a dict. Properties are attributes, None
+    when they are missing, and can be read by name like a dict's. to_json() makes the dict the
+    parameter would have parsed, which is also what parse and parse_result accept in its place.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        value = getattr(self, name, None) if name in self.__slots__ else None
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in self.__slots__ else None
+        return default if value is None else value
+
+    def to_json(self):
+        out = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                out[name] = _json(value)
+        return out
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_json()
+        return self.to_json() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Record({})".format(", ".join("{}={!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+
+def _json(value):
+    if isinstance(value, Record):
+        return value.to_json()
+    elif type(value) is LazyObject:
+        return _json(value.to_dict())
+    elif _typed_array(value):
+        return value.tolist()
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif type(value) is list:
+        return [_json(v) for v in value]
+    elif type(value) is dict:
+        return {k: _json(v) for k, v in value.items()}
+    return value
+
+
+# Record classes by their property names, so equal ObjectParameters share one
+_record_classes = {}
+
+
+def _record_class(names):
+    key = tuple(names)
+    cls = _record_classes.get(key, None)
+    if cls is None:
+        for name in names:
+            if not name.isidentifier() or keyword.iskeyword(name) or name in Record.__dict__:
+                raise Exception("'{}' can't be the attribute of a record".format(name))
+        # a generated __init__ assigns every slot at C speed, unlike a loop over setattr
+        source = "def __init__(self, {0}):\n    {1} = {0}\n".format(
+            ", ".join(names), ", ".join("self." + name for name in names)) if names else "def __init__(self):\n    pass\n"
+        namespace = {}
+        exec(source, namespace)
+        cls = _record_classes[key] = type('Record', (Record,), {'__slots__': key, '__init__': namespace['__init__']})
+    return cls
+
+
+def _path(context):
+    """ Renders a LazyObject context: a string, or a (parent, key) pair where the key may be (index, length) """
+    if type(context) is LazyObject:
+        return _path(context._context)
+    if type(context) is tuple:
+        parent, key = context
+        if type(key) is tuple:
+            return "{}[{}/{}]".format(_path(parent), *key)
+        return "{}[{}]".format(_path(parent), key)
+    return context
+
+
+def _place(param, value, context):
+    """ Tells the lazy objects in a freshly parsed value, however deep in its eager containers, where they are """
+    if type(value) is LazyObject:
+        value._context = context
+    elif (type(value) in (list, dict) or isinstance(value, Record)) and param._frozen_schema() and param._frozen[3]:
+        _place_within(value, context)
+
+
+def _place_within(value, context):
+    # stops at lazy objects, which place their own properties as they're parsed
+    if type(value) is LazyObject:
+        value._context = context
+    elif type(value) is list:
+        n = len(value)
+        for i, v in enumerate(value):
+            _place_within(v, (context, (i, n)))
+    elif type(value) is dict:
+        for k, v in value.items():
+            _place_within(v, (context, k))
+    elif isinstance(value, Record):
+        for name in value.__slots__:
+            _place_within(getattr(value, name), (context, name))
+
+
 class LooseObjectParameter(SchemaParameter):
+    __slots__ = ('value_type',)
+
     def __init__(self, description, value_type, key_regex='.+', **kwargs):
         add_schema = {
             'minProperties': 1,
             'patternProperties': {
-                key_regex: value_type.to_schema()
+                key_regex: value_type
             },
             'additionalProperties': False
         }
@@ -158,15 +670,34 @@ class LooseObjectParameter(SchemaParameter):
         self.value_type = value_type
         self.jsonType = "object"
 
+    _parse_types = (dict,)
+
     def _parse(self, value, context=""):
         if type(value) != dict:
             raise Exception("Expected to parse a dict!")
         out = {}
+        parse = self.value_type._parse_node
         for name in value:
-            out[name] = self.value_type.parse(value[name], context+"[{}]".format(name))
+            try:
+                out[name] = parse(value[name])
+            except _ParseError as e:
+                raise e.within("[{}]".format(name))
         return out
 
+    def _normalize(self, value):
+        if type(value) != dict:
+            return self._parse(value, "")
+        parse = self.value_type._parse_node
+        for name in value:
+            try:
+                value[name] = parse(value[name], True)
+            except _ParseError as e:
+                raise e.within("[{}]".format(name))
+        return value
+
 class StringMapParameter(SchemaParameter):
+    __slots__ = ('value_type',)
+
     def __init__(self, description, **kwargs):
         self.value_type = StringParameter("Value")
         add_schema = {
@@ -179,15 +710,33 @@ class StringMapParameter(SchemaParameter):
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.jsonType = "object"
 
+    _parse_types = (dict,)
+
     def _parse(self, value, context=""):
         if type(value) != dict:
             raise Exception("Expected to parse a dict!")
         return value
 
 
+def _typed_array(value):
+    """ Whether value is an array.array or a numpy array, which arrays of numbers parse from too """
+    kind = type(value)
+    return kind is array.array or (kind.__name__ == 'ndarray' and kind.__module__ == 'numpy')
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("ArrayParameter output='numpy' needs numpy, which isn't installed")
+    return numpy
+
+
 class ArrayParameter(SchemaParameter):
-    def __init__(self, description, element, min_items=0, max_items=None, unique=False, **kwargs):
-        add_schema = {'items': element.to_schema()}
+    __slots__ = ('element', 'output')
+
+    def __init__(self, description, element, min_items=0, max_items=None, unique=False, output="list", **kwargs):
+        add_schema = {'items': element}
         if min_items > 0:
             add_schema["minItems"] = min_items
         if max_items:
@@ -197,14 +746,97 @@ class ArrayParameter(SchemaParameter):
 
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.element = element
+        # Arrays of numbers can also parse into an array.array ("array") or a numpy array ("numpy")
+        self.output = output
+        if output != "list":
+            if _typecode(element) is None:
+                raise Exception("Only arrays of FloatParameter or IntParameter can have output '{}'".format(output))
+            if output == "numpy":
+                _numpy()
+            elif output != "array":
+                raise Exception("Unknown array output '{}'".format(output))
         self.jsonType = "array"
 
+    _parse_types = (list, tuple)
+
+    def _makes_objects(self):
+        return self.output != "list"
+
     def _parse(self, value, context=""):
         if type(value) not in (list, tuple):
-            raise Exception("Expected to parse a list or tuple!")
-        return [self.element.parse(v, context + "[{}/{}]".format(i, len(value))) for i, v in enumerate(value)]
+            if not _typed_array(value):
+                raise Exception("Expected to parse a list or tuple!")
+            value = value.tolist()
+        typecode = _typecode(self.element)
+        if typecode is not None:
+            return self._parse_numbers(value, typecode)
+        return self._parse_elements(value)
+
+    def _normalize(self, value):
+        if type(value) != list or _typecode(self.element) is not None:
+            return self._parse(value, "")
+        parse = self.element._parse_node
+        for i, v in enumerate(value):
+            try:
+                value[i] = parse(v, True)
+            except _ParseError as e:
+                raise e.within("[{}/{}]".format(i, len(value)))
+        return value
+
+    def _parse_elements(self, value):
+        out = []
+        parse = self.element._parse_node
+        try:
+            for v in value:
+                out.append(parse(v))
+        except _ParseError as e:
+            raise e.within("[{}/{}]".format(len(out), len(value)))
+        return out
+
+    def _parse_numbers(self, value, typecode):
+        # array.array converts ints, floats and bools exactly like float() and int() do, in one call.
+        # Anything else (strings, None, ints too big for 64 bits) is parsed one element at a time.
+        try:
+            numbers = array.array(typecode, value)
+        except (TypeError, OverflowError):
+            numbers = self._parse_elements(value)
+        if self.output == "list":
+            # unchecked against minimum and maximum, like the FloatParameter and IntParameter values it holds
+            return numbers.tolist() if type(numbers) is array.array else numbers
+        if type(numbers) is not array.array:
+            try:
+                numbers = array.array(typecode, numbers)
+            except (TypeError, OverflowError) as e:
+                raise Exception("Can't store the parsed values as an array: {}".format(e))
+        if self.output == "numpy":
+            numbers = _numpy().frombuffer(numbers, dtype='float64' if typecode == 'd' else 'int64')
+        self._check_bounds(numbers)
+        return numbers
+
+    def _check_bounds(self, numbers):
+        # only typed outputs check the element's minimum and maximum, lists parse like their elements do
+        schema = self.element._frozen_schema()
+        low, high = schema.get('minimum', None), schema.get('maximum', None)
+        if (low is None and high is None) or not len(numbers):
+            return
+        # numpy arrays find their own extremes much faster than min() and max() can
+        lowest, highest = (numbers.min(), numbers.max()) if hasattr(numbers, 'min') else (min(numbers), max(numbers))
+        if low is not None and lowest < low:
+            problem = "{} is less than the minimum of {}"
+            index = next(i for i, n in enumerate(numbers) if n < low)
+            bound = low
+        elif high is not None and highest > high:
+            problem = "{} is greater than the maximum of {}"
+            index = next(i for i, n in enumerate(numbers) if n > high)
+            bound = high
+        else:
+            return
+        error = Exception(problem.format(numbers[index], bound))
+        raise _ParseError.wrap(error, "").within("[{}/{}]".format(index, len(numbers)))
 
 class FloatParameter(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, minimum=None, maximum=None, **kwargs):
         add_schema = {}
         if minimum:
@@ -214,10 +846,14 @@ class FloatParameter(SchemaParameter):
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.jsonType = "number"
 
+    _parse_types = (int, float, bool, str)
+
     def _parse(self, value, context=""):
         return float(value)
 
 class IntParameter(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, minimum=None, maximum=None, **kwargs):
         add_schema = {}
         if minimum:
@@ -227,37 +863,229 @@ class IntParameter(SchemaParameter):
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.jsonType = "integer"
 
+    _parse_types = (int, float, bool, str)
+
     def _parse(self, value, context=""):
         return int(value)
 
-class IsoDateParameter(StringParameter):
+# Formats every supported python's fromisoformat reads, tried before the general ISO 8601 regex
+_FAST_DATE = re.compile(r'\d{4}-\d\d-\d\d$')
+_FAST_LOCAL = re.compile(r'\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(\.\d{3}|\.\d{6})?$')
+_FAST_ISO = re.compile(r'\d{4}-\d\d-\d\d([T ]\d\d:\d\d(:\d\d(\.\d{3}|\.\d{6})?)?([+-]\d\d:\d\d)?)?$')
+_ISO = re.compile(
+    r'(?P<year>[+-]?\d{4})(-?((?P<month>\d\d)(-?(?P<day>\d\d))?|W(?P<week>\d\d)(-?(?P<weekday>[1-7]))?|(?P<ordinal>\d{3})))?'
+    r'([T\s](?P<hour>\d\d)(:?(?P<minute>\d\d)(:?(?P<second>\d\d))?)?([.,](?P<fraction>\d+))?)?'
+    r'(?P<offset>Z|[+-]\d\d(:?\d\d)?)?$')
+
+# Parsed dates and times by (kind, text); schedules repeat the same few a lot
+_parsed_dates = {}
+
+
+def _iso_datetime(text):
+    """ Any ISO 8601 date or date and time, as a datetime that is naive unless it had an offset """
+    m = _ISO.match(text)
+    if m is None:
+        raise ValueError("{} is not an ISO 8601 date".format(text))
+    g = m.groupdict()
+    year = int(g['year'])
+    if g['week'] is not None:
+        day = datetime.date.fromisocalendar(year, int(g['week']), int(g['weekday'] or 1))
+    elif g['ordinal'] is not None:
+        day = datetime.date(year, 1, 1) + datetime.timedelta(days=int(g['ordinal']) - 1)
+        if day.year != year:
+            raise ValueError("{} has a day past the end of the year".format(text))
+    else:
+        day = datetime.date(year, int(g['month'] or 1), int(g['day'] or 1))
+    hour, minute, second = (int(g[k] or 0) for k in ('hour', 'minute', 'second'))
+    microsecond = int(g['fraction'][:6].ljust(6, '0')) if g['fraction'] else 0
+    tz = None
+    if g['offset'] == 'Z':
+        tz = datetime.timezone.utc
+    elif g['offset']:
+        sign = -1 if g['offset'][0] == '-' else 1
+        digits = g['offset'][1:].replace(':', '')
+        tz = datetime.timezone(sign * datetime.timedelta(hours=int(digits[:2]), minutes=int(digits[2:] or 0)))
+    if hour == 24 and minute == second == microsecond == 0:
+        return datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(tzinfo=tz))
+    return datetime.datetime.combine(day, datetime.time(hour, minute, second, microsecond, tzinfo=tz))
+
+
+def _parse_date(text, kind, strict):
+    """
+    text as a date ('date'), a naive datetime ('local') or a datetime ('datetime'). strict is the
+    pattern the parameter validates strings with, if it has one.
+    """
+    key = (kind, strict, text)
+    found = _parsed_dates.get(key, None)
+    if found is not None:
+        return found
+    parsed = None
+    try:
+        if kind == 'date' and _FAST_DATE.match(text):
+            parsed = datetime.date.fromisoformat(text)
+        elif kind == 'local' and _FAST_LOCAL.match(text):
+            parsed = datetime.datetime.fromisoformat(text)
+        elif kind == 'datetime' and _FAST_ISO.match(text):
+            parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        # 24:00 and the like, which the general parser takes care of
+        pass
+    if parsed is None:
+        if strict is not None and not re.match(strict, text):
+            raise ValueError("{} does not match {}".format(text, strict))
+        parsed = _iso_datetime(text)
+        if kind == 'date':
+            parsed = parsed.date()
+        elif kind == 'local' and parsed.tzinfo is not None:
+            raise ValueError("{} is not a local time, it has an offset".format(text))
+    if len(_parsed_dates) >= 1024:
+        _parsed_dates.clear()
+    _parsed_dates[key] = parsed
+    return parsed
+
+
+class _DateParameter(StringParameter):
+    """
+    A string parameter holding an ISO 8601 date or time. With output="datetime" it parses into a
+    date or datetime, which checks the format too. The schema is the same either way: the JSON
+    schema formats are RFC 3339's, which reject the local and abbreviated times these take.
+    """
+    __slots__ = ('output', '_strict')
+
+    _kind = None
+    _parse_types = (str,)
+
+    def __init__(self, description, pattern=None, output="str", **kwargs):
+        if output not in ("str", "datetime"):
+            raise Exception("output must be 'str' or 'datetime', not '{}'".format(output))
+        self.output = output
+        self._strict = pattern
+        StringParameter.__init__(self, description, pattern=pattern, **kwargs)
+
+    def _makes_objects(self):
+        return self.output == "datetime"
+
+    def _parse(self, value, context=""):
+        if self.output == "str":
+            return value.strip()
+        if isinstance(value, datetime.date):
+            # already parsed, like the values of a LazyObject
+            return value
+        return _parse_date(value.strip(), self._kind, self._strict)
+
+class IsoDateParameter(_DateParameter):
+    __slots__ = ()
+
+    _kind = 'datetime'
+
     def __init__(self, description, **kwargs):
-        StringParameter.__init__(self, description, **kwargs)
+        _DateParameter.__init__(self, description, **kwargs)
+
+class NaiveIsoDateParameter(_DateParameter):
+    __slots__ = ()
+
+    _kind = 'date'
 
-class NaiveIsoDateParameter(StringParameter):
     def __init__(self, description, **kwargs):
         pattern = r"^([\+-]?\d{4}(?!\d{2}\b))((-?)((0[1-9]|1[0-2])(\3([12]\d|0[1-9]|3[01]))?|W([0-4]\d|5[0-2])(-?[1-7])?|(00[1-9]|0[1-9]\d|[12]\d{2}|3([0-5]\d|6[1-6]))))$"
-        StringParameter.__init__(self, description, **kwargs)
+        _DateParameter.__init__(self, description, **kwargs)
+        # the pattern isn't in the schema, but a string that doesn't match it can't be parsed
+        self._strict = pattern
+
+class LocalIsoDateTimeParameter(_DateParameter):
+    __slots__ = ()
+
+    _kind = 'local'
 
-class LocalIsoDateTimeParameter(StringParameter):
     def __init__(self, description, **kwargs):
         pattern = r"^([\+-]?\d{4}(?!\d{2}\b))((-?)((0[1-9]|1[0-2])(\3([12]\d|0[1-9]|3[01]))?|W([0-4]\d|5[0-2])(-?[1-7])?|(00[1-9]|0[1-9]\d|[12]\d{2}|3([0-5]\d|6[1-6])))([T\s]((([01]\d|2[0-3])((:?)[0-5]\d)?|24\:?00)([\.,]\d+(?!:))?)?(\17[0-5]\d([\.,]\d+)?)))$"
-        StringParameter.__init__(self, description, pattern=pattern, **kwargs)
+        _DateParameter.__init__(self, description, pattern=pattern, **kwargs)
+
+def _typecode(element):
+    """ The array.array typecode an ArrayParameter of this element can parse into, if it's a number """
+    owner = _parse_owner(element)
+    if owner is FloatParameter:
+        return 'd'
+    if owner is IntParameter:
+        return 'q'
+    return None
+
+
+def _parse_owner(option):
+    """ The class whose _parse an option runs """
+    for cls in type(option).__mro__:
+        if '_parse' in cls.__dict__:
+            return cls
+
+
+class _UnionIndex(object):
+    """
+    Narrows the options of a OneOf/AnyOf down to the ones whose _parse could succeed for a value,
+    keyed on the value's type, enum options and the required properties of object options.
+    Whatever is left is still tried in order, so the result is the same as trying every option.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.edits = SchemaParameter._edits
+        self.by_type = {}
+        for t in (str, bool, int, float, dict, list, tuple):
+            entries = []
+            for option in options:
+                types = _parse_owner(option).__dict__.get('_parse_types', None)
+                if types is None or t in types:
+                    entries.append((option, self._guard(option, t)))
+            guarded = entries if any(guard for option, guard in entries) else None
+            self.by_type[t] = (tuple(option for option, guard in entries), guarded)
+
+    @staticmethod
+    def _guard(option, t):
+        owner = _parse_owner(option)
+        if owner is EnumParameter and t is str:
+            return lambda value: value.strip() in option.options
+        if owner is ObjectParameter and t is dict:
+            required = []
+            for name, prop in option.properties.items():
+                prop._observed = True
+                if prop.is_required():
+                    required.append(name)
+            if required:
+                return lambda value: all(value.get(name) is not None for name in required)
+        return None
+
+    @classmethod
+    def of(cls, union):
+        index = union._index
+        if index is None or index.options is not union.options or index.edits != SchemaParameter._edits:
+            index = union._index = cls(union.options)
+        return index
+
+    def candidates(self, value):
+        found = self.by_type.get(type(value), None)
+        if found is None:
+            return self.options
+        options, guarded = found
+        if guarded is None:
+            return options
+        return [option for option, guard in guarded if guard is None or guard(value)]
+
 
 class OneOfParameter(SchemaParameter):
+    __slots__ = ('options', '_index')
+
     def __init__(self, description, options, **kwargs):
         self.options = options
+        self._index = None
         add_schema = {
-            "oneOf": [o.to_schema() for o in options]
+            "oneOf": list(options)
         }
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.jsonType = [o.jsonType for o in options]
 
     def _parse(self, value, context):
         if value is not None:
-            for option in self.options:
+            for option in _UnionIndex.of(self).candidates(value):
                 try:
-                    val = option.parse(value, context+":OneOf:")
+                    val = option._parse_node(value)
                     if val is not None:
                         return val
                 except Exception as e:
@@ -266,19 +1094,22 @@ class OneOfParameter(SchemaParameter):
         return False
 
 class AnyOfParameter(SchemaParameter):
+    __slots__ = ('options', '_index')
+
     def __init__(self, description, options, **kwargs):
         self.options = options
+        self._index = None
         add_schema = {
-            "anyOf": [o.to_schema() for o in options]
+            "anyOf": list(options)
         }
         SchemaParameter.__init__(self, description, more_schema=add_schema, **kwargs)
         self.jsonType = [o.jsonType for o in options]
 
     def _parse(self, value, context):
         if value is not None:
-            for option in self.options:
+            for option in _UnionIndex.of(self).candidates(value):
                 try:
-                    val = option.parse(value, context+":AnyOf:")
+                    val = option._parse_node(value)
                     if val is not None:
                         return val
                 except Exception as e:
@@ -287,50 +1118,123 @@ class AnyOfParameter(SchemaParameter):
         return False
 
 class JsonParameter(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         SchemaParameter.__init__(self, description, **kwargs)
         self.jsonType = ["array", "boolean", "integer", "number", "object", "string"]
 
 class SchemaResult(SchemaParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         SchemaParameter.__init__(self, description, **kwargs)
 
 class StringResult(StringParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         StringParameter.__init__(self, description, **kwargs)
 
 class ObjectResult(ObjectParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         ObjectParameter.__init__(self, description, **kwargs)
 
 class ArrayResult(ArrayParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         ArrayParameter.__init__(self, description, **kwargs)
 
 class FloatResult(FloatParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         FloatParameter.__init__(self, description, **kwargs)
 
 class IntResult(IntParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         IntParameter.__init__(self, description, **kwargs)
 
 class IsoDateResult(IsoDateParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         IsoDateParameter.__init__(self, description, **kwargs)
 
 class LooseObjectResult(LooseObjectParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         LooseObjectParameter.__init__(self, description, **kwargs)
 
 class JsonResult(JsonParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         JsonParameter.__init__(self, description, **kwargs)
 
 class UriResult(UriParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         UriParameter.__init__(self, description, **kwargs)
 
 class UuidResult(UuidParameter):
+    __slots__ = ()
+
     def __init__(self, description, **kwargs):
         UuidParameter.__init__(self, description, **kwargs)
+
+
+def schema_footprint(*schemas):
+    """
+    Approximate memory held by the given parameters and schemas, in bytes. Every object is counted
+    once, however many nodes share it, so shared fragments show up as more fragment_references
+    than fragments. The node figures include the schema templates the nodes are built from.
+    """
+    report = {'nodes': 0, 'node_bytes': 0, 'fragments': 0, 'fragment_references': 0, 'schema_bytes': 0}
+    seen = set()
+
+    def walk(value, bucket):
+        if isinstance(value, SchemaParameter):
+            pending.append(value)
+            return
+        if isinstance(value, (FrozenDict, FrozenList)):
+            report['fragment_references'] += 1
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        report[bucket] += sys.getsizeof(value)
+        if isinstance(value, (FrozenDict, FrozenList)):
+            report['fragments'] += 1
+        if isinstance(value, dict):
+            for k, v in value.items():
+                walk(k, bucket)
+                walk(v, bucket)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                walk(v, bucket)
+
+    pending = []
+    for schema in schemas:
+        walk(schema, 'schema_bytes')
+    while pending:
+        node = pending.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        report['nodes'] += 1
+        report['node_bytes'] += sys.getsizeof(node)
+        if hasattr(node, '__dict__'):
+            report['node_bytes'] += sys.getsizeof(node.__dict__)
+        schema = node._frozen_schema()
+        walk(schema, 'schema_bytes')
+        if node._schema is not schema:
+            walk(node._schema, 'node_bytes')
+    report['total_bytes'] = report['node_bytes'] + report['schema_bytes']
+    return report
@@ -0,0 +1,562 @@
+import re
+import marshal
+import numbers
+import pickle
+from jsonschema.exceptions import ValidationError
+
+
+# Keywords Draft4Validator acts on that our parameters never produce. We refuse
+# to compile them rather than silently skipping a check.
+UNSUPPORTED = ('$ref', 'dependencies', 'additionalItems')
+
+_STRING_KEYWORDS = ('pattern', 'minLength', 'maxLength')
+_NUMBER_KEYWORDS = ('minimum', 'maximum', 'multipleOf')
+_OBJECT_KEYWORDS = ('properties', 'required', 'minProperties', 'maxProperties',
+                    'patternProperties', 'additionalProperties')
+_ARRAY_KEYWORDS = ('items', 'minItems', 'maxItems', 'uniqueItems')
+_ANY_KEYWORDS = ('enum', 'oneOf', 'anyOf', 'allOf', 'not')
+
+_TYPE_CHECKS = {
+    'string': "isinstance({0}, str)",
+    'number': "(isinstance({0}, _Number) and not isinstance({0}, bool))",
+    'integer': "(isinstance({0}, int) and not isinstance({0}, bool))",
+    'object': "isinstance({0}, dict)",
+    'array': "isinstance({0}, list)",
+    'boolean': "isinstance({0}, bool)",
+    'null': "{0} is None",
+}
+
+_MISSING = object()
+
+
+def _ensure_list(thing):
+    return [thing] if isinstance(thing, str) else list(thing)
+
+
+def _unbool(element):
+    if element is True:
+        return True, "bool"
+    elif element is False:
+        return False, "bool"
+    return element
+
+
+def _uniq(container):
+    # Same semantics as jsonschema._utils.uniq
+    try:
+        return len(set(_unbool(i) for i in container)) == len(container)
+    except TypeError:
+        seen = []
+        for e in container:
+            e = _unbool(e)
+            if e in seen:
+                return False
+            seen.append(e)
+    return True
+
+
+def _error(message, validator, validator_value, instance, schema, context=()):
+    return ValidationError(
+        message,
+        validator=validator,
+        validator_value=validator_value,
+        instance=instance,
+        schema=schema,
+        schema_path=(validator,),
+        context=context
+    )
+
+
+def _descend(errors, path, schema_path):
+    for error in errors:
+        if path is not None:
+            error.path.appendleft(path)
+        error.schema_path.extendleft(reversed(schema_path))
+        yield error
+
+
+def _additional_errors(instance, schema, extras):
+    patterns = sorted(schema["patternProperties"]) if "patternProperties" in schema else None
+    if patterns is not None:
+        verb = "does" if len(extras) == 1 else "do"
+        message = "%s %s not match any of the regexes: %s" % (
+            ", ".join(map(repr, sorted(extras))), verb, ", ".join(map(repr, patterns)))
+    else:
+        verb = "was" if len(extras) == 1 else "were"
+        message = "Additional properties are not allowed (%s %s unexpected)" % (
+            ", ".join(repr(extra) for extra in extras), verb)
+    return _error(message, 'additionalProperties', schema['additionalProperties'], instance, schema)
+
+
+def _one_of_errors(instance, options, schema):
+    all_errors = []
+    first_valid = None
+    for index, (check, errors, subschema) in enumerate(options):
+        if check(instance):
+            first_valid = index
+            break
+        all_errors.extend(_descend(errors(instance), None, (index,)))
+    else:
+        yield _error("%r is not valid under any of the given schemas" % (instance,),
+                     'oneOf', schema['oneOf'], instance, schema, context=all_errors)
+        return
+
+    more_valid = [s for (check, errors, s) in options[first_valid + 1:] if check(instance)]
+    if more_valid:
+        more_valid.append(options[first_valid][2])
+        reprs = ", ".join(repr(s) for s in more_valid)
+        yield _error("%r is valid under each of %s" % (instance, reprs), 'oneOf', schema['oneOf'], instance, schema)
+
+
+def _any_of_errors(instance, options, schema):
+    all_errors = []
+    for index, (check, errors, subschema) in enumerate(options):
+        if check(instance):
+            return
+        all_errors.extend(_descend(errors(instance), None, (index,)))
+    yield _error("%r is not valid under any of the given schemas" % (instance,),
+                 'anyOf', schema['anyOf'], instance, schema, context=all_errors)
+
+
+class _Compiler(object):
+    """
+    Turns a draft-04 schema (as produced by SchemaParameter.to_schema) into python source. Every
+    schema node gets two functions: _check_N, a boolean fast path that allocates nothing, and
+    _errors_N, a generator that mirrors Draft4Validator.iter_errors keyword by keyword so the
+    messages, paths and ordering match. Errors are only generated for subtrees that fail _check_N.
+    """
+    def __init__(self):
+        self.lines = []
+        self.consts = []
+        self.names = {}
+        self.pending = []
+        self.deferred = []
+
+    def const(self, value):
+        self.consts.append(value)
+        return "_c[{}]".format(len(self.consts) - 1)
+
+    def regex(self, pattern):
+        return self.const(re.compile(pattern).search)
+
+    def node(self, schema):
+        key = id(schema)
+        if key not in self.names:
+            for keyword in UNSUPPORTED:
+                if keyword in schema:
+                    raise Exception("Schema keyword '{}' is not supported by the schema compiler".format(keyword))
+            for t in _ensure_list(schema.get('type', ())):
+                if t not in _TYPE_CHECKS:
+                    raise Exception("Unknown schema type '{}'".format(t))
+            self.names[key] = len(self.names)
+            self.pending.append(schema)
+        return self.names[key]
+
+    def compile(self, schema):
+        root = self.node(schema)
+        while self.pending:
+            s = self.pending.pop()
+            self._emit_check(s)
+            self._emit_errors(s)
+            self._emit_errors(s, counting=True)
+        return root
+
+    # --- fast path -----------------------------------------------------------------------------
+
+    @staticmethod
+    def is_leaf(schema):
+        return not any(k in schema for k in _OBJECT_KEYWORDS + _ARRAY_KEYWORDS + _ANY_KEYWORDS[1:])
+
+    def check_expr(self, schema, var):
+        """ A boolean expression validating var, inlined for leaf schemas """
+        if not self.is_leaf(schema):
+            return "_check_{}({})".format(self.node(schema), var)
+
+        terms = []
+        if 'enum' in schema:
+            terms.append(self.enum_expr(schema['enum'], var))
+
+        if 'type' in schema:
+            branches = []
+            for t in _ensure_list(schema['type']):
+                branches.append(" and ".join([_TYPE_CHECKS[t].format(var)] + self.leaf_terms(schema, t, var)))
+            terms.append("({})".format(" or ".join(branches)) if len(branches) > 1 else branches[0])
+        else:
+            for t, guard in (('string', "not isinstance({0}, str)"),
+                             ('number', "not isinstance({0}, _Number) or isinstance({0}, bool)")):
+                more = self.leaf_terms(schema, t, var)
+                if more:
+                    terms.append("({} or ({}))".format(guard.format(var), " and ".join(more)))
+
+        return "({})".format(" and ".join(terms)) if terms else "True"
+
+    def enum_expr(self, enum, var):
+        if all(isinstance(e, str) for e in enum):
+            return "(isinstance({0}, str) and {0} in {1})".format(var, self.const(frozenset(enum)))
+        return "{} in {}".format(var, self.const(enum))
+
+    def leaf_terms(self, schema, t, var):
+        terms = []
+        if t == 'string':
+            if 'pattern' in schema:
+                terms.append("{}({}) is not None".format(self.regex(schema['pattern']), var))
+            if 'minLength' in schema:
+                terms.append("len({}) >= {!r}".format(var, schema['minLength']))
+            if 'maxLength' in schema:
+                terms.append("len({}) <= {!r}".format(var, schema['maxLength']))
+        elif t in ('number', 'integer'):
+            if 'minimum' in schema:
+                op = ">" if schema.get('exclusiveMinimum', False) else ">="
+                terms.append("{} {} {}".format(var, op, self.const(schema['minimum'])))
+            if 'maximum' in schema:
+                op = "<" if schema.get('exclusiveMaximum', False) else "<="
+                terms.append("{} {} {}".format(var, op, self.const(schema['maximum'])))
+            if 'multipleOf' in schema:
+                terms.append("_multiple_of({}, {})".format(var, self.const(schema['multipleOf'])))
+        return terms
+
+    def _emit_check(self, schema):
+        n = self.names[id(schema)]
+        out = self.lines
+        if self.is_leaf(schema):
+            out.append("def _check_{}(x):".format(n))
+            out.append("    return {}".format(self.check_expr(schema, "x")))
+            out.append("")
+            return
+
+        out.append("def _check_{}(x):".format(n))
+        if 'enum' in schema:
+            out.append("    if not {}: return False".format(self.enum_expr(schema['enum'], "x")))
+        if 'oneOf' in schema:
+            checks = [self.check_expr(s, "x") for s in schema['oneOf']]
+            out.append("    if [{}].count(True) != 1: return False".format(", ".join(checks)))
+        if 'anyOf' in schema:
+            out.append("    if not ({}): return False".format(" or ".join(self.check_expr(s, "x") for s in schema['anyOf'])))
+        if 'allOf' in schema:
+            out.append("    if not ({}): return False".format(" and ".join(self.check_expr(s, "x") for s in schema['allOf'])))
+        if 'not' in schema:
+            out.append("    if {}: return False".format(self.check_expr(schema['not'], "x")))
+
+        types = _ensure_list(schema['type']) if 'type' in schema else list(_TYPE_CHECKS)
+        for t in types:
+            if t == 'object':
+                body = self.object_lines(schema)
+            elif t == 'array':
+                body = self.array_lines(schema)
+            else:
+                terms = self.leaf_terms(schema, t, "x")
+                body = ["if not ({}): return False".format(" and ".join(terms))] if terms else []
+            out.append("    if {}:".format(_TYPE_CHECKS[t].format("x")))
+            for line in body:
+                out.append("        " + line)
+            out.append("        return True")
+        out.append("    return {}".format('False' if 'type' in schema else 'True'))
+        out.append("")
+
+    def object_lines(self, schema):
+        lines = []
+        if 'minProperties' in schema:
+            lines.append("if len(x) < {!r}: return False".format(schema['minProperties']))
+        if 'maxProperties' in schema:
+            lines.append("if len(x) > {!r}: return False".format(schema['maxProperties']))
+
+        properties = schema.get('properties', {})
+        required = schema.get('required', [])
+        for name, subschema in properties.items():
+            lines.append("_v = x.get({!r}, _MISSING)".format(name))
+            if name in required:
+                lines.append("if _v is _MISSING: return False")
+                lines.append("if not {}: return False".format(self.check_expr(subschema, "_v")))
+            else:
+                lines.append("if _v is not _MISSING and not {}: return False".format(self.check_expr(subschema, "_v")))
+        for name in required:
+            if name not in properties:
+                lines.append("if {!r} not in x: return False".format(name))
+
+        patterns = schema.get('patternProperties', {})
+        for pattern, subschema in patterns.items():
+            lines.append("for _k, _v in x.items():")
+            lines.append("    if {}(_k) and not {}: return False".format(self.regex(pattern), self.check_expr(subschema, "_v")))
+
+        if 'additionalProperties' in schema:
+            aP = schema['additionalProperties']
+            if isinstance(aP, dict) or not aP:
+                known = self.const(frozenset(properties))
+                lines.append("for _k, _v in x.items():")
+                if patterns:
+                    lines.append("    if _k in {} or {}(_k): continue".format(known, self.regex("|".join(patterns))))
+                else:
+                    lines.append("    if _k in {}: continue".format(known))
+                if isinstance(aP, dict):
+                    lines.append("    if not {}: return False".format(self.check_expr(aP, "_v")))
+                else:
+                    lines.append("    return False")
+        return lines
+
+    def array_lines(self, schema):
+        lines = []
+        if 'minItems' in schema:
+            lines.append("if len(x) < {!r}: return False".format(schema['minItems']))
+        if 'maxItems' in schema:
+            lines.append("if len(x) > {!r}: return False".format(schema['maxItems']))
+        items = schema.get('items', None)
+        if isinstance(items, dict):
+            lines.append("for _v in x:")
+            lines.append("    if not {}: return False".format(self.check_expr(items, "_v")))
+        elif items is not None:
+            for index, subschema in enumerate(items):
+                lines.append("if len(x) > {0} and not {1}: return False".format(index, self.check_expr(subschema, "x[{}]".format(index))))
+        if schema.get('uniqueItems', False):
+            lines.append("if not _uniq(x): return False")
+        return lines
+
+    # --- error path ----------------------------------------------------------------------------
+
+    def _emit_errors(self, schema, counting=False):
+        """
+        _errors_N, or with counting _count_N(x, _p, _t): the same walk adding one to _t[(path, keyword)]
+        for every error _errors_N would yield after the first _t[None] of them, where path is _p
+        followed by the property names and '*' for array indexes, each ending in '/'. No message or
+        ValidationError is made, and the paths are strings so their hashes are kept.
+        """
+        n = self.names[id(schema)]
+        s = self.const(schema)
+        out = ["def _count_{}(x, _p, _t):".format(n) if counting else "def _errors_{}(x):".format(n)]
+
+        def tally(keyword, indent):
+            out.append("{}if _t[None]:".format(indent))
+            out.append("{}    _t[None] -= 1".format(indent))
+            out.append("{}else:".format(indent))
+            out.append("{}    _t[_p, {!r}] = _t.get((_p, {!r}), 0) + 1".format(indent, keyword, keyword))
+
+        def leaf(keyword, condition, message):
+            out.append("    if {}:".format(condition))
+            if counting:
+                tally(keyword, "        ")
+            else:
+                out.append("        yield _error({}, {!r}, {}['{}'], x, {})".format(message, keyword, s, keyword, s))
+
+        def descend(subschema, var, path, schema_path, indent="    "):
+            out.append("{}if not {}:".format(indent, self.check_expr(subschema, var)))
+            if counting:
+                if path is None:
+                    place = "_p"
+                elif path == "_i":
+                    # worked out before the loop over the items
+                    place = "_pi"
+                elif isinstance(path, int):
+                    place = "_p + '*/'"
+                elif path == "_k":
+                    place = "_p + _k + '/'"
+                else:
+                    place = "_p + {!r}".format(eval(path) + "/")
+                out.append("{}    _count_{}({}, {}, _t)".format(indent, self.node(subschema), var, place))
+                return
+            # inlined _descend, a generator per level is most of the cost of a deep error
+            out.append("{}    for _e in _errors_{}({}):".format(indent, self.node(subschema), var))
+            if path is not None:
+                out.append("{}        _e.path.appendleft({})".format(indent, path))
+            out.append("{}        _e.schema_path.extendleft({!r})".format(indent, tuple(reversed(schema_path))))
+            out.append("{}        yield _e".format(indent))
+
+        for keyword, value in schema.items():
+            if keyword == 'type':
+                types = _ensure_list(value)
+                condition = "not ({})".format(" or ".join(_TYPE_CHECKS[t].format("x") for t in types))
+                message = "'%r is not of type %s' % (x, {!r})".format(", ".join(repr(t) for t in types))
+                leaf(keyword, condition, message)
+            elif keyword == 'enum':
+                leaf(keyword, "not {}".format(self.enum_expr(value, "x")), "'%r is not one of %r' % (x, {}['enum'])".format(s))
+            elif keyword == 'pattern':
+                leaf(keyword, "isinstance(x, str) and {}(x) is None".format(self.regex(value)),
+                     "'%r does not match %r' % (x, {}['pattern'])".format(s))
+            elif keyword == 'minLength':
+                leaf(keyword, "isinstance(x, str) and len(x) < {!r}".format(value), "'%r is too short' % (x,)")
+            elif keyword == 'maxLength':
+                leaf(keyword, "isinstance(x, str) and len(x) > {!r}".format(value), "'%r is too long' % (x,)")
+            elif keyword in ('minimum', 'maximum'):
+                minimum = keyword == 'minimum'
+                exclusive = schema.get('exclusiveMinimum' if minimum else 'exclusiveMaximum', False)
+                op = ("<=" if exclusive else "<") if minimum else (">=" if exclusive else ">")
+                cmp = ("less than" if minimum else "greater than") + (" or equal to" if exclusive else "")
+                leaf(keyword, "{} and x {} {}['{}']".format(_TYPE_CHECKS['number'].format("x"), op, s, keyword),
+                     "'%r is {} the {} of %r' % (x, {}['{}'])".format(cmp, keyword, s, keyword))
+            elif keyword == 'multipleOf':
+                leaf(keyword, "{} and not _multiple_of(x, {}['multipleOf'])".format(_TYPE_CHECKS['number'].format("x"), s),
+                     "'%r is not a multiple of %r' % (x, {}['multipleOf'])".format(s))
+            elif keyword == 'minItems':
+                leaf(keyword, "isinstance(x, list) and len(x) < {!r}".format(value), "'%r is too short' % (x,)")
+            elif keyword == 'maxItems':
+                leaf(keyword, "isinstance(x, list) and len(x) > {!r}".format(value), "'%r is too long' % (x,)")
+            elif keyword == 'uniqueItems':
+                leaf(keyword, "{!r} and isinstance(x, list) and not _uniq(x)".format(bool(value)),
+                     "'%r has non-unique elements' % (x,)")
+            elif keyword == 'minProperties':
+                leaf(keyword, "isinstance(x, dict) and len(x) < {!r}".format(value),
+                     "'%r does not have enough properties' % (x,)")
+            elif keyword == 'maxProperties':
+                leaf(keyword, "isinstance(x, dict) and len(x) > {!r}".format(value), "'%r has too many properties' % (x,)")
+            elif keyword == 'required' and value:
+                out.append("    if isinstance(x, dict):")
+                for name in value:
+                    out.append("        if {!r} not in x:".format(name))
+                    if counting:
+                        tally('required', "            ")
+                    else:
+                        out.append("            yield _error({!r}, 'required', {}['required'], x, {})".format(
+                            "%r is a required property" % name, s, s))
+            elif keyword == 'properties' and value:
+                out.append("    if isinstance(x, dict):")
+                for name, subschema in value.items():
+                    out.append("        if {!r} in x:".format(name))
+                    descend(subschema, "x[{!r}]".format(name), repr(name), ('properties', name), indent="            ")
+            elif keyword == 'patternProperties' and value:
+                out.append("    if isinstance(x, dict):")
+                for pattern, subschema in value.items():
+                    out.append("        for _k, _v in x.items():")
+                    out.append("            if {}(_k):".format(self.regex(pattern)))
+                    descend(subschema, "_v", "_k", ('patternProperties', pattern), indent="                ")
+            elif keyword == 'additionalProperties':
+                if not isinstance(value, dict) and value:
+                    continue
+                patterns = "|".join(schema.get('patternProperties', {}))
+                known = self.const(frozenset(schema.get('properties', {})))
+                out.append("    if isinstance(x, dict):")
+                if patterns:
+                    out.append("        _extras = set(_k for _k in x if _k not in {} and not {}(_k))".format(known, self.regex(patterns)))
+                else:
+                    out.append("        _extras = set(_k for _k in x if _k not in {})".format(known))
+                if isinstance(value, dict):
+                    out.append("        for _k in _extras:")
+                    descend(value, "x[_k]", "_k", ('additionalProperties',), indent="            ")
+                else:
+                    out.append("        if _extras:")
+                    if counting:
+                        tally('additionalProperties', "            ")
+                    else:
+                        out.append("            yield _additional_errors(x, {}, _extras)".format(s))
+            elif keyword == 'items' and value:
+                out.append("    if isinstance(x, list):")
+                if isinstance(value, dict):
+                    if counting:
+                        out.append("        _pi = _p + '*/'")
+                    out.append("        for _i, _v in enumerate(x):")
+                    descend(value, "_v", "_i", ('items',), indent="            ")
+                else:
+                    for index, subschema in enumerate(value):
+                        out.append("        if len(x) > {}:".format(index))
+                        descend(subschema, "x[{}]".format(index), index, ('items', index), indent="            ")
+            elif keyword == 'oneOf' and counting:
+                leaf(keyword, "[{}].count(True) != 1".format(", ".join(self.check_expr(o, "x") for o in value)), None)
+            elif keyword == 'anyOf' and counting:
+                leaf(keyword, "not ({})".format(" or ".join(self.check_expr(o, "x") for o in value)), None)
+            elif keyword in ('oneOf', 'anyOf'):
+                options = "[{}]".format(", ".join("(_check_{0}, _errors_{0}, {1})".format(self.node(o), self.const(o)) for o in value))
+                helper = "_one_of_errors" if keyword == 'oneOf' else "_any_of_errors"
+                out.append("    yield from {}(x, {}, {})".format(helper, self.const_expr(options), s))
+            elif keyword == 'allOf':
+                for index, subschema in enumerate(value):
+                    descend(subschema, "x", None, ('allOf', index))
+            elif keyword == 'not':
+                leaf(keyword, self.check_expr(value, "x"), "'%r is not allowed for %r' % ({}['not'], x)".format(s))
+
+        out.append("    return")
+        if not counting:
+            out.append("    yield")
+        out.append("")
+        self.lines.extend(out)
+
+    def const_expr(self, source):
+        """ A constant evaluated once, after every generated function is defined """
+        self.consts.append(None)
+        self.deferred.append((len(self.consts) - 1, source))
+        return "_c[{}]".format(len(self.consts) - 1)
+
+
+def _multiple_of(instance, dB):
+    if isinstance(dB, float):
+        quotient = instance / dB
+        return int(quotient) == quotient
+    return not instance % dB
+
+
+class CompiledValidator(object):
+    """
+    A drop-in replacement for Draft4Validator (is_valid, iter_errors, validate) for schemas
+    built from SchemaParameter trees. 'format' is not checked, just like a Draft4Validator
+    created without a format_checker.
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        compiler = _Compiler()
+        self._root = compiler.compile(schema)
+        self.source = "\n".join(compiler.lines)
+        self._consts = compiler.consts
+        self._deferred = compiler.deferred
+        self._link(compile(self.source, "<compiled schema>", "exec"))
+
+    def _link(self, code):
+        namespace = {
+            '_c': self._consts,
+            '_Number': numbers.Number,
+            '_MISSING': _MISSING,
+            '_uniq': _uniq,
+            '_multiple_of': _multiple_of,
+            '_error': _error,
+            '_descend': _descend,
+            '_additional_errors': _additional_errors,
+            '_one_of_errors': _one_of_errors,
+            '_any_of_errors': _any_of_errors,
+        }
+        exec(code, namespace)
+        for index, source in self._deferred:
+            self._consts[index] = eval(source, namespace)
+
+        self._check = namespace["_check_{}".format(self._root)]
+        self._errors = namespace["_errors_{}".format(self._root)]
+        self._count = namespace["_count_{}".format(self._root)]
+
+    def to_artifact(self):
+        """
+        The compiled validator as bytes, for from_artifact to load in another process without
+        generating or compiling any code. Only valid for the python version that wrote it.
+        """
+        consts = list(self._consts)
+        for index, source in self._deferred:
+            consts[index] = None
+        code = compile(self.source, "<compiled schema>", "exec")
+        return pickle.dumps((self.source, marshal.dumps(code), consts, self._deferred, self._root),
+                            pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_artifact(cls, schema, artifact):
+        """ A validator for schema, loaded from the bytes to_artifact wrote for that schema """
+        validator = cls.__new__(cls)
+        validator.schema = schema
+        validator.source, code, validator._consts, validator._deferred, validator._root = pickle.loads(artifact)
+        validator._link(marshal.loads(code))
+        return validator
+
+    def is_valid(self, instance):
+        return self._check(instance)
+
+    def iter_errors(self, instance):
+        if self._check(instance):
+            return iter(())
+        return self._errors(instance)
+
+    def count_errors(self, instance, prefix=(), skip=0):
+        """
+        How many errors iter_errors would yield after its first `skip`, by (path, validator), in the
+        order they'd come, without making any. Paths are '/'-joined and start with the prefix parts,
+        with '*' for every array index.
+        """
+        counts = {None: skip}
+        if not self._check(instance):
+            self._count(instance, "".join(str(p) + "/" for p in prefix), counts)
+        del counts[None]
+        return {(path[:-1], validator): count for (path, validator), count in counts.items()}
+
+    def validate(self, instance):
+        for error in self.iter_errors(instance):
+            raise error
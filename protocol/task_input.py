@@ -0,0 +1,102 @@
+"""
+What FulfillmentFunction and FulfillmentWorker do with a task's input before the handler gets it,
+and with the result it returns: the input is received and decoded or scanned as a stream,
+validated and parsed into kwargs, with an InputCache skipping whatever was done for it before.
+"""
+import json
+
+from .fulfillment_parser import InvocationPlan, parse_result
+from .schema import schema_footprint
+from .datazipper import DataZipper
+from .param_validator import ParamValidator
+from .event_stream import ArrayStream
+from .event_decoder import EventDecoder
+from .input_cache import InputCache
+
+
+class InputHandler(object):
+    def __init__(self, parameters, result, artifact_cache=None, stream=None, max_errors=None, fail_fast=False,
+                 result_policy=None, intern_strings=False, input_cache=None):
+        self._params = parameters
+        self._result = result
+        # A ResultPolicy, to parse only some of the results; None parses every one
+        self._result_policy = result_policy
+        # Whether results parse into plain JSON, so they're sent without converting records and the like
+        self._plain_result = result.plain_json()
+        # Decode events with their enum values sharing one string, for inputs that repeat them a lot
+        self._decoder = EventDecoder(parameters) if intern_strings else None
+        # An InputCache, for tasks that keep coming back with the same input
+        self._input_cache = input_cache
+        # kwarg names, parsers and defaults worked out once rather than for every task
+        self._plan = InvocationPlan(parameters)
+        # How many validation errors to describe in an INVALID response, the rest are only counted
+        self.validator = ParamValidator(parameters, artifact_cache, max_errors, fail_fast)
+        # The name of an ArrayParameter to hand the handler as an iterator, read incrementally
+        self.stream = ArrayStream(parameters, stream, artifact_cache, max_errors=max_errors,
+                                  fail_fast=fail_fast) if stream is not None else None
+
+    def memory_report(self, schema):
+        """ How much memory schema and the parameters hold, see schema_footprint, and what intern_strings saved """
+        report = schema_footprint(schema, self._result, *self._params.values())
+        if self._decoder is not None:
+            # what sharing strings has saved in the events decoded so far
+            report['shared_strings'] = self._decoder.shared
+            report['shared_string_bytes'] = self._decoder.saved_bytes
+        return report
+
+    def receive(self, event, in_place=False):
+        """ A TaskInput for event, a raw input or one already decoded; in_place if no one else holds it """
+        return TaskInput(self, event, in_place)
+
+    def parse_result(self, result):
+        return parse_result(result, self._result, self._result_policy, self._plain_result)
+
+
+class TaskInput(object):
+    def __init__(self, handler, event, in_place):
+        self._handler = handler
+        self._streamed = None
+        self._cached = self._cache_key = None
+        decode = isinstance(event, str)
+        # an event we decoded ourselves isn't shared with anyone, so it can be parsed in place
+        self._owned = in_place or decode
+        if decode and handler._input_cache is not None and handler.stream is None:
+            self._cache_key = InputCache.key(event)
+            self._cached = handler._input_cache.get(self._cache_key)
+        if self._cached is not None:
+            event = self._cached[0]
+        elif decode:
+            if handler.stream is not None:
+                self._streamed = handler.stream.scan(event)
+                event = self._streamed.event
+            else:
+                text = DataZipper.receive(event)
+                event = json.loads(text) if handler._decoder is None else handler._decoder.loads(text)
+        self.event = event
+
+    def validation_errors(self):
+        if self._streamed is not None:
+            return self._streamed.validation_errors
+        if self._cached is not None:
+            return self._cached[1]
+        errors = self._handler.validator.validate(self.event)
+        if self._cache_key is not None:
+            self._handler._input_cache.put(self._cache_key, self.event, errors)
+        return errors
+
+    def kwargs(self):
+        handler = self._handler
+        if self._cached is not None and self._cached[2] is not None:
+            return self._cached[2]
+        if self._streamed is not None:
+            return self._streamed.kwargs()
+        if handler.stream is not None:
+            return handler.stream.parse(self.event)
+        # a cached event is parsed again when it comes round, or until its kwargs are kept, so not in place
+        return handler._plan(self.event, in_place=self._owned and self._cache_key is None)
+
+    def handled(self, kwargs):
+        """ Keeps the kwargs of a cached input once the handler is done with them, if the cache keeps kwargs """
+        cache = self._handler._input_cache
+        if self._cache_key is not None and cache.kwargs and (self._cached is None or self._cached[2] is None):
+            cache.put(self._cache_key, self.event, [], kwargs)
@@ -0,0 +1,13 @@
+"""
+Whether a file another process left behind can be used. The caches keep pickled validators and
+task inputs in shared directories like /tmp, so they only read what nobody else could have written.
+"""
+import os
+
+
+def trusted(path):
+    """ Whether path belongs to root or this user and can't be written by anyone else """
+    if not hasattr(os, 'getuid'):
+        return True
+    info = os.stat(path)
+    return info.st_uid in (0, os.getuid()) and not info.st_mode & 0o022
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+import os
+import sys
+import shutil
+import tempfile
+import types
+import unittest
+from protocol.schema import *
+from protocol.artifact_cache import ArtifactCache, main
+from protocol.fulfillment_function import FulfillmentFunction
+
+PARAMETERS = {
+    "id": UuidParameter("The id"),
+    "kind": EnumParameter("Kind", options=["home", "work"], required=False),
+    "tags": ArrayParameter("Tags", element=StringParameter("Tag", pattern="^[a-z]+$"), unique=True),
+    "either": OneOfParameter("Either", options=(IntParameter("A number"), StringParameter("A string")), required=False)
+}
+
+EVENTS = [
+    {"id": "02ef139a-417a-4328-9953-5996b9f36dae", "tags": ["a", "b"]},
+    {"id": "nope", "kind": "boat", "tags": ["a", "a", "B"], "either": 1.5},
+    {}
+]
+
+
+def errors(validator, event):
+    return [(e.message, list(e.path), list(e.schema_path)) for e in validator.iter_errors(event)]
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.schema = ObjectParameter('', properties=PARAMETERS).to_schema(True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        cache = ArtifactCache(self.directory)
+        compiled = cache.compiled_validator(self.schema)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        loaded = ArtifactCache(self.directory).compiled_validator(self.schema)
+        self.assertIsNot(loaded, compiled)
+        self.assertEqual(loaded.source, compiled.source)
+        for event in EVENTS:
+            self.assertEqual(loaded.is_valid(event), compiled.is_valid(event))
+            self.assertEqual(errors(loaded, event), errors(compiled, event))
+
+    def test_fingerprint(self):
+        cache = ArtifactCache(self.directory)
+        cache.compiled_validator(self.schema)
+        changed = ObjectParameter('', properties=dict(PARAMETERS, id=UuidParameter("The id", required=False)))
+        cache.compiled_validator(changed.to_schema(True))
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertNotEqual(cache.fingerprint(IntParameter("N", minimum=1).to_schema()),
+                            cache.fingerprint(FloatParameter("N", minimum=1).to_schema()))
+
+    def test_unusable_artifacts(self):
+        cache = ArtifactCache(self.directory)
+        path = cache.store(cache.compiled_validator(self.schema))
+
+        os.chmod(path, 0o666)
+        self.assertIsNone(cache.load(self.schema))
+
+        os.chmod(path, 0o644)
+        with open(path, 'wb') as f:
+            f.write(b'truncated')
+        self.assertIsNone(cache.load(self.schema))
+        self.assertTrue(cache.compiled_validator(self.schema).is_valid(EVENTS[0]))
+
+    def test_fallback_directory(self):
+        read_only = os.path.join(self.directory, 'missing', 'file')
+        open(os.path.join(self.directory, 'missing'), 'w').close()
+        cache = ArtifactCache(read_only, os.path.join(self.directory, 'tmp'))
+        path = cache.store(cache.compiled_validator(self.schema))
+        self.assertEqual(os.path.dirname(path), os.path.join(self.directory, 'tmp'))
+
+    def test_build_command(self):
+        module = types.ModuleType('artifact_test_function')
+        module.function = FulfillmentFunction("Test function", PARAMETERS, StringResult("out"), lambda **kwargs: "")
+        sys.modules[module.__name__] = module
+        try:
+            self.assertEqual(main([module.__name__, self.directory]), 0)
+        finally:
+            del sys.modules[module.__name__]
+
+        cache = ArtifactCache(self.directory)
+        function = FulfillmentFunction("Test function", PARAMETERS, StringResult("out"), lambda **kwargs: "",
+                                       artifact_cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(function._input.validator.validate(EVENTS[0]), [])
+
+    def test_build_command_stream(self):
+        parameters = {"name": StringParameter("Name"), "ids": ArrayParameter("Ids", element=IntParameter("Id", minimum=1))}
+        module = types.ModuleType('artifact_test_stream')
+        module.function = FulfillmentFunction("Test function", parameters, StringResult("out"), lambda **kwargs: "",
+                                              stream="ids")
+        sys.modules[module.__name__] = module
+        try:
+            self.assertEqual(main([module.__name__, self.directory]), 0)
+        finally:
+            del sys.modules[module.__name__]
+
+        # the event's validator, and the streamed parameters' and element's ones
+        cache = ArtifactCache(self.directory)
+        function = FulfillmentFunction("Test function", parameters, StringResult("out"), lambda **kwargs: "",
+                                       stream="ids", artifact_cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (3, 0))
+        self.assertEqual([e['path'] for e in function._input.stream.scan('{"name": "x", "ids": [1, 0]}').validation_errors],
+                         ['ids/1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,43 @@
 #!/usr/bin/python
 
+import base64
+import hashlib
+import json
+import lzma
 import os
+import tempfile
+import zlib
 import unittest
-from protocol.datazipper import DataZipper, to_unicode
+from botocore.exceptions import ClientError
+from protocol.datazipper import AdaptiveCompression, BASE85, DataZipper, ZstdCodec, to_unicode
+
+class StubZstandard(object):
+    """ zlib behind the calls ZstdCodec makes of the zstandard module, which may not be installed """
+    class ZstdCompressor(object):
+        def __init__(self, level=3):
+            self.level = min(level, 9)
+
+        def compressobj(self):
+            return zlib.compressobj(self.level)
+
+    class ZstdDecompressor(object):
+        def read_to_iter(self, reader, read_size=1 << 17, write_size=1 << 17):
+            decompressor = zlib.decompressobj()
+            for pending in iter(lambda: reader.read(read_size), b''):
+                while pending:
+                    yield decompressor.decompress(pending, write_size)
+                    pending = decompressor.unconsumed_tail
+
 
 class MockS3Object(object):
-    def __init__(self, bucket, key):
+    def __init__(self, bucket, key, directory):
         self.bucket = bucket
         self.key = key.replace("/", "_")
+        self.directory = directory
         self.filename = self._filename()
 
     def _filename(self):
-        return "test/{}_{}.outons3butnotreally".format(self.bucket, self.key)
+        return os.path.join(self.directory, "{}_{}.outons3butnotreally".format(self.bucket, self.key))
 
     def put(self, Body = None) -> None:
         self._reset()
@@ -21,19 +47,32 @@ class MockS3Object(object):
     def get(self):
         return {"Body": open(self.filename, "rb")}
 
+    def load(self):
+        if not os.path.exists(self.filename):
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
     def _reset(self):
         if os.path.exists(self.filename):
             os.remove(self.filename)
 
 class MockS3(object):
+    """ Objects are files in directory, a temporary directory the test removes """
+    def __init__(self, directory):
+        self.directory = directory
 
     def Object(self, bucket, key):
-        return MockS3Object(bucket, key)
+        return MockS3Object(bucket, key, self.directory)
 
 class TestDataZipper(unittest.TestCase):
 
     def setUp(self):
-        DataZipper.s3 = MockS3()
+        self.directory = tempfile.TemporaryDirectory()
+        DataZipper.s3 = MockS3(self.directory.name)
+        DataZipper.stored.clear()
+
+    def tearDown(self):
+        DataZipper.stored.clear()
+        self.directory.cleanup()
 
     def test_simple(self):
         self.assertEqual(DataZipper.deliver("Hello", 5000), "Hello")
@@ -62,6 +101,184 @@ class TestDataZipper(unittest.TestCase):
 
             self.assertTrue(received == bigger_json)
 
+    def test_zip_stream(self):
+        text = "☃ snow {} ".format("x" * 50) * 500
+        expected = "FF-ZIP:{}:{}".format(len(text), base64.b64encode(zlib.compress(text.encode('utf-8'))).decode())
+        for chunk_size in (1, 7, 1000, 1 << 16):
+            zipped, md5_hash = DataZipper._zip_stream(text, chunk_size)
+            self.assertEqual(zipped.decode('ascii'), expected)
+            self.assertEqual(md5_hash, hashlib.md5(expected.encode()).hexdigest())
+        self.assertEqual(DataZipper.receive(DataZipper.deliver(text, 1000)), text)
+        self.assertEqual(DataZipper.receive(DataZipper.deliver(text, 100)), text)
+
+    def test_codecs(self):
+        text = "☃ snow {} ".format("x" * 50) * 500
+        zipped = DataZipper.deliver(text, 1000, codec="FF-LZMA")
+        self.assertTrue(zipped.startswith("FF-LZMA:{}:".format(len(text))))
+        self.assertEqual(lzma.decompress(base64.b64decode(zipped.split(":", 2)[2])).decode('utf-8'), text)
+        self.assertEqual(DataZipper.receive(zipped), text)
+        for chunk_size in (3, 1000):
+            self.assertEqual("".join(DataZipper.receive_stream(zipped, chunk_size)()), text)
+            self.assertEqual("".join(DataZipper.receive_stream(DataZipper.deliver(text, 100, codec="FF-LZMA"), chunk_size)()), text)
+
+        # the first registered codec in the preference is used, and FF-ZIP payloads still decode
+        zipped = DataZipper.deliver(text, 1000, codec=("FF-NOPE", "FF-ZIP"))
+        self.assertTrue(zipped.startswith("FF-ZIP:"))
+        self.assertEqual(DataZipper.receive(zipped), text)
+        self.assertRaises(Exception, DataZipper.deliver, text, 1000, codec="FF-NOPE")
+
+        configured = DataZipper.codec
+        try:
+            DataZipper.codec = "FF-LZMA"
+            self.assertTrue(DataZipper.deliver(text, 1000).startswith("FF-LZMA:"))
+        finally:
+            DataZipper.codec = configured
+
+    def test_zstd(self):
+        modules = [StubZstandard]
+        try:
+            import zstandard
+            modules.append(zstandard)
+        except ImportError:
+            pass
+        text = "☃ snow {} ".format("x" * 50) * 500
+        registered = dict(DataZipper.codecs)
+        self.addCleanup(lambda: (DataZipper.codecs.clear(), DataZipper.codecs.update(registered)))
+        for module in modules:
+            codec = ZstdCodec(module)
+            DataZipper.register(codec)
+            for strategy in (None, AdaptiveCompression()):
+                zipped = DataZipper.deliver(text, 1000, codec="FF-ZSTD", strategy=strategy)
+                self.assertTrue(zipped.startswith("FF-ZSTD:{}:".format(len(text))))
+                self.assertEqual(DataZipper.receive(zipped), text)
+            compressed = base64.b64decode(zipped.split(":", 2)[2])
+            for chunk_size in (3, 1000):
+                pieces = list(codec.inflate([compressed[:10], compressed[10:]], chunk_size))
+                self.assertEqual(b"".join(pieces).decode('utf-8'), text)
+                self.assertLessEqual(max(len(piece) for piece in pieces), chunk_size)
+                self.assertEqual("".join(DataZipper.receive_stream(zipped, chunk_size)()), text)
+
+    def test_adaptive(self):
+        with open('test/bigTestData.json', 'r') as big_json_file:
+            big_json = big_json_file.read()
+        # zlib makes 29000 characters of this at level 1 and 25136 at level 9
+        paths = []
+        strategy = AdaptiveCompression(metrics=paths.append)
+        for limit, path in ((30000, 'fast'), (27000, 'best'), (24000, 'spilled'), (21000, 'spilled'), (15000, 'skipped')):
+            delivered = DataZipper.deliver(big_json, limit, strategy=strategy)
+            self.assertEqual(paths[-1], path)
+            self.assertLessEqual(len(delivered), limit)
+            self.assertEqual(DataZipper.receive(delivered), big_json)
+            self.assertEqual("".join(DataZipper.receive_stream(delivered)()), big_json)
+        self.assertEqual(strategy.counts, {'fast': 1, 'best': 1, 'spilled': 2, 'skipped': 1})
+        self.assertEqual(len(DataZipper.deliver(big_json, 21000, strategy=strategy)), len(delivered))
+
+        # the best of a spilled result is kept, and a skipped result goes to S3 as it is
+        spilled = DataZipper._get_url(DataZipper.deliver(big_json, 24000, strategy=strategy)).read()
+        self.assertEqual(len(spilled), len("FF-ZIP:72686:") + 25136)
+        skipped = DataZipper._get_url(DataZipper.deliver(big_json, 15000, strategy=strategy)).read()
+        self.assertEqual(skipped.decode('utf-8'), big_json)
+
+    def test_store_dedupe(self):
+        puts = []
+
+        class CountingS3(MockS3):
+            def Object(self, bucket, key):
+                s3_obj = MockS3Object(bucket, key, self.directory)
+                put = s3_obj.put
+                s3_obj.put = lambda Body=None: (puts.append(key), put(Body))
+                return s3_obj
+
+        DataZipper.s3 = CountingS3(self.directory.name)
+        text = "dedupe me " + "".join(hashlib.sha512(str(i).encode()).hexdigest() for i in range(20))
+        url = DataZipper.deliver(text, 100)
+        self.assertEqual(DataZipper.deliver(text, 100), url)
+        self.assertEqual(len(puts), 1)
+        self.assertEqual(DataZipper.receive(url), text)
+
+        # once forgotten, it's uploaded again unless S3 is asked first
+        DataZipper.stored.clear()
+        DataZipper.deliver(text, 100)
+        self.assertEqual(len(puts), 2)
+        DataZipper.stored.clear()
+        try:
+            DataZipper.check_existing = True
+            existing = DataZipper.store_counts['existing']
+            self.assertEqual(DataZipper.deliver(text, 100), url)
+            self.assertEqual(DataZipper.store_counts['existing'], existing + 1)
+            self.assertEqual(len(puts), 2)
+            DataZipper.deliver(text + "more", 100)
+            self.assertEqual(len(puts), 3)
+        finally:
+            DataZipper.check_existing = False
+
+        # the index is bounded, and entries expire
+        stored_size, stored_for = DataZipper.stored_size, DataZipper.stored_for
+        try:
+            DataZipper.stored_size = 2
+            for i in range(3):
+                DataZipper.deliver(text + str(i), 100)
+            self.assertEqual(len(DataZipper.stored), 2)
+            DataZipper.stored_for = 0
+            DataZipper.deliver(text, 100)
+            DataZipper.deliver(text, 100)
+            self.assertEqual(len(puts), 8)
+        finally:
+            DataZipper.stored_size, DataZipper.stored_for = stored_size, stored_for
+
+    def test_digest(self):
+        text = "blake me " + "".join(hashlib.sha512(str(i).encode()).hexdigest() for i in range(20, 40))
+        try:
+            DataZipper.digest = "blake2b"
+            url = DataZipper.deliver(text, 100)
+        finally:
+            DataZipper.digest = "md5"
+        magick, digest, proto, path = url.split(":")
+        zipped = DataZipper._zip_data(text, 100)
+        self.assertEqual(digest, "blake2b-" + hashlib.blake2b(zipped.encode(), digest_size=16).hexdigest())
+        self.assertTrue(path.endswith("/{}.ff".format(digest)))
+        # both kinds of key resolve whatever the digest is now
+        self.assertEqual(DataZipper.receive(url), text)
+        self.assertEqual(DataZipper.receive(DataZipper.deliver(text, 100)), text)
+
+    def test_base85(self):
+        # every character goes in JSON and SWF strings as it is
+        alphabet = BASE85.encode(bytes(range(256)) * 4).decode('ascii')
+        self.assertEqual(len(set(alphabet)), 85)
+        self.assertEqual(json.dumps(alphabet), '"{}"'.format(alphabet))
+        self.assertTrue(all(' ' < c < '\x7f' for c in alphabet))
+        for size in range(12):
+            self.assertEqual(len(BASE85.encode(bytes(size))), BASE85.length(size))
+
+        text = "☃ snow {} ".format("x" * 50) * 500
+        zipped = DataZipper.deliver(text, 1000, codec="FF-B85")
+        self.assertTrue(zipped.startswith("FF-B85:{}:".format(len(text))))
+        self.assertEqual(zlib.decompress(base64.b85decode(zipped.split(":", 2)[2])).decode('utf-8'), text)
+        self.assertEqual(DataZipper.receive(zipped), text)
+        for chunk_size in (1, 7, 1000):
+            self.assertEqual("".join(DataZipper.receive_stream(zipped, chunk_size)()), text)
+        zipped = DataZipper.deliver(text, 1000, codec="FF-LZMA-B85")
+        self.assertTrue(zipped.startswith("FF-LZMA-B85:"))
+        self.assertEqual(DataZipper.receive(zipped), text)
+
+    def test_dense(self):
+        with open('test/bigTestData.json', 'r') as big_json_file:
+            big_json = big_json_file.read()
+        # 25601 characters as FF-ZIP, 24000 as FF-B85, and 23576 at zlib's best level
+        self.assertTrue(DataZipper.deliver(big_json, 25000).startswith("FF-URL:"))
+        try:
+            DataZipper.dense = {"FF-ZIP": "FF-B85"}
+            for strategy in (None, AdaptiveCompression()):
+                delivered = DataZipper.deliver(big_json, 25000, strategy=strategy)
+                self.assertTrue(delivered.startswith("FF-B85:72686:"))
+                self.assertEqual(len(delivered), 24000 if strategy is None else 23576)
+                self.assertEqual(DataZipper.receive(delivered), big_json)
+            self.assertTrue(DataZipper.deliver(big_json, 23000).startswith("FF-URL:"))
+            # it's only used when it makes the difference
+            self.assertTrue(DataZipper.deliver(big_json, 26000).startswith("FF-ZIP:"))
+        finally:
+            DataZipper.dense = {}
+
     def test_to_unicode(self):
         as_unicode = "☃"  # snowman!
         as_bytes = as_unicode.encode()
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+import asyncio
+import hashlib
+import tempfile
+import unittest
+from botocore.exceptions import ClientError
+from protocol.datazipper import DataZipper
+from protocol.payload_cache import PayloadCache
+from test.test_datazipper import MockS3
+
+
+class _AsyncBody(object):
+    def __init__(self, body):
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+
+class AsyncLocalS3(object):
+    """
+    An asyncio S3 stand-in with the calls of aiobotocore's client that DataZipper makes. Every call
+    takes `latency` seconds, and max_in_flight says how many were ever waited on at once.
+    """
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.objects = {}
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _call(self, name):
+        self.calls.append(name)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+    async def put_object(self, Bucket, Key, Body):
+        await self._call('put')
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    async def head_object(self, Bucket, Key):
+        await self._call('head')
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    async def get_object(self, Bucket, Key):
+        await self._call('get')
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": _AsyncBody(self.objects[(Bucket, Key)])}
+
+
+def texts(count):
+    # too random to zip under the limit, so every one is spilled
+    return ["".join(hashlib.sha512("{} {}".format(n, i).encode()).hexdigest() for i in range(20)) for n in range(count)]
+
+
+class TestDataZipperAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        DataZipper.s3 = MockS3(self.directory.name)
+        DataZipper.stored.clear()
+
+    def tearDown(self):
+        DataZipper.stored.clear()
+        self.directory.cleanup()
+
+    def with_async_s3(self, s3):
+        DataZipper.async_s3 = s3
+        self.addCleanup(setattr, DataZipper, 'async_s3', None)
+
+    def test_overlap(self):
+        s3 = AsyncLocalS3()
+        self.with_async_s3(s3)
+        originals = texts(20)
+
+        async def round_trip():
+            urls = await asyncio.gather(*(DataZipper.deliver_async(text, 1000) for text in originals))
+            received = await asyncio.gather(*(DataZipper.receive_async(url) for url in urls))
+            return urls, received
+
+        urls, received = asyncio.run(round_trip())
+        self.assertTrue(all(url.startswith(DataZipper.magick_url) for url in urls))
+        self.assertEqual(received, originals)
+        self.assertEqual(s3.calls, ['put'] * 20 + ['get'] * 20)
+        self.assertEqual(s3.max_in_flight, 20)
+
+        # the same results again are already stored, and check_existing asks the client
+        self.assertEqual(asyncio.run(DataZipper.deliver_async(originals[0], 1000)), urls[0])
+        self.assertEqual(len(s3.calls), 40)
+        DataZipper.stored.clear()
+        try:
+            DataZipper.check_existing = True
+            self.assertEqual(asyncio.run(DataZipper.deliver_async(originals[0], 1000)), urls[0])
+            self.assertEqual(s3.calls[40:], ['head'])
+        finally:
+            DataZipper.check_existing = False
+
+    def test_payload_cache(self):
+        s3 = AsyncLocalS3(latency=0)
+        self.with_async_s3(s3)
+        text = texts(1)[0]
+        with tempfile.TemporaryDirectory() as directory:
+            DataZipper.payload_cache = PayloadCache(directory=directory)
+            try:
+                url = asyncio.run(DataZipper.deliver_async(text, 1000))
+                for _ in range(3):
+                    self.assertEqual(asyncio.run(DataZipper.receive_async(url)), text)
+            finally:
+                DataZipper.payload_cache = None
+        self.assertEqual(s3.calls, ['put', 'get'])
+
+    def test_executor(self):
+        # without an async client the blocking S3 resource runs on s3_executor
+        text = texts(1)[0]
+        url = asyncio.run(DataZipper.deliver_async(text, 1000))
+        self.assertEqual(url, DataZipper.deliver(text, 1000))
+        self.assertEqual(asyncio.run(DataZipper.receive_async(url)), text)
+
+        text = "zip me " * 1000
+        zipped = asyncio.run(DataZipper.deliver_async(text, 1000))
+        self.assertTrue(zipped.startswith("FF-ZIP:"))
+        self.assertEqual(asyncio.run(DataZipper.receive_async(zipped)), text)
+        self.assertEqual(asyncio.run(DataZipper.deliver_async("short", 1000)), "short")
+        self.assertEqual(asyncio.run(DataZipper.receive_async("short")), "short")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+import json
+import unittest
+from protocol.schema import *
+from protocol.event_decoder import EventDecoder
+from protocol.fulfillment_function import FulfillmentFunction
+
+PARAMETERS = {
+    "channel": EnumParameter("Channel", options=["search", "social"]),
+    "rows": ArrayParameter("Rows", ObjectParameter("Row", properties={
+        "status": EnumParameter("Status", options=["active", "paused"]),
+        "kinds": ArrayParameter("Kinds", EnumParameter("Kind", options=["home", "work"])),
+        "either": OneOfParameter("Either", options=(EnumParameter("Size", options=["big"]), IntParameter("N")))
+    }))
+}
+
+
+def rows(n):
+    return [{"status": "active", "kinds": ["home", "work", 1], "either": "big", "name": "active"} for _ in range(n)]
+
+
+class TestEventDecoder(unittest.TestCase):
+
+    def test_shared_values(self):
+        decoder = EventDecoder(PARAMETERS)
+        text = json.dumps({"channel": "search", "rows": rows(3)})
+        event = decoder.loads(text)
+        self.assertEqual(event, json.loads(text))
+        first, last = event["rows"][0], event["rows"][-1]
+        self.assertIs(first["status"], last["status"])
+        self.assertIs(first["kinds"][1], last["kinds"][1])
+        self.assertIs(first["either"], last["either"])
+        # properties that can't hold an option are left alone
+        self.assertIsNot(first["name"], last["name"])
+        self.assertEqual(decoder.shared, 13)
+        self.assertGreater(decoder.saved_bytes, 13 * 40)
+
+        self.assertEqual(EventDecoder({"name": StringParameter("Name")}).loads('{"name": "x"}'), {"name": "x"})
+
+    def test_lists(self):
+        decoder = EventDecoder({
+            "grid": ArrayParameter("Grid", ArrayParameter("Row", EnumParameter("Cell", options=["on", "off"]))),
+            "mixed": ArrayParameter("Mixed", OneOfParameter("Either", options=(
+                IntParameter("N"), EnumParameter("Size", options=["big"])))),
+            "labels": LooseObjectParameter("Labels", EnumParameter("Label", options=["red"]))
+        })
+        text = json.dumps({"grid": [["on", "off"], ["off", "on"]], "mixed": [1, "big", "big"],
+                           "labels": {"a": "red", "b": "red"}})
+        event = decoder.loads(text)
+        self.assertEqual(event, json.loads(text))
+        self.assertIs(event["grid"][0][0], event["grid"][1][1])
+        self.assertIs(event["mixed"][1], event["mixed"][2])
+        self.assertIs(event["labels"]["a"], event["labels"]["b"])
+        self.assertEqual(decoder.shared, 8)
+
+    def test_function(self):
+        function = FulfillmentFunction("Test", PARAMETERS, IntResult("Rows"),
+                                       lambda channel, rows: len(rows), intern_strings=True)
+        valid = [{"status": "paused", "kinds": ["work"], "either": 2} for _ in range(10)]
+        response = function.handle(json.dumps({"channel": "social", "rows": valid}), {})
+        self.assertEqual(response["result"], 10)
+        report = function.memory_report()
+        self.assertEqual(report['shared_strings'], 21)
+        self.assertNotIn('shared_strings', FulfillmentFunction("Test", PARAMETERS, IntResult("Rows"), len).memory_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
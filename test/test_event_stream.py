@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import json
+import tempfile
+import unittest
+from protocol.schema import *
+from protocol.datazipper import DataZipper
+from protocol.event_stream import ArrayStream, _JsonReader
+from protocol.fulfillment_function import FulfillmentFunction
+from protocol.fulfillment_exception import FulfillmentValidationException
+from test.test_datazipper import MockS3
+
+PARAMETERS = {
+    "campaignName": StringParameter("Campaign"),
+    "records": ArrayParameter("Records", element=ObjectParameter("A record", properties={
+        "id": IntParameter("Id", minimum=1),
+        "name": StringParameter("Name"),
+        "kind": EnumParameter("Kind", options=["a", "b"], default="a")
+    }), min_items=1, max_items=500)
+}
+
+
+def records(n):
+    return [{"id": i + 1, "name": " record {} ☃ ".format(i), "kind": "ab"[i % 2]} for i in range(n)]
+
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        DataZipper.s3 = MockS3(self.directory.name)
+        DataZipper.stored.clear()
+        self.stream = ArrayStream(PARAMETERS, "records", chunk_size=7)
+
+    def tearDown(self):
+        DataZipper.stored.clear()
+        self.directory.cleanup()
+
+    def test_reader(self):
+        document = '{"a": [1, 22.5e3, -333, "x\\"y", {"b": [true, false, null]}], "c": {}, "d": []}'
+        for size in (1, 2, 5, 1000):
+            reader = _JsonReader(document[i:i + size] for i in range(0, len(document), size))
+            found = {}
+            for key in reader.members():
+                found[key] = list(reader.elements()) if reader.peek() == '[' else reader.value()
+            self.assertEqual(reader.peek(), '')
+            self.assertEqual(found, json.loads(document))
+
+        reader = _JsonReader(['{"a" 1}'])
+        self.assertRaises(ValueError, lambda: list(reader.members()))
+
+    def test_inputs(self):
+        event = {"records": records(300), "campaignName": " Spring "}
+        text = json.dumps(event)
+        for data in (text, DataZipper.deliver(text, 1000), DataZipper.deliver(text, 10)):
+            streamed = self.stream.scan(data)
+            self.assertEqual(streamed.validation_errors, [])
+            self.assertEqual(streamed.event, {"records": [], "campaignName": " Spring "})
+
+            kwargs = streamed.kwargs()
+            self.assertEqual(kwargs["campaign_name"], "Spring")
+            self.assertEqual(list(kwargs["records"]), PARAMETERS["records"].parse(event["records"]))
+            # the input can be read again
+            self.assertEqual(len(list(streamed.kwargs()["records"])), 300)
+
+    def test_validation(self):
+        bad = records(3)
+        bad[1]["id"] = 0
+        del bad[2]["name"]
+        streamed = self.stream.scan(json.dumps({"records": bad}))
+        self.assertEqual([(e['path'], e['validator']) for e in streamed.validation_errors], [
+            ('', 'required'),
+            ('records/1/id', 'minimum'),
+            ('records/2', 'required')
+        ])
+
+        streamed = self.stream.scan(json.dumps({"campaignName": "x", "records": []}))
+        self.assertEqual([(e['path'], e['message']) for e in streamed.validation_errors], [
+            ('records', '[] is too short')
+        ])
+        streamed = self.stream.scan(json.dumps({"campaignName": "x", "records": records(501)}))
+        self.assertEqual([(e['path'], e['message']) for e in streamed.validation_errors], [
+            ('records', '[... 501 items] is too long')
+        ])
+
+        streamed = self.stream.scan(json.dumps({"campaignName": "x", "records": {}}))
+        self.assertEqual([e['path'] for e in streamed.validation_errors], ['records'])
+
+        streamed = self.stream.scan(json.dumps({"campaignName": "x"}))
+        self.assertEqual([e['message'] for e in streamed.validation_errors], ["'records' is a required property"])
+
+        self.assertRaises(Exception, lambda: ArrayStream(PARAMETERS, "campaignName"))
+        self.assertRaises(Exception, lambda: ArrayStream({"a": ArrayParameter("A", IntParameter("I"), unique=True)}, "a"))
+
+    def test_error_budget(self):
+        bad = records(300)
+        for record in bad:
+            record["id"] = 0
+        text = json.dumps({"records": bad})
+
+        errors = ArrayStream(PARAMETERS, "records", max_errors=2).scan(text).validation_errors
+        self.assertEqual([(e['path'], e['validator_value']) for e in errors], [
+            ('', ['campaignName', 'records']),
+            ('records/0/id', 1),
+            ('records/*/id', 299)
+        ])
+        errors = ArrayStream(PARAMETERS, "records", fail_fast=True).scan(text).validation_errors
+        self.assertEqual([(e['path'], e['validator_value']) for e in errors], [
+            ('', ['campaignName', 'records']),
+            ('records/*/id', 1)
+        ])
+
+        # too many items counts against the budget like the errors in them
+        text = json.dumps({"records": bad + bad})
+        errors = ArrayStream(PARAMETERS, "records", max_errors=2).scan(text).validation_errors
+        self.assertEqual([(e['path'], e['validator'], e['validator_value']) for e in errors], [
+            ('', 'required', ['campaignName', 'records']),
+            ('records/0/id', 'minimum', 1),
+            ('records/*/id', 'maxErrors', 599),
+            ('records', 'maxErrors', 1)
+        ])
+        errors = ArrayStream(PARAMETERS, "records", max_errors=1000).scan(text).validation_errors
+        self.assertEqual(errors[-1]['message'], "[... 600 items] is too long")
+
+    def test_parse_errors(self):
+        bad = records(3)
+        bad[2]["kind"] = " c "
+        schema = dict(PARAMETERS, records=ArrayParameter("Records", element=ObjectParameter("A record", properties={
+            "kind": StringParameter("Kind")
+        })))
+        stream = ArrayStream(schema, "records", chunk_size=7)
+        streamed = stream.scan(json.dumps({"campaignName": "x", "records": bad}))
+        elements = streamed.kwargs()["records"]
+        self.assertEqual(next(elements), {"kind": "a"})
+
+        streamed = self.stream.scan(json.dumps({"campaignName": "x", "records": bad}))
+        elements = streamed.kwargs()["records"]
+        self.assertEqual(next(elements)["id"], 1)
+        next(elements)
+        with self.assertRaises(FulfillmentValidationException) as raised:
+            next(elements)
+        self.assertIn("records[2]", str(raised.exception))
+
+    def test_function(self):
+        seen = []
+
+        def handler(campaign_name, records):
+            for record in records:
+                seen.append(record["id"])
+            return campaign_name
+
+        function = FulfillmentFunction("Streams", PARAMETERS, StringResult("Name"), handler, stream="records")
+        event = {"campaignName": "Spring", "records": records(5)}
+        self.assertEqual(function.handle(DataZipper.deliver(json.dumps(event), 100), {})["result"], "Spring")
+        self.assertEqual(function.handle(event, {})["result"], "Spring")
+        self.assertEqual(seen, [1, 2, 3, 4, 5] * 2)
+
+        response = function.handle(json.dumps({"campaignName": "Spring", "records": []}), {})
+        self.assertEqual(response["status"], "INVALID")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+import unittest
+from protocol.schema import *
+from protocol.fulfillment_parser import InvocationPlan, ResultPolicy, parse_event, parse_result
+from protocol.fulfillment_exception import FulfillmentValidationException
+from protocol.fulfillment_function import FulfillmentFunction
+
+RESULT = ObjectResult("A result", properties={
+    "name": StringParameter("Name"),
+    "rows": ArrayParameter("Rows", element=IntParameter("Row")),
+    "note": StringParameter("Note", required=False, default="none")
+})
+
+
+class TestFulfillmentParser(unittest.TestCase):
+
+    def test_invocation_plan(self):
+        params = {
+            "campaignName": StringParameter("Name"),
+            "budget": FloatParameter("Budget", required=False, default="2.5"),
+            "tags": ArrayParameter("Tags", StringParameter("Tag"), required=False, default=["a"]),
+            "note": StringParameter("Note", required=False)
+        }
+        plan = InvocationPlan(params)
+        for event in ({"campaignName": " x "}, {"campaignName": "x", "budget": 1, "tags": [" b "], "note": "n"}):
+            self.assertEqual(plan(event), parse_event(event, params))
+        first, second = plan({"campaignName": "x"}), plan({"campaignName": "x"})
+        self.assertEqual(first, {"campaign_name": "x", "budget": 2.5, "tags": ["a"], "note": None})
+        self.assertIsNot(first["tags"], second["tags"])
+
+        with self.assertRaises(FulfillmentValidationException) as planned:
+            plan({})
+        with self.assertRaises(FulfillmentValidationException) as parsed:
+            parse_event({}, params)
+        self.assertEqual(str(planned.exception), str(parsed.exception))
+
+        params["note"].required = True
+        self.assertRaises(FulfillmentValidationException, lambda: plan({"campaignName": "x"}))
+
+    def test_parse_shape(self):
+        value = {"name": " x ", "rows": ["1", 2], "extra": True}
+        self.assertIs(RESULT.parse_shape(value), value)
+        self.assertEqual(StringResult("S").parse_shape(" s "), "s")
+        self.assertEqual(ArrayResult("A", element=IntParameter("I")).parse_shape(["1"]), ["1"])
+
+        with self.assertRaises(Exception) as raised:
+            RESULT.parse_shape({"rows": []}, "result")
+        self.assertEqual(str(raised.exception), "Exception while parsing result: "
+                                                "result[name]-Missing required parameter (description: Name)")
+        with self.assertRaises(Exception) as raised:
+            RESULT.parse_shape([], "result")
+        self.assertEqual(str(raised.exception), "Exception while parsing result: Expected to parse a dict!")
+
+    def test_plain_json(self):
+        self.assertTrue(RESULT.plain_json())
+        self.assertTrue(ArrayResult("A", element=IsoDateParameter("D")).plain_json())
+        for result in (ObjectResult("O", output="record", properties={}),
+                       ObjectResult("O", properties={"rows": ArrayParameter("R", IntParameter("I"), output="array")}),
+                       ArrayResult("A", element=ObjectParameter("O", lazy=True, properties={})),
+                       OneOfParameter("Either", options=(IntParameter("I"), IsoDateParameter("D", output="datetime")))):
+            self.assertFalse(result.plain_json())
+
+    def test_policies(self):
+        value = {"name": " x ", "rows": ["1", 2]}
+        parsed = {"name": "x", "rows": [1, 2], "note": "none"}
+        self.assertEqual(parse_result(value, RESULT), (parsed, []))
+        self.assertEqual(parse_result((value, ["n"]), RESULT, ResultPolicy()), (parsed, ["n"]))
+        # a result that's only shape checked goes back as the handler made it, not copied
+        self.assertIs(parse_result(value, RESULT, ResultPolicy('shape-only'))[0], value)
+        self.assertRaises(Exception, lambda: ResultPolicy('sometimes'))
+
+        seen = []
+        policy = ResultPolicy('sampled', rate=0.25, metrics=seen.append, seed=1)
+        results = [policy.parse(value, RESULT) for _ in range(400)]
+        self.assertEqual(results.count(parsed) + results.count(value), 400)
+        self.assertTrue(50 < policy.counts['parsed'] < 150)
+        self.assertEqual(policy.counts['parsed'] + policy.counts['shape_checked'], 400)
+        self.assertEqual(len(seen), 400)
+
+        for bad in ({"name": "x", "rows": ["one"]}, {"rows": []}):
+            self.assertRaises(Exception, lambda: ResultPolicy('always', metrics=seen.append).parse(bad, RESULT))
+        self.assertRaises(Exception, lambda: policy.parse({"rows": []}, RESULT))
+        self.assertEqual(seen[-3:], ['violation'] * 3)
+        self.assertEqual(policy.counts['violation'], 1)
+
+    def test_function(self):
+        policy = ResultPolicy('shape-only')
+        function = FulfillmentFunction("Test", {}, RESULT, lambda: {"name": " x ", "rows": []}, result_policy=policy)
+        self.assertEqual(function.handle({}, {})["result"], {"name": " x ", "rows": []})
+        self.assertEqual(policy.counts['shape_checked'], 1)
+
+        function = FulfillmentFunction("Test", {}, RESULT, lambda: {"rows": []}, result_policy=policy)
+        self.assertEqual(function.handle({}, {})["status"], "FAILED")
+        self.assertEqual(policy.counts['violation'], 1)
+
+    def test_record_result(self):
+        result = ObjectResult("A result", output="record", properties={
+            "name": StringParameter("Name"),
+            "row": ObjectParameter("Row", output="record", properties={"id": IntParameter("Id")})
+        })
+        parsed, notes = parse_result({"name": " x ", "row": {"id": 1}}, result)
+        self.assertEqual(type(parsed), dict)
+        self.assertEqual(type(parsed["row"]), dict)
+        function = FulfillmentFunction("Test", {}, result, lambda: result.parse({"name": "x", "row": {"id": 1}}))
+        response = function.handle({}, {})
+        self.assertEqual(response["status"], "SUCCESS")
+        self.assertEqual(response["result"], {"name": "x", "row": {"id": 1}})
+
+    def test_typed_array_result(self):
+        result = ArrayResult("Numbers", element=IntParameter("N"), output="array")
+        function = FulfillmentFunction("Test", {"numbers": ArrayParameter("Numbers", IntParameter("N"), output="array")},
+                                       result, lambda numbers: numbers)
+        response = function.handle({"numbers": [1, 2]}, {})
+        self.assertEqual(response["status"], "SUCCESS")
+        self.assertEqual(response["result"], [1, 2])
+
+    def test_datetime_result(self):
+        result = IsoDateResult("When", output="datetime")
+        function = FulfillmentFunction("Test", {}, result, lambda: "2020-01-02T03:04:05Z")
+        response = function.handle({}, {})
+        self.assertEqual(response["status"], "SUCCESS")
+        self.assertEqual(response["result"], "2020-01-02T03:04:05+00:00")
+
+    def test_lazy_result(self):
+        result = ObjectResult("A result", lazy=True, properties={
+            "name": StringParameter("Name"),
+            "when": IsoDateParameter("When", output="datetime")
+        })
+        function = FulfillmentFunction("Test", {}, result, lambda: {"name": "x", "when": "2020-01-02T03:04:05Z"})
+        response = function.handle({}, {})
+        self.assertEqual(response["status"], "SUCCESS")
+        self.assertEqual(response["result"], {"name": "x", "when": "2020-01-02T03:04:05+00:00"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import tempfile
+import unittest
+from protocol.schema import *
+from protocol.datazipper import DataZipper
+from protocol.input_cache import InputCache
+from protocol.fulfillment_function import FulfillmentFunction
+from test.test_datazipper import MockS3
+
+PARAMETERS = {
+    "name": StringParameter("Name"),
+    "rows": ArrayParameter("Rows", ObjectParameter("Row", properties={"id": IntParameter("Id")}))
+}
+
+
+class TestInputCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        DataZipper.s3 = MockS3(self.directory.name)
+        DataZipper.stored.clear()
+        self.seen = []
+
+    def tearDown(self):
+        DataZipper.stored.clear()
+        self.directory.cleanup()
+
+    def function(self, cache):
+        def handler(name, rows):
+            self.seen.append(rows)
+            return name
+        return FulfillmentFunction("Test", PARAMETERS, StringResult("Name"), handler, input_cache=cache)
+
+    def test_retries(self):
+        cache = InputCache(size=2)
+        function = self.function(cache)
+        text = json.dumps({"name": " x ", "rows": [{"id": 1, "extra": 1}]})
+        for _ in range(3):
+            self.assertEqual(function.handle(text, {})["result"], "x")
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(self.seen, [[{"id": 1}]] * 3)
+        # without kwargs the cached event is parsed again, so every call gets its own
+        self.assertIsNot(self.seen[0], self.seen[1])
+
+        invalid = json.dumps({"rows": []})
+        self.assertEqual(function.handle(invalid, {})["status"], "INVALID")
+        self.assertEqual(function.handle(invalid, {})["status"], "INVALID")
+        self.assertEqual(cache.hits, 3)
+
+        function.handle(json.dumps({"name": "y", "rows": []}), {})
+        function.handle(text, {})
+        self.assertEqual(cache.misses, 4)
+
+    def test_kwargs(self):
+        cache = InputCache(kwargs=True)
+        function = self.function(cache)
+        text = DataZipper.deliver(json.dumps({"name": "x", "rows": [{"id": i} for i in range(100)]}), 100)
+        function.handle(text, {})
+        function.handle(text, {})
+        self.assertEqual(cache.hits, 1)
+        self.assertIs(self.seen[0], self.seen[1])
+
+    def test_kwargs_after_failure(self):
+        cache = InputCache(kwargs=True)
+        calls = []
+
+        def handler(name, rows):
+            calls.append([dict(row) for row in rows])
+            rows[0]["id"] = -1
+            if len(calls) == 1:
+                raise Exception("deferred")
+            return name
+        function = FulfillmentFunction("Test", PARAMETERS, StringResult("Name"), handler, input_cache=cache)
+        text = json.dumps({"name": "x", "rows": [{"id": 1}]})
+        self.assertEqual(function.handle(text, {})["status"], "FAILED")
+        # the kwargs the failed handler changed aren't kept, the retry parses the cached event again
+        self.assertEqual(function.handle(text, {})["result"], "x")
+        self.assertEqual(calls, [[{"id": 1}], [{"id": 1}]])
+        self.assertEqual(cache.hits, 1)
+
+    def test_keys(self):
+        url = DataZipper._store_in_s3("x" * 10)
+        self.assertEqual(InputCache.key(url), hashlib.md5(b"x" * 10).hexdigest())
+        self.assertNotEqual(InputCache.key("a"), InputCache.key("b"))
+        self.assertEqual(self.function(None).handle({"name": "x", "rows": []}, {})["result"], "x")
+
+
+if __name__ == '__main__':
+    unittest.main()
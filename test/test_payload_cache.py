@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+import os
+import tempfile
+import unittest
+from protocol.datazipper import DataZipper
+from protocol.payload_cache import PayloadCache
+from test.test_datazipper import MockS3, MockS3Object
+
+
+class CountingS3(MockS3):
+    def __init__(self, directory):
+        MockS3.__init__(self, directory)
+        self.gets = 0
+
+    def Object(self, bucket, key):
+        s3_obj = MockS3Object(bucket, key, self.directory)
+        get = s3_obj.get
+
+        def counted():
+            self.gets += 1
+            return get()
+        s3_obj.get = counted
+        return s3_obj
+
+
+class TestPayloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_memory(self):
+        cache = PayloadCache(memory_bytes=400)
+        for key in ("a", "b", "c", "d", "e"):
+            cache.put(key, key.encode() * 100)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b").read(), b"b" * 100)
+        cache.put("f", b"f" * 100)
+        # b was used more recently than c
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.memory_used, 400)
+        # more than a quarter of the memory tier, and not a key that could come from an FF-URL
+        cache.put("g", b"g" * 101)
+        cache.put("../h", b"h")
+        self.assertIsNone(cache.get("g"))
+        self.assertIsNone(cache.get("../h"))
+        self.assertEqual((cache.memory_hits, cache.disk_hits, cache.misses), (1, 0, 4))
+
+    def test_disk(self):
+        cache = PayloadCache(memory_bytes=400, directory=self.directory.name, disk_bytes=1000)
+        cache.put("big", b"x" * 600)
+        with cache.get("big") as f:
+            self.assertEqual(f.read(), b"x" * 600)
+        cache.put("small", b"s" * 10)
+
+        # a new process finds them, and one sharing the directory finds what's stored later
+        again = PayloadCache(memory_bytes=400, directory=self.directory.name, disk_bytes=1000)
+        self.assertEqual(again.disk_used, 610)
+        cache.put("later", b"l" * 10)
+        self.assertEqual(again.get("later").read(), b"l" * 10)
+        self.assertEqual(again.get("small").read(), b"s" * 10)
+        self.assertEqual(again.disk_hits, 2)
+        self.assertEqual(again.get("small").read(), b"s" * 10)
+        self.assertEqual(again.memory_hits, 1)
+
+        cache.put("bigger", b"y" * 500)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "big.ff")))
+        self.assertIsNone(cache.get("big"))
+        self.assertEqual(cache.disk_used, 520)
+
+    def test_receive(self):
+        objects = tempfile.TemporaryDirectory()
+        self.addCleanup(objects.cleanup)
+        DataZipper.s3 = s3 = CountingS3(objects.name)
+        text = "payload {} ".format("☃" * 100) * 200
+        url = DataZipper.deliver(text, 100)
+        try:
+            DataZipper.payload_cache = PayloadCache(directory=self.directory.name)
+            for _ in range(3):
+                self.assertEqual(DataZipper.receive(url), text)
+                self.assertEqual("".join(DataZipper.receive_stream(url, 100)()), text)
+            self.assertEqual(s3.gets, 1)
+
+            # the disk tier is enough for a streamed payload, and its files are closed once read
+            DataZipper.payload_cache = cache = PayloadCache(memory_bytes=0, directory=self.directory.name)
+            opened = []
+            get = cache.get
+            cache.get = lambda key: opened.append(get(key)) or opened[-1]
+            chunks = DataZipper.receive_stream(url, 100)
+            for _ in range(2):
+                self.assertEqual("".join(chunks()), text)
+            self.assertEqual(s3.gets, 1)
+            self.assertEqual(len(opened), 2)
+            self.assertTrue(all(f.closed for f in opened))
+        finally:
+            DataZipper.payload_cache = None
+        DataZipper.receive(url)
+        self.assertEqual(s3.gets, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
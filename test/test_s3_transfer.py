@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+import hashlib
+import io
+import threading
+import unittest
+from urllib.parse import parse_qs, unquote, urlsplit
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from protocol.datazipper import DataZipper
+
+
+class _Raw(io.BytesIO):
+    def stream(self, amt=1024, decode_content=None):
+        return iter(lambda: self.read(amt), b'')
+
+
+class LocalS3(object):
+    """
+    An S3 stand-in for a real boto3 resource: its requests are answered in process, from a dict,
+    instead of being sent. Knows the calls s3transfer makes for multipart uploads and ranged
+    downloads, and records every one.
+    """
+    def __init__(self):
+        self.objects = {}
+        self._uploads = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        session = boto3.session.Session(aws_access_key_id='local', aws_secret_access_key='local',
+                                        region_name='us-east-1')
+        config = {'s3': {'addressing_style': 'path'}}
+        try:
+            config = Config(request_checksum_calculation='when_required', **config)
+        except TypeError:
+            config = Config(**config)
+        self.resource = session.resource('s3', endpoint_url='http://s3.local', config=config)
+        self.resource.meta.client.meta.events.register('before-send.s3', self._handle)
+
+    def _handle(self, request, **kwargs):
+        url = urlsplit(request.url)
+        bucket, key = unquote(url.path).lstrip('/').split('/', 1)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        body = request.body.read() if hasattr(request.body, 'read') else (request.body or b'')
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = {k.lower(): (v.decode() if isinstance(v, bytes) else v) for k, v in request.headers.items()}
+        with self._lock:
+            status, response_headers, content = self._answer(request.method, bucket, key, query, headers, body)
+        response_headers.setdefault('content-length', str(len(content)))
+        return AWSResponse(request.url, status, response_headers, _Raw(content))
+
+    def _answer(self, method, bucket, key, query, headers, body):
+        if method == 'POST' and 'uploads' in query:
+            self.requests.append('create')
+            upload_id = str(len(self._uploads) + 1)
+            self._uploads[upload_id] = {}
+            return 200, {}, self._xml('InitiateMultipartUploadResult', Bucket=bucket, Key=key, UploadId=upload_id)
+        if method == 'PUT' and 'uploadId' in query:
+            self.requests.append('part')
+            self._uploads[query['uploadId']][int(query['partNumber'])] = body
+            return 200, {'etag': self._etag(body)}, b''
+        if method == 'POST' and 'uploadId' in query:
+            self.requests.append('complete')
+            parts = self._uploads.pop(query['uploadId'])
+            self.objects[(bucket, key)] = b''.join(parts[n] for n in sorted(parts))
+            return 200, {}, self._xml('CompleteMultipartUploadResult', Bucket=bucket, Key=key, ETag='"x"')
+        if method == 'DELETE' and 'uploadId' in query:
+            self._uploads.pop(query['uploadId'], None)
+            return 204, {}, b''
+        if method == 'PUT':
+            self.requests.append('put')
+            self.objects[(bucket, key)] = body
+            return 200, {'etag': self._etag(body)}, b''
+        stored = self.objects.get((bucket, key))
+        if stored is None:
+            return 404, {}, b'' if method == 'HEAD' else self._xml('Error', Code='NoSuchKey', Message='missing')
+        if method == 'HEAD':
+            self.requests.append('head')
+            return 200, {'etag': self._etag(stored), 'content-length': str(len(stored))}, b''
+        if 'range' in headers:
+            self.requests.append('range')
+            first, last = headers['range'].split('=')[1].split('-')
+            last = min(int(last or len(stored) - 1), len(stored) - 1)
+            content_range = 'bytes {}-{}/{}'.format(first, last, len(stored))
+            return 206, {'etag': self._etag(stored), 'content-range': content_range}, stored[int(first):last + 1]
+        self.requests.append('get')
+        return 200, {'etag': self._etag(stored)}, stored
+
+    @staticmethod
+    def _etag(body):
+        return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+    @staticmethod
+    def _xml(root, **fields):
+        inner = ''.join('<{0}>{1}</{0}>'.format(k, v) for k, v in fields.items())
+        return '<?xml version="1.0" encoding="UTF-8"?><{0}>{1}</{0}>'.format(root, inner).encode('utf-8')
+
+
+class TestS3Transfer(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = LocalS3()
+        saved = {name: getattr(DataZipper, name) for name in
+                 ('s3', 'transfer_threshold', 'part_size', 'concurrency', 'parallel_downloads')}
+        self.addCleanup(lambda: [setattr(DataZipper, name, value) for name, value in saved.items()])
+        DataZipper.s3 = self.s3.resource
+        DataZipper.stored.clear()
+        self.addCleanup(DataZipper.stored.clear)
+        # s3transfer won't make parts under 5 MB
+        DataZipper.transfer_threshold = DataZipper.part_size = 5 << 20
+        DataZipper.concurrency = 4
+        # not something zlib can do much with, so it's spilled in more than one part
+        self.text = "".join(hashlib.sha512(str(i).encode()).hexdigest() for i in range(100000))
+
+    def test_small(self):
+        text = self.text[:50000]
+        url = DataZipper.deliver(text, 1000)
+        self.assertEqual(self.s3.requests, ['put'])
+        self.assertEqual(DataZipper.receive(url), text)
+        self.assertEqual(self.s3.requests, ['put', 'get'])
+
+    def test_multipart(self):
+        url = DataZipper.deliver(self.text, 1000)
+        stored = self.s3.objects[(DataZipper.bucket, url.split(":", 3)[3].split("/", 3)[3])]
+        parts = -(-len(stored) // DataZipper.part_size)
+        self.assertGreater(parts, 1)
+        self.assertEqual(self.s3.requests, ['create'] + ['part'] * parts + ['complete'])
+        self.assertEqual(url.split(":")[1], hashlib.md5(stored).hexdigest())
+
+        self.s3.requests.clear()
+        self.assertEqual(DataZipper.receive(url), self.text)
+        self.assertEqual(self.s3.requests, ['get'])
+
+        DataZipper.parallel_downloads = True
+        for received in (DataZipper.receive(url), "".join(DataZipper.receive_stream(url)())):
+            self.assertEqual(received, self.text)
+        self.assertEqual(self.s3.requests, ['get'] + (['head'] + ['range'] * parts) * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,12 @@
 #!/usr/bin/python
 
+import datetime
+import json
+import importlib.util
+import array
 import unittest
 from protocol.schema import *
+from protocol.fulfillment_exception import FulfillmentValidationException
 from jsonschema import Draft4Validator
 
 
@@ -152,6 +157,285 @@ class TestSchema(unittest.TestCase):
         self.assertFalse(validator.is_valid(["one", "two"]))
         self.assertFalse(validator.is_valid({"one": "two"}))
 
+    def test_NumericArrayParameter(self):
+        inputs = [
+            [], [1, 2.5, True, -0.0, 1e300], (3, 4), [" 1.5 ", 2], [1.9, -1.9, 7], [10 ** 30, 2], [None, 1]
+        ]
+        for element in (FloatParameter("F"), IntParameter("I"), FloatParameter("F", default=0.5),
+                        IntParameter("I", required=False)):
+            for value in inputs:
+                try:
+                    expected = [element.parse(v) for v in value]
+                except Exception:
+                    self.assertRaises(Exception, lambda: ArrayParameter("A", element).parse(value))
+                    continue
+                parsed = ArrayParameter("A", element).parse(value)
+                self.assertEqual(parsed, expected)
+                self.assertEqual([type(v) for v in parsed], [type(v) for v in expected])
+
+        typed = ArrayParameter("A", IntParameter("I"), output="array").parse([1, True, "3"])
+        self.assertEqual((typed.typecode, typed.tolist()), ('q', [1, 1, 3]))
+        self.assertEqual(ArrayParameter("A", FloatParameter("F"), output="array").parse([1, 2]).typecode, 'd')
+        self.assertRaises(Exception, lambda: ArrayParameter("A", IntParameter("I", required=False), output="array").parse([None]))
+        self.assertRaises(Exception, lambda: ArrayParameter("A", StringParameter("S"), output="array"))
+        self.assertRaises(Exception, lambda: ArrayParameter("A", IntParameter("I"), output="tuple"))
+
+        # typed arrays parse back in, lists of them too
+        self.assertEqual(ArrayParameter("A", IntParameter("I"), output="array").parse(typed), typed)
+        self.assertEqual(ArrayParameter("A", FloatParameter("F")).parse(array.array('d', [1.5])), [1.5])
+        self.assertRaises(Exception, lambda: ArrayParameter("A", FloatParameter("F")).parse({1.5}))
+
+        # lists aren't bounds checked, just like the scalars they hold
+        self.assertEqual(FloatParameter("F", maximum=5).parse(6), 6.0)
+        self.assertEqual(ArrayParameter("A", FloatParameter("F", maximum=5)).parse([6]), [6.0])
+        bounded = ArrayParameter("A", FloatParameter("F", minimum=0.5, maximum=2), output="array")
+        self.assertEqual(bounded.parse([0.5, 2]).tolist(), [0.5, 2.0])
+        with self.assertRaises(Exception) as raised:
+            bounded.parse([1, 0.25, 3], "budgets")
+        self.assertEqual(str(raised.exception), "Exception while parsing budgets: Exception while parsing "
+                                                "budgets[1/3]: 0.25 is less than the minimum of 0.5")
+        with self.assertRaises(Exception) as raised:
+            bounded.parse(["1", "3"], "budgets")
+        self.assertIn("budgets[1/2]: 3.0 is greater than the maximum of 2.0", str(raised.exception))
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "numpy isn't installed")
+    def test_NumericArrayParameterNumpy(self):
+        parsed = ArrayParameter("A", FloatParameter("F"), output="numpy").parse([1, 2.5, "3"])
+        self.assertEqual((str(parsed.dtype), parsed.tolist()), ('float64', [1.0, 2.5, 3.0]))
+        parsed = ArrayParameter("A", IntParameter("I"), output="numpy").parse([1, 2])
+        self.assertEqual((str(parsed.dtype), parsed.tolist()), ('int64', [1, 2]))
+
+    def test_ParseErrorContext(self):
+        arr = ArrayParameter("Addresses", element=ObjectParameter("An address", properties={
+            "street": StringParameter("Street"),
+            "kind": EnumParameter("Kind", options=["home", "work"], default="home")
+        }))
+
+        with self.assertRaises(Exception) as raised:
+            arr.parse([{"street": "Main"}, {"street": "Elm", "kind": "boat"}], "addresses")
+        self.assertEqual(str(raised.exception),
+                         "Exception while parsing addresses: "
+                         "Exception while parsing addresses[1/2]: "
+                         "Exception while parsing addresses[1/2][kind]: boat is not a valid value for Enum!")
+
+        with self.assertRaises(Exception) as raised:
+            arr.parse([{"street": "Main"}, {}], "addresses")
+        self.assertEqual(str(raised.exception),
+                         "Exception while parsing addresses: "
+                         "Exception while parsing addresses[1/2]: "
+                         "addresses[1/2][street]-Missing required parameter (description: Street)")
+
+        dobj = ObjectParameter("Bad default", properties={
+            "count": IntParameter("A count", default="many")
+        }, default={})
+
+        with self.assertRaises(Exception) as raised:
+            dobj.parse(None, "counts")
+        self.assertEqual(str(raised.exception),
+                         "Exception while parsing counts/-default-/: "
+                         "Exception while parsing counts/-default-/[count]/-default-/: "
+                         "invalid literal for int() with base 10: 'many'")
+
+    def test_SchemaCache(self):
+        child = StringParameter("Uno")
+        obj = ObjectParameter("Erbjerct", properties={"one": child})
+
+        obj_schema = obj.to_schema()
+        self.assertIs(obj.to_schema(), obj_schema)
+        self.assertIs(obj.to_schema(True)['properties']['one'], child.to_schema())
+        self.assertRaises(TypeError, lambda: obj_schema.update({'type': 'string'}))
+        self.assertRaises(TypeError, lambda: obj_schema['required'].append('two'))
+        self.assertEqual(json.loads(json.dumps(obj_schema)), obj_schema)
+
+        child.required = False
+        self.assertIsNot(obj.to_schema(), obj_schema)
+        self.assertEqual(obj.to_schema()['properties']['one']['type'], ['null', 'string'])
+
+    def test_LazyObjectParameter(self):
+        def address(lazy):
+            return ObjectParameter("An address", lazy=lazy, properties={
+                "street": StringParameter("Street"),
+                "kind": EnumParameter("Kind", options=["home", "work"], default="home"),
+                "note": StringParameter("Note", required=False),
+                "geo": ObjectParameter("Geo", lazy=lazy, properties={"lat": FloatParameter("Lat")}),
+                "history": ArrayParameter("History", ObjectParameter("Old", lazy=lazy, properties={
+                    "kind": EnumParameter("Kind", options=["home", "work"])
+                }), required=False)
+            })
+        value = {"street": " Main ", "geo": {"lat": "43.6"}, "history": [{"kind": "work"}], "extra": 1}
+
+        lazy = address(True).parse(value, "address")
+        self.assertIsInstance(lazy, LazyObject)
+        self.assertEqual(lazy, address(False).parse(value, "address"))
+        self.assertEqual(lazy.to_dict(), address(False).parse(value, "address"))
+        self.assertEqual(sorted(lazy), ["geo", "history", "kind", "street"])
+        self.assertIs(lazy["geo"], lazy["geo"])
+        self.assertEqual(lazy["geo"]["lat"], 43.6)
+        self.assertNotIn("note", lazy)
+        self.assertRaises(KeyError, lambda: lazy["extra"])
+
+        # nothing is parsed until it's read, and errors carry the path of what was read
+        broken = address(True).parse({"street": "Main", "kind": "boat", "geo": {"lat": "north"},
+                                      "history": [{"kind": "work"}, {"kind": "boat"}]}, "address")
+        self.assertEqual(broken["street"], "Main")
+        with self.assertRaises(FulfillmentValidationException) as raised:
+            broken["kind"]
+        self.assertEqual(str(raised.exception),
+                         "Error parsing parameter 'address': Exception while parsing address: "
+                         "Exception while parsing address[kind]: boat is not a valid value for Enum!")
+        with self.assertRaises(FulfillmentValidationException) as raised:
+            broken["geo"]["lat"]
+        self.assertIn("Exception while parsing address[geo][lat]: could not convert", str(raised.exception))
+        self.assertEqual(broken["history"][0]["kind"], "work")
+        with self.assertRaises(FulfillmentValidationException) as raised:
+            broken["history"][1]["kind"]
+        self.assertIn("Error parsing parameter 'address[history][1/2]'", str(raised.exception))
+
+        # lazy objects under eager ones, directly, in arrays and in records, know where they are too
+        def kinds(output):
+            return ObjectParameter("Kinds", output=output, properties={
+                "one": ObjectParameter("One", lazy=True, properties={"kind": EnumParameter("Kind", options=["a"])}),
+                "many": ArrayParameter("Many", ObjectParameter("Rows", properties={
+                    "row": ObjectParameter("Row", lazy=True, properties={"kind": EnumParameter("Kind", options=["a"])})
+                }))
+            })
+        value = {"one": {"kind": "b"}, "many": [{"row": {"kind": "a"}}, {"row": {"kind": "b"}}]}
+        for output in ("dict", "record"):
+            for in_place in (False, True):
+                outer = kinds(output).parse(json.loads(json.dumps(value)), "outer", in_place)
+                with self.assertRaises(FulfillmentValidationException) as raised:
+                    outer["one"]["kind"]
+                self.assertIn("Exception while parsing outer[one][kind]: b is not", str(raised.exception))
+                self.assertEqual(outer["many"][0]["row"]["kind"], "a")
+                with self.assertRaises(FulfillmentValidationException) as raised:
+                    outer["many"][1]["row"]["kind"]
+                self.assertIn("Error parsing parameter 'outer[many][1/2][row]'", str(raised.exception))
+
+    def test_RecordOutput(self):
+        def location(output):
+            return ObjectParameter("A location", output=output, properties={
+                "locationId": IntParameter("Id"),
+                "name": StringParameter("Name"),
+                "note": StringParameter("Note", required=False),
+                "geo": ObjectParameter("Geo", output=output, properties={"lat": FloatParameter("Lat")}),
+                "tags": ArrayParameter("Tags", StringParameter("Tag"), required=False, default=["x"])
+            })
+        value = {"locationId": 1, "name": " Main ", "geo": {"lat": "43.5"}, "extra": True}
+        record = location("record").parse(value, "location", in_place=True)
+        self.assertIsInstance(record, Record)
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertEqual((record.locationId, record.name, record.note, record.geo.lat), (1, "Main", None, 43.5))
+        self.assertEqual(record["tags"], ["x"])
+        self.assertEqual(record.get("note", "-"), "-")
+        self.assertRaises(KeyError, lambda: record["note"])
+        self.assertRaises(KeyError, lambda: record["extra"])
+
+        as_dict = location("dict").parse(value, "location")
+        self.assertEqual(record.to_json(), as_dict)
+        self.assertEqual(record, as_dict)
+        self.assertIs(type(record), type(location("record").parse(value)))
+        # records go back through parse, and so parse_result, as the dicts they stand for
+        self.assertEqual(ObjectResult("Out", properties=location("dict").properties).parse(record), as_dict)
+        self.assertEqual(ArrayParameter("All", location("record")).parse([record, value]), [record, record])
+
+        with self.assertRaises(Exception) as raised:
+            location("record").parse(dict(value, geo={}), "location")
+        self.assertIn("location[geo][lat]-Missing", str(raised.exception))
+        self.assertRaises(Exception, lambda: ObjectParameter("O", output="record", properties={"a-b": IntParameter("I")}))
+        self.assertRaises(Exception, lambda: ObjectParameter("O", output="record", lazy=True, properties={}))
+        self.assertEqual(ObjectParameter("O", output="record", properties={}).parse({}).to_json(), {})
+
+    def test_InPlaceParse(self):
+        tags = ["x"]
+        param = ObjectParameter("An address", properties={
+            "street": StringParameter("Street"),
+            "note": StringParameter("Note", required=False),
+            "tags": ArrayParameter("Tags", StringParameter("Tag"), required=False, default=tags),
+            "geo": ObjectParameter("Geo", properties={"lat": FloatParameter("Lat")}),
+            "rooms": ArrayParameter("Rooms", ObjectParameter("Room", properties={"size": IntParameter("Size")}))
+        })
+
+        def value():
+            return {"street": " Main ", "note": None, "geo": {"lat": "43.6"},
+                    "rooms": [{"size": "1", "extra": True}, {"size": 2}], "extra": 1}
+
+        raw = value()
+        geo, rooms, room = raw["geo"], raw["rooms"], raw["rooms"][0]
+        parsed = param.parse(raw, "address", in_place=True)
+        self.assertEqual(parsed, param.parse(value(), "address"))
+        self.assertIs(parsed, raw)
+        self.assertIs(parsed["geo"], geo)
+        self.assertIs(parsed["rooms"], rooms)
+        self.assertIs(parsed["rooms"][0], room)
+        self.assertEqual(room, {"size": 1})
+        self.assertNotIn("note", parsed)
+        self.assertNotIn("extra", parsed)
+        # defaults are copied, never handed out to be changed
+        self.assertIsNot(parsed["tags"], tags)
+        self.assertEqual(tags, ["x"])
+
+        broken = value()
+        broken["rooms"][1]["size"] = "big"
+        with self.assertRaises(Exception) as copied:
+            param.parse(broken, "address")
+        with self.assertRaises(Exception) as in_place:
+            param.parse(broken, "address", in_place=True)
+        self.assertEqual(str(in_place.exception), str(copied.exception))
+        self.assertIn("address[rooms][1/2][size]", str(in_place.exception))
+
+    def test_SharedSchemas(self):
+        first = UuidParameter("Location id")
+        second = UuidParameter("Location id")
+        self.assertRaises(AttributeError, lambda: setattr(first, 'extra', 1))
+        self.assertIs(first.to_schema(), second.to_schema())
+        self.assertIsNot(UuidParameter("Other id").to_schema(), first.to_schema())
+        self.assertIsNot(IntParameter("N", minimum=1).to_schema()['minimum'],
+                         FloatParameter("N", minimum=1).to_schema()['minimum'])
+
+        one = ObjectParameter("Obj", properties={"a": first, "b": NaiveIsoDateParameter("Start")})
+        two = ObjectParameter("Obj", properties={"a": second, "b": NaiveIsoDateParameter("Start")})
+        self.assertIs(one.to_schema(), two.to_schema())
+
+        second.required = False
+        self.assertIsNot(one.to_schema(), two.to_schema())
+        self.assertEqual(one.to_schema()['required'], ['a', 'b'])
+        self.assertEqual(two.to_schema()['properties']['a']['type'], ['null', 'string'])
+        self.assertEqual(two.to_schema()['required'], ['b'])
+        self.assertTrue(two.to_compiled_validator().is_valid({"b": "2020-01-02"}))
+        self.assertEqual(two.parse({"b": "2020-01-02"}), {"b": "2020-01-02"})
+
+        # defaults are compared by value and type, never by equality alone
+        self.assertIsNot(JsonParameter("J", default=[1]).to_schema(), JsonParameter("J", default=[True]).to_schema())
+
+    def test_SchemaFootprint(self):
+        date = NaiveIsoDateParameter("Start date")
+        params = {"a": date, "b": NaiveIsoDateParameter("Start date"), "c": ArrayParameter("Dates", date)}
+        report = schema_footprint(*params.values())
+        self.assertEqual(report['nodes'], 3)
+        self.assertEqual(report['fragments'], 2)
+        self.assertGreater(report['fragment_references'], report['fragments'])
+        self.assertEqual(report['total_bytes'], report['node_bytes'] + report['schema_bytes'])
+        self.assertEqual(schema_footprint(*params.values()), report)
+
+    def test_SchemaExamples(self):
+        bad = ObjectParameter("Bad example", properties={
+            "one": StringParameter("Uno", example=1)
+        })
+        self.assertRaises(Exception, bad.to_schema)
+
+        SchemaParameter.validate_examples = False
+        try:
+            bad = ObjectParameter("Bad example", properties={
+                "one": StringParameter("Uno", example=1)
+            })
+            bad.to_schema()
+        finally:
+            SchemaParameter.validate_examples = True
+        self.assertRaises(Exception, bad.check_examples)
+
+        good = ArrayParameter("Good example", element=StringParameter("Uno", example="one"), example=["one"])
+        good.check_examples()
+
     def test_EnumParameter(self):
         req = EnumParameter("some options!", options=["fish", "cheese", "apple"])
         s = req.to_schema(True)
@@ -190,6 +474,46 @@ class TestSchema(unittest.TestCase):
         self.assertFalse(validator.is_valid(15))
         self.assertFalse(validator.is_valid(None))
 
+    def test_DateParameters(self):
+        # the schema doesn't change with the output, and has no RFC 3339 format the values might not meet
+        local = LocalIsoDateTimeParameter("When", output="datetime")
+        self.assertIs(local.to_schema(), LocalIsoDateTimeParameter("When").to_schema())
+        self.assertIn('pattern', local.to_schema())
+        self.assertNotIn('format', local.to_schema())
+        self.assertEqual(LocalIsoDateTimeParameter("When").parse(" 2020-01-02T10:00:00 "), "2020-01-02T10:00:00")
+
+        expected = {
+            "2020-01-02T10:00:00": datetime.datetime(2020, 1, 2, 10),
+            "2020-01-02 10:00:00.123": datetime.datetime(2020, 1, 2, 10, 0, 0, 123000),
+            "20200102T100000,5": datetime.datetime(2020, 1, 2, 10, 0, 0, 500000),
+            "2020-W01-4T10:00:00": datetime.datetime(2020, 1, 2, 10),
+            "2020-002T23:59:59": datetime.datetime(2020, 1, 2, 23, 59, 59),
+        }
+        for text, value in expected.items():
+            self.assertEqual(local.parse(text), value)
+            self.assertEqual(local.parse(text), local.parse(text))
+        for text in ("2020-01-02", "2020-01-02T10:00", "2020-02-30T10:00:00", "2020-01-02T10:00:00Z", "soon"):
+            self.assertRaises(Exception, lambda: local.parse(text))
+
+        day = NaiveIsoDateParameter("Day", output="datetime")
+        self.assertIs(day.to_schema(), NaiveIsoDateParameter("Day").to_schema())
+        for text in ("2020-01-02", "20200102", "2020-W01-4", "2020-002"):
+            self.assertEqual(day.parse(text), datetime.date(2020, 1, 2))
+        self.assertRaises(Exception, lambda: day.parse("2020-01-02T10:00:00"))
+
+        iso = IsoDateParameter("At", output="datetime", required=False, default="2020-01-02")
+        utc = datetime.timezone.utc
+        self.assertEqual(iso.parse(None), datetime.datetime(2020, 1, 2))
+        self.assertEqual(iso.parse("2020-01-02T10:00:00Z"), datetime.datetime(2020, 1, 2, 10, tzinfo=utc))
+        self.assertEqual(iso.parse("2020-01-02T12:30:00+02:30"), datetime.datetime(2020, 1, 2, 10, tzinfo=utc))
+        self.assertEqual(iso.parse("2020-01-02T24:00"), datetime.datetime(2020, 1, 3))
+        self.assertEqual(iso.parse("2020-01-02T12:30-0230").utcoffset(), -datetime.timedelta(hours=2, minutes=30))
+
+        schedule = ArrayParameter("Schedule", local).parse(["2020-01-02T10:00:00"] * 3)
+        self.assertEqual(schedule, [datetime.datetime(2020, 1, 2, 10)] * 3)
+        self.assertIs(schedule[0], schedule[2])
+        self.assertRaises(Exception, lambda: IsoDateParameter("At", output="arrow"))
+
     def test_UuidParameter(self):
         req = UuidParameter("02ef139a-417a-4328-9953-5996b9f36dae")
         s = req.to_schema(True)
@@ -240,6 +564,45 @@ class TestSchema(unittest.TestCase):
             print([c.message for c in e.context])
         return True
 
+    def test_OneOfDispatch(self):
+        options = (
+            EnumParameter("Kind", options=["zip", "radius"]),
+            ObjectParameter("Zip target", properties={
+                "zip": StringParameter("Zip"),
+                "name": StringParameter("Name", required=False)
+            }),
+            ObjectParameter("Radius target", properties={
+                "lat": FloatParameter("Latitude"),
+                "lon": FloatParameter("Longitude"),
+                "miles": IntParameter("Miles", default=5)
+            }),
+            LooseObjectParameter("Anything keyed", value_type=StringParameter("Value")),
+            ArrayParameter("Zips", element=StringParameter("Zip")),
+            BooleanParameter("Everywhere"),
+            FloatParameter("Budget"),
+            StringParameter("Free text"),
+        )
+
+        def try_all(value):
+            for option in options:
+                try:
+                    val = option.parse(value)
+                    if val is not None:
+                        return val
+                except Exception:
+                    pass
+            return False
+
+        union = OneOfParameter("Targets", options=options)
+        values = ["zip", " radius ", "anywhere", "1.5", 3, 2.5, True, False, [], ["83702"], ("83702",),
+                  {"zip": "83702"}, {"zip": None, "lat": 1.0, "lon": 2}, {"lat": "x", "lon": 2.0}, {"k": "v"},
+                  {"k": 1}, {}, b"zip"]
+        for value in values:
+            self.assertEqual(union.parse(value), try_all(value), value)
+
+        options[2].properties["lon"].required = False
+        self.assertEqual(union.parse({"lat": 1.0}), {"lat": 1.0, "miles": 5})
+
     def test_AnyOfParameter(self):
         req = AnyOfParameter("Any of these things could be valid!", options=(
             ArrayParameter("A list of junk", StringParameter("A String", min_length=5)),
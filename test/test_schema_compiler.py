@@ -0,0 +1,210 @@
+#!/usr/bin/python
+
+import unittest
+from protocol.schema import *
+from protocol.schema_compiler import CompiledValidator
+from protocol.param_validator import ParamValidator
+from jsonschema import Draft4Validator
+
+UUID = "02ef139a-417a-4328-9953-5996b9f36dae"
+
+ADDRESS = ObjectParameter("An address", properties={
+    "street": StringParameter("Street", min_length=3, max_length=40),
+    "zip": StringParameter("Zip", pattern=r"^\d{5}$", required=False),
+    "kind": EnumParameter("Kind", options=["home", "work"], required=False, default="home")
+})
+
+PARAMETERS = {
+    "id": UuidParameter("The id"),
+    "name": StringParameter("A name", required=False),
+    "count": IntParameter("A count", minimum=1, maximum=10, required=False),
+    "ratio": FloatParameter("A ratio", minimum=0.5, maximum=2.5, required=False),
+    "flag": BooleanParameter("A flag", required=False),
+    "uri": UriParameter("Somewhere", required=False),
+    "when": LocalIsoDateTimeParameter("When", required=False),
+    "address": ADDRESS,
+    "others": ArrayParameter("More addresses", element=ADDRESS, min_items=1, max_items=3, required=False),
+    "tags": ArrayParameter("Tags", element=StringParameter("Tag"), unique=True, required=False),
+    "lookup": LooseObjectParameter("Lookup", value_type=IntParameter("Value"), key_regex="^[a-z]+$", required=False),
+    "strings": StringMapParameter("String map", required=False),
+    "either": OneOfParameter("Either", options=(
+        ArrayParameter("A list of junk", StringParameter("A String", min_length=5)),
+        IntParameter("Some number")
+    ), required=False),
+    "any": AnyOfParameter("Any", options=(
+        StringParameter("Short", max_length=2),
+        StringParameter("Long", min_length=5)
+    ), required=False),
+    "json": JsonParameter("Anything", required=False)
+}
+
+VALID = {
+    "id": UUID,
+    "address": {"street": "Main St."}
+}
+
+INSTANCES = [
+    VALID,
+    dict(VALID, name="fish", count=3, ratio=1.5, flag=True, uri="http://a.b", when="2017-01-01T10:00"),
+    dict(VALID, others=[{"street": "Elm St.", "zip": "83702", "kind": "work"}], tags=["a", "b"]),
+    dict(VALID, lookup={"abc": 1, "def": 2}, strings={"a": "b"}, either=["hello"], json=[1, {"a": None}]),
+    dict(VALID, either=12, any="ab"),
+    dict(VALID, any="abcdef"),
+    {},
+    None,
+    [],
+    "a string",
+    dict(VALID, id="not a uuid"),
+    dict(VALID, id=12345),
+    dict(VALID, name=1, count=0, ratio=3.0, flag="yes"),
+    dict(VALID, count=True, ratio=False),
+    dict(VALID, count=1.5, ratio="1.5"),
+    dict(VALID, address={"zip": "1234", "kind": "boat"}),
+    dict(VALID, address={"street": "ab", "zip": 83702}),
+    dict(VALID, address={"street": "x" * 41, "kind": None}),
+    dict(VALID, address=[]),
+    dict(VALID, others=[]),
+    dict(VALID, others=[{"street": "Elm St."}] * 4),
+    dict(VALID, others=[{"street": "Elm St."}, {"street": 1}, {}, 5]),
+    dict(VALID, tags=["a", "a"]),
+    dict(VALID, tags=[1, True, 1.0]),
+    dict(VALID, lookup={}),
+    dict(VALID, lookup={"abc": "x", "ABC": 1, "1": 2}),
+    dict(VALID, lookup={"ABC": 1}),
+    dict(VALID, strings={"a": 1, "b": "c", "c": None}),
+    dict(VALID, either="hello"),
+    dict(VALID, either=["hello", 1]),
+    dict(VALID, either=1.2345),
+    dict(VALID, either=True),
+    dict(VALID, any="abc"),
+    dict(VALID, any=5),
+    dict(VALID, when="yesterday"),
+    dict(VALID, json=None, uri=""),
+]
+
+
+def flatten(error):
+    return (
+        error.message,
+        list(error.path),
+        list(error.absolute_path),
+        list(error.schema_path),
+        error.validator,
+        error.validator_value,
+        error.instance,
+        error.cause,
+        [flatten(c) for c in error.context]
+    )
+
+
+class TestSchemaCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+    def assertConforms(self, schema, instances):
+        draft4 = Draft4Validator(schema)
+        compiled = CompiledValidator(schema)
+        for instance in instances:
+            self.assertEqual(compiled.is_valid(instance), draft4.is_valid(instance), instance)
+            self.assertEqual([flatten(e) for e in compiled.iter_errors(instance)],
+                             [flatten(e) for e in draft4.iter_errors(instance)], instance)
+
+    def test_conformance(self):
+        self.assertConforms(ObjectParameter("", properties=PARAMETERS).to_schema(True), INSTANCES)
+
+    def test_conformance_leaf(self):
+        values = [None, "", " fish ", "fishsticks", 1, 1.5, True, [], {}]
+        for param in PARAMETERS.values():
+            self.assertConforms(param.to_schema(), values)
+        self.assertConforms(StringParameter("Beta", min_length=5, max_length=10, default="honey").to_schema(), values)
+        self.assertConforms(EnumParameter("Mixed", options=["one", 2, None]).to_schema(), values + [2.0, "one"])
+
+    def test_conformance_keywords(self):
+        schema = {
+            'description': 'Not produced by our parameters, but handled the same way',
+            'allOf': [{'minimum': 2}, {'maximum': 5, 'exclusiveMaximum': True}],
+            'not': {'enum': [3]},
+            'multipleOf': 0.5
+        }
+        self.assertConforms(schema, [1, 2, 2.5, 3, 4.75, 5, "x", None])
+
+        schema = {'type': 'array', 'items': [{'type': 'string'}, {'type': 'integer'}], 'minItems': 1}
+        self.assertConforms(schema, [[], ["a"], ["a", 1, None], [1, "a"], {}])
+
+        schema = {'type': 'object', 'properties': {'a': {'type': 'string'}}, 'additionalProperties': False,
+                  'maxProperties': 1, 'required': ['a', 'b']}
+        self.assertConforms(schema, [{}, {'a': 'x'}, {'a': 'x', 'c': 1, 'd': 2}, {'c': 1}])
+
+        schema = {'type': 'object', 'properties': {}, 'required': [], 'patternProperties': {},
+                  'items': [], 'description': 'Nothing to check inside'}
+        self.assertConforms(schema, [{}, {'a': 1}, [], None])
+
+    def test_count_errors(self):
+        # the errors iter_errors would yield after the first few, by place, without building them
+        for schema, instances in ((ObjectParameter("", properties=PARAMETERS).to_schema(True), INSTANCES),
+                                  ({'allOf': [{'minimum': 2}], 'not': {'enum': [3]}}, [1, 3]),
+                                  ({'type': 'array', 'items': [{'type': 'string'}, {'type': 'integer'}]}, [[1, "a"]])):
+            compiled = CompiledValidator(schema)
+            for instance in instances:
+                for skip in (0, 1, 3):
+                    expected = {}
+                    for e in list(compiled.iter_errors(instance))[skip:]:
+                        place = ("/".join(["in"] + ['*' if isinstance(p, int) else p for p in e.path]), e.validator)
+                        expected[place] = expected.get(place, 0) + 1
+                    self.assertEqual(list(compiled.count_errors(instance, ["in"], skip).items()), list(expected.items()))
+
+    def test_unsupported(self):
+        self.assertRaises(Exception, lambda: CompiledValidator({'$ref': '#/definitions/thing'}))
+        self.assertRaises(Exception, lambda: CompiledValidator({'type': 'any'}))
+
+    def test_validate(self):
+        validator = UuidParameter("The id").to_compiled_validator()
+        validator.validate(UUID)
+        self.assertRaises(Exception, lambda: validator.validate("123-ABC"))
+
+    def test_param_validator(self):
+        validator = ParamValidator(PARAMETERS)
+        self.assertEqual(validator.validate(VALID), [])
+
+        errors = validator.validate(dict(VALID, count=0, address={"zip": "1234"}))
+        self.assertEqual([(e['message'], e['path'], e['validator']) for e in errors], [
+            ('0 is less than the minimum of 1', 'count', 'minimum'),
+            ("'1234' does not match '^\\\\d{5}$'", 'address/zip', 'pattern'),
+            ("'street' is a required property", 'address', 'required')
+        ])
+
+    def test_error_budget(self):
+        rows = {"rows": ArrayParameter("Rows", ObjectParameter("Row", properties={
+            "id": IntParameter("Id", minimum=1),
+            "name": StringParameter("Name")
+        }))}
+        event = {"rows": [{"id": 0} for _ in range(50)]}
+        self.assertEqual(len(ParamValidator(rows).validate(event)), 100)
+
+        errors = ParamValidator(rows, max_errors=3).validate(event)
+        self.assertEqual([(e['path'], e['validator'], e['validator_value']) for e in errors], [
+            ('rows/0/id', 'minimum', 1),
+            ('rows/0', 'required', ['id', 'name']),
+            ('rows/1/id', 'minimum', 1),
+            ('rows/*', 'maxErrors', 49),
+            ('rows/*/id', 'maxErrors', 48)
+        ])
+        self.assertEqual(errors[4]['message'], "48 more 'minimum' error(s) at 'rows/*/id'")
+        self.assertEqual(ParamValidator.count(errors), 100)
+
+        # elements collected one at a time, as a stream does, are only counted once the budget is full
+        budget = ParamValidator(rows, max_errors=1).budget()
+        element = CompiledValidator(rows["rows"].element.to_schema())
+        for i, row in enumerate(event["rows"]):
+            budget.collect(element, row, ("rows", i))
+        self.assertEqual([(e['path'], e['validator_value']) for e in budget.errors()],
+                         [('rows/0/id', 1), ('rows/*', 50), ('rows/*/id', 49)])
+
+        errors = ParamValidator(rows, fail_fast=True).validate(event)
+        self.assertEqual([e['path'] for e in errors], ['rows/0/id'])
+        self.assertEqual(ParamValidator(rows, fail_fast=True).validate({"rows": []}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()